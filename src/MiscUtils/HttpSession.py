@@ -4,9 +4,20 @@ __author__      = "Graham Klyne (GK@ACM.ORG)"
 __copyright__   = "Copyright 2011-2013, University of Oxford"
 __license__     = "MIT (http://opensource.org/licenses/MIT)"
 
+import os
+import stat
 import re   # Used for link header parsing
+import json
+import glob
+import hashlib
+import tempfile
+import email.utils
 import httplib
 import urlparse
+import socket
+import select
+import threading
+import time
 import rdflib
 import logging
 
@@ -24,6 +35,15 @@ RDF_CONTENT_TYPES = (
 
 ACCEPT_RDF_CONTENT_TYPES = "application/rdf+xml, text/turtle"
 
+POOL_MAX_IDLE   = 4         # Maximum idle connections kept for each scheme, host and port
+POOL_IDLE_TIME  = 30        # Seconds after which an idle connection is closed
+CHUNK_SIZE      = 64*1024   # Size of blocks read from a file-like request body
+
+CACHE_MAX_SIZE  = 256*1024*1024     # Bytes of responses kept in an on-disk cache
+CACHE_MAX_AGE   = 30*24*3600        # Seconds after which an unused stored response is discarded
+CACHE_PRUNE_INTERVAL = 3600         # Minimum seconds between checks of on-disk cache size
+CACHE_PRUNE_STORES   = 100          # Number of responses stored between checks of cache size
+
 def splitValues(txt, sep=",", lq='"<', rq='">'):
     """
     Helper function returns list of delimited values in a string,
@@ -127,6 +147,568 @@ class HTTP_Error(Exception):
                  (repr(self._msg), repr(self._value), repr(self._uri)))
 
 
+# Pool of persistent HTTP connections shared by HTTP sessions
+
+class HTTP_ConnectionPool(object):
+
+    """
+    Pool of persistent (keep-alive) HTTP and HTTPS connections, kept separately for
+    each scheme, host and port.
+
+    A connection is checked out of the pool for the duration of a single request,
+    and returned when the response has been read, so a pool may be shared by
+    sessions used in different threads.  Connections that have been idle for
+    longer than idletime seconds are closed rather than reused.
+
+    If a rate limit is set, requests to each scheme, host and port are delayed
+    as needed so that no more than that number of requests per second are sent.
+    """
+
+    def __init__(self, maxidle=POOL_MAX_IDLE, idletime=POOL_IDLE_TIME, timeout=None,
+            ratelimit=None):
+        self._maxidle  = maxidle
+        self._idletime = idletime
+        self._timeout  = timeout
+        self._lock     = threading.Lock()
+        self._idle     = {}     # (scheme, netloc) -> list of [connection, time released]
+        self._ratelimit = ratelimit
+        self._nextsend  = {}    # (scheme, netloc) -> earliest time for next request
+        return
+
+    def setRateLimit(self, ratelimit):
+        """
+        Set maximum number of requests per second sent to any one scheme, host and
+        port, or None (or 0) for no limit.  This applies to all sessions using
+        the pool.
+        """
+        with self._lock:
+            self._ratelimit = ratelimit
+            self._nextsend  = {}
+        return
+
+    def _throttle(self, scheme, netloc):
+        """
+        Wait until a request may be sent to the indicated scheme and host:port
+        within the rate limit.  Each caller is allocated the next available time
+        slot, so concurrent requests are spaced out rather than sent together.
+        """
+        if not self._ratelimit: return
+        key = self._key(scheme, netloc)
+        with self._lock:
+            now  = time.time()
+            send = max(now, self._nextsend.get(key, 0))
+            self._nextsend[key] = send + 1.0/self._ratelimit
+        if send > now:
+            time.sleep(send-now)
+        return
+
+    def _key(self, scheme, netloc):
+        return ((scheme or "http").lower(), netloc.lower())
+
+    def getConnection(self, scheme, netloc, timeout=None):
+        """
+        Check out a connection for the indicated scheme and host:port, reusing an
+        idle connection if one is available.
+
+        Returns a pair (connection, reused), where reused is True if the connection
+        was previously used for other requests.
+        """
+        key  = self._key(scheme, netloc)
+        con  = None
+        now  = time.time()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle and con is None:
+                (c, released) = idle.pop()
+                if now-released <= self._idletime and not _isConnectionDropped(c):
+                    con = c
+                else:
+                    c.close()
+        reused = con is not None
+        if con is None:
+            if key[0] == "https":
+                con = httplib.HTTPSConnection(netloc)
+            else:
+                con = httplib.HTTPConnection(netloc)
+        con.timeout = timeout or self._timeout or socket.getdefaulttimeout()
+        if con.sock:
+            con.sock.settimeout(con.timeout)
+        return (con, reused)
+
+    def releaseConnection(self, scheme, netloc, con):
+        """
+        Return a connection to the pool after the response to a request has been read.
+        """
+        key = self._key(scheme, netloc)
+        now = time.time()
+        with self._lock:
+            idle = [ i for i in self._idle.get(key, []) if now-i[1] <= self._idletime ]
+            if len(idle) < self._maxidle:
+                idle.append([con, now])
+                con = None
+            self._idle[key] = idle
+        if con:
+            con.close()
+        return
+
+    def request(self, scheme, netloc, method, path, body=None, headers={}, timeout=None,
+            outfile=None, progress=None):
+        """
+        Issue a request using a pooled connection, and read the response.
+
+        The request body may be a string, a file-like object or an iterator over
+        strings (see _sendRequest).  If a reused connection turns out to have been
+        closed by the server, the request is retried once using a new connection
+        (unless the request body is a stream, which cannot be sent again).
+
+        If outfile is supplied, the body of a successful (2xx) response is copied
+        to it in blocks (see _copyResponse), rather than being read into memory.
+
+        Returns a pair (response, data), where data is the response body, or the
+        number of bytes copied to outfile.
+        """
+        while True:
+            self._throttle(scheme, netloc)
+            (con, reused) = self.getConnection(scheme, netloc, timeout=timeout)
+            response = None
+            try:
+                _sendRequest(con, method, path, body, headers)
+                response = con.getresponse()
+                if outfile is not None and 200 <= response.status < 300:
+                    data = _copyResponse(response, outfile, progress)
+                else:
+                    data = response.read()
+            except socket.timeout:
+                con.close()
+                raise
+            except (httplib.BadStatusLine, httplib.CannotSendRequest, socket.error), e:
+                con.close()
+                if ( reused and response is None and
+                     (body is None or isinstance(body, basestring)) ):
+                    log.debug("HTTP_ConnectionPool.request: retry %s %s after %r"%(method, path, e))
+                    continue
+                raise
+            except:
+                con.close()
+                raise
+            self.releaseConnection(scheme, netloc, con)
+            return (response, data)
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for cons in idle.itervalues():
+            for (con, _) in cons:
+                con.close()
+        return
+
+def _sendRequest(con, method, path, body, headers):
+    """
+    Send request on an HTTP connection.  A string body or a regular file body
+    is sent with a Content-Length header (httplib sends a file in blocks as it
+    is read).  Any other file-like object, or an iterator over strings, is sent
+    using chunked transfer encoding as it is read.
+    """
+    if body is None or isinstance(body, basestring) or _isRegularFile(body):
+        con.request(method, path, body, headers)
+        return
+    con.putrequest(method, path)
+    for (h, v) in headers.iteritems():
+        con.putheader(h, v)
+    con.putheader("Transfer-Encoding", "chunked")
+    con.endheaders()
+    blocks = body
+    if hasattr(body, "read"):
+        blocks = iter(lambda: body.read(CHUNK_SIZE), "")
+    for data in blocks:
+        if data:
+            con.send("%x\r\n%s\r\n"%(len(data), data))
+    con.send("0\r\n\r\n")
+    return
+
+def _copyResponse(response, outfile, progress=None):
+    """
+    Copy response body to a file in blocks.  If supplied, progress is called
+    after each block as progress(bytes copied, content length or None).
+
+    Returns the number of bytes copied.
+    """
+    length = response.getheader("content-length", "")
+    length = int(length) if length.isdigit() else None
+    size   = 0
+    while True:
+        data = response.read(CHUNK_SIZE)
+        if not data: break
+        outfile.write(data)
+        size += len(data)
+        if progress:
+            progress(size, length)
+    if length is not None and size < length:
+        raise httplib.IncompleteRead("", length-size)
+    return size
+
+def _isRegularFile(body):
+    try:
+        return stat.S_ISREG(os.fstat(body.fileno()).st_mode)
+    except (AttributeError, OSError, ValueError):
+        return False
+
+def _isConnectionDropped(con):
+    """
+    Test if an idle connection has been closed by the server: an idle connection
+    should have nothing to read, so a readable socket indicates end of file (or
+    unexpected data that would confuse the next response).
+    """
+    if con.sock is None:
+        return False
+    try:
+        return bool(select.select([con.sock], [], [], 0)[0])
+    except (select.error, socket.error, ValueError):
+        return True
+
+# Connection pool used by HTTP sessions that are not given a pool
+_connectionpool = HTTP_ConnectionPool()
+
+def getConnectionPool():
+    """
+    Return connection pool shared by HTTP sessions
+    """
+    return _connectionpool
+
+# On-disk cache of HTTP responses, with revalidation
+
+class HTTP_Cache(object):
+
+    """
+    On-disk cache of responses to HTTP GET requests, keyed by URI, accept header
+    and the credential (authorization header) used, so a response obtained using
+    one credential is never returned for a request using another.
+
+    Responses are stored if they carry a validator (ETag or Last-Modified) or an
+    expiry time (Cache-Control max-age or Expires), and the response does not
+    specify Cache-Control no-store or private.  A stored response is used without contacting
+    the server until it expires; after that, a conditional request is issued using
+    the stored validators, and the stored body is used if the server responds
+    304 (Not Modified).
+
+    For RDF responses, the parsed graph is also saved (as N-Triples), so that an
+    unchanged body need not be parsed again from its original syntax.
+
+    Each URI has a directory named by the hash of the URI, containing for each
+    accept header value and credential a metadata file (.json), a response body
+    (.body), and possibly a parsed graph (-<body digest>.nt).  Only a hash of the
+    credential is stored.
+
+    The cache is pruned from time to time: responses not stored or revalidated for
+    maxage seconds are discarded, then the least recently stored responses until
+    the total size of the cache is no more than maxsize bytes.
+    """
+
+    def __init__(self, cachedir, maxsize=CACHE_MAX_SIZE, maxage=CACHE_MAX_AGE):
+        self._cachedir = cachedir
+        self._maxsize  = maxsize
+        self._maxage   = maxage
+        self._stores   = 0
+        self._lock     = threading.Lock()
+        self._checkPrune()
+        return
+
+    def _uridir(self, uri):
+        return os.path.join(self._cachedir, hashlib.sha1(str(uri)).hexdigest())
+
+    def _credentialkey(self, credential):
+        return hashlib.sha1(credential).hexdigest() if credential else ""
+
+    def _entryname(self, uri, accept, credential=None):
+        key = (accept or "") + "\n" + self._credentialkey(credential)
+        return os.path.join(self._uridir(uri), hashlib.sha1(key).hexdigest()[:16])
+
+    def _writeFile(self, filename, data):
+        # Write via temporary file and rename so readers never see a partial file
+        (fd, tmpname) = tempfile.mkstemp(dir=os.path.dirname(filename), prefix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.rename(tmpname, filename)
+        except:
+            os.remove(tmpname)
+            raise
+        return
+
+    def _expiry(self, headers, now):
+        """
+        Return time at which a response with the supplied headers expires, or None
+        if the response may not be stored.
+        """
+        cachecontrol = {}
+        for d in headers.get("cache-control", "").split(","):
+            (name, _, value) = d.strip().partition("=")
+            cachecontrol[name.strip().lower()] = value.strip().strip('"')
+        if "no-store" in cachecontrol or "private" in cachecontrol:
+            return None
+        expires = now
+        if "no-cache" in cachecontrol:
+            pass
+        elif cachecontrol.get("max-age", "").isdigit():
+            expires = now + int(cachecontrol["max-age"])
+        elif "expires" in headers:
+            exptime  = email.utils.parsedate_tz(headers["expires"])
+            datetime = email.utils.parsedate_tz(headers.get("date", ""))
+            if exptime:
+                # Apply difference between Expires and Date to allow for clock skew
+                expires = email.utils.mktime_tz(exptime)
+                if datetime:
+                    expires = now + expires - email.utils.mktime_tz(datetime)
+        if expires <= now and not ("etag" in headers or "last-modified" in headers):
+            return None
+        return expires
+
+    def lookup(self, uri, accept, credential=None):
+        """
+        Find a stored response for the given URI, accept header value and credential.
+
+        Returns a dictionary describing the stored response, or None.
+        """
+        entryname = self._entryname(uri, accept, credential)
+        try:
+            with open(entryname+".json", "rb") as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if ( entry.get("uri") != str(uri) or entry.get("accept") != (accept or "") or
+             entry.get("credential", "") != self._credentialkey(credential) ):
+            return None
+        entry["entryname"] = entryname
+        return entry
+
+    def isFresh(self, entry):
+        return time.time() < entry["expires"]
+
+    def validators(self, entry):
+        """
+        Return header fields for a conditional request to revalidate a stored response
+        """
+        headers = entry["headers"]
+        reqheaders = {}
+        if "etag" in headers:
+            reqheaders["if-none-match"] = headers["etag"]
+        if "last-modified" in headers:
+            reqheaders["if-modified-since"] = headers["last-modified"]
+        return reqheaders
+
+    def readBody(self, entry):
+        """
+        Return stored body of a response, or None if it cannot be read
+        """
+        try:
+            with open(entry["entryname"]+".body", "rb") as f:
+                data = f.read()
+        except IOError:
+            return None
+        if hashlib.sha1(data).hexdigest() != entry["digest"]:
+            return None
+        return data
+
+    def store(self, uri, accept, status, reason, headerlist, data, credential=None):
+        """
+        Store response to a GET request, if permitted by the response headers.
+
+        Returns a dictionary describing the stored response, or None.
+        """
+        now     = time.time()
+        headers = dict(headerlist)
+        expires = self._expiry(headers, now) if status == 200 else None
+        if expires is None:
+            self.invalidate(uri)
+            return None
+        with self._lock:
+            self._stores += 1
+            prune = self._stores % CACHE_PRUNE_STORES == 0
+        if prune:
+            self.prune()
+        entryname = self._entryname(uri, accept, credential)
+        entry = (
+            { "uri":        str(uri)
+            , "accept":     accept or ""
+            , "credential": self._credentialkey(credential)
+            , "status":     status
+            , "reason":     reason
+            , "headerlist": headerlist
+            , "headers":    headers
+            , "expires":    expires
+            , "digest":     hashlib.sha1(data).hexdigest()
+            })
+        try:
+            if not os.path.isdir(os.path.dirname(entryname)):
+                os.makedirs(os.path.dirname(entryname))
+            for g in glob.glob(entryname+"-*.nt"):
+                os.remove(g)
+            self._writeFile(entryname+".body", data)
+            self._writeFile(entryname+".json", json.dumps(entry))
+        except (IOError, OSError), e:
+            log.warn("HTTP_Cache: cannot store response for %s: %s"%(uri, e))
+            return None
+        entry["entryname"] = entryname
+        return entry
+
+    def refresh(self, entry, headerlist):
+        """
+        Update a stored response with header fields from a 304 (Not Modified) response.
+
+        Returns the updated entry.
+        """
+        # Header fields describing the body are not updated from the 304 response
+        updates    = [ (h,v) for (h,v) in headerlist if h not in
+                       ["content-length", "content-type", "content-encoding", "transfer-encoding"] ]
+        names      = set( h for (h,v) in updates )
+        headerlist = [ (h,v) for (h,v) in entry["headerlist"] if h not in names ] + updates
+        headers    = dict(headerlist)
+        expires    = self._expiry(headers, time.time())
+        if expires is None:
+            self.invalidate(entry["uri"])
+            return entry
+        entryname = entry.pop("entryname")
+        entry.update(headerlist=headerlist, headers=headers, expires=expires)
+        try:
+            self._writeFile(entryname+".json", json.dumps(entry))
+        except (IOError, OSError), e:
+            log.warn("HTTP_Cache: cannot update response for %s: %s"%(entry["uri"], e))
+        entry["entryname"] = entryname
+        return entry
+
+    def invalidate(self, uri):
+        """
+        Discard all stored responses for a URI
+        """
+        uridir = self._uridir(uri)
+        for f in glob.glob(os.path.join(uridir, "*")):
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+        return
+
+    def _checkPrune(self):
+        """
+        Prune the cache if it has not been pruned recently, as recorded by the
+        modification time of a marker file.
+        """
+        marker = os.path.join(self._cachedir, ".pruned")
+        try:
+            if time.time() - os.stat(marker).st_mtime < CACHE_PRUNE_INTERVAL:
+                return
+        except OSError:
+            pass
+        self.prune()
+        return
+
+    def prune(self):
+        """
+        Discard stored responses that are too old, or that exceed the cache size limit.
+        """
+        now     = time.time()
+        entries = []        # (time stored, size, files)
+        try:
+            uridirs = os.listdir(self._cachedir)
+        except OSError:
+            return
+        for d in uridirs:
+            uridir = os.path.join(self._cachedir, d)
+            if not os.path.isdir(uridir): continue
+            files = {}
+            for f in os.listdir(uridir):
+                files.setdefault(f[:16], []).append(os.path.join(uridir, f))
+            for fs in files.itervalues():
+                try:
+                    stamp = max( os.stat(f).st_mtime for f in fs if f.endswith(".json") )
+                except (OSError, ValueError):
+                    stamp = 0
+                size = 0
+                for f in fs:
+                    try:
+                        size += os.stat(f).st_size
+                    except OSError:
+                        pass
+                entries.append((stamp, size, fs))
+        entries.sort()
+        total = sum( size for (stamp, size, fs) in entries )
+        for (stamp, size, fs) in entries:
+            if now-stamp <= self._maxage and total <= self._maxsize:
+                break
+            for f in fs:
+                try:
+                    os.remove(f)
+                except OSError:
+                    pass
+            try:
+                os.rmdir(os.path.dirname(fs[0]))     # Fails unless URI directory now empty
+            except OSError:
+                pass
+            total -= size
+        try:
+            if not os.path.isdir(self._cachedir):
+                os.makedirs(self._cachedir)
+            with open(os.path.join(self._cachedir, ".pruned"), "w"):
+                pass
+        except (IOError, OSError), e:
+            log.warn("HTTP_Cache: cannot record pruning of %s: %s"%(self._cachedir, e))
+        log.debug("HTTP_Cache.prune: %s, %d bytes kept"%(self._cachedir, total))
+        return
+
+    def _graphname(self, entry):
+        return entry["entryname"]+"-"+entry["digest"][:16]+".nt"
+
+    def readGraph(self, entry, graph):
+        """
+        Add parsed graph saved for a stored RDF response to the supplied graph.
+
+        Returns True if a saved graph was read, otherwise False.
+        """
+        try:
+            with open(self._graphname(entry), "rb") as f:
+                data = f.read()
+        except IOError:
+            return False
+        # Namespace prefixes are saved as comment lines
+        for (prefix, uri) in GRAPH_PREFIX_LINE.findall(data):
+            graph.bind(prefix, rdflib.namespace.Namespace(uri), override=False)
+        graph.parse(data=data, format="nt")
+        return True
+
+    def storeGraph(self, entry, graph):
+        """
+        Save parsed graph for a stored RDF response
+        """
+        prefixes = "".join([ "# @prefix %s: <%s>\n"%(p, u) for (p, u) in graph.namespaces() ])
+        try:
+            self._writeFile(self._graphname(entry), prefixes+graph.serialize(format="nt"))
+        except (IOError, OSError), e:
+            log.warn("HTTP_Cache: cannot store graph for %s: %s"%(entry["uri"], e))
+        return
+
+GRAPH_PREFIX_LINE = re.compile(r"^# @prefix ([\w\-.]*): <([^>]*)>$", re.MULTILINE)
+
+# Response cache used by HTTP sessions that are not given a cache
+_httpcache = None
+
+def getHttpCache():
+    """
+    Return response cache shared by HTTP sessions, or None
+    """
+    return _httpcache
+
+def setHttpCache(cache):
+    """
+    Set response cache shared by HTTP sessions (None to disable caching)
+    """
+    global _httpcache
+    _httpcache = cache
+    return
+
 # Class for handling Access in an HTTP session
 
 class HTTP_Session(object):
@@ -145,9 +727,15 @@ class HTTP_Session(object):
     request, but such requests are not issued using the access key of the HTTP
     session.
 
+    Requests are issued using persistent connections from a connection pool, which
+    by default is shared by all HTTP sessions (see getConnectionPool).
+
+    Responses to GET requests are saved in and revalidated from a response cache,
+    if one is supplied or set for all sessions (see HTTP_Cache, setHttpCache).
+
     """
 
-    def __init__(self, baseuri, accesskey=None):
+    def __init__(self, baseuri, accesskey=None, pool=None, cache=None):
         log.debug("HTTP_Session.__init__: baseuri "+baseuri)
         self._baseuri = baseuri
         self._key     = accesskey
@@ -155,7 +743,8 @@ class HTTP_Session(object):
         self._scheme  = parseduri.scheme
         self._host    = parseduri.netloc
         self._path    = parseduri.path
-        self._httpcon = httplib.HTTPConnection(self._host)
+        self._pool    = pool or getConnectionPool()
+        self._cache   = cache or getHttpCache()
         return
 
     def __enter__(self):
@@ -166,8 +755,8 @@ class HTTP_Session(object):
         return
 
     def close(self):
+        # Connections remain in the pool for use by other sessions
         self._key     = None
-        self._httpcon.close()
         return
 
     def baseuri(self):
@@ -187,7 +776,8 @@ class HTTP_Session(object):
         return parseLinks(headers["_headerlist"])
 
     def doRequest(self, uripath,
-            method="GET", body=None, ctype=None, accept=None, reqheaders=None, exthost=False):
+            method="GET", body=None, ctype=None, accept=None, reqheaders=None, exthost=False,
+            outfile=None, progress=None):
         """
         Perform HTTP request.
 
@@ -195,28 +785,33 @@ class HTTP_Session(object):
             uripath     URI reference of resource to access, resolved against the base URI of
                         the current HTTP_Session object.
             method      HTTP method to use (default GET)
-            body        request body to use (default none)
+            body        request body to use (default none): a string, or a file-like
+                        object or iterator over strings that is read as the request is sent
             ctype       content-type of request body (default none)
             accept      string containing list of content types for HTTP accept header
             reqheaders  dictionary of additional header fields to send with the HTTP request
             exthost     True if a request to a URI with a scheme and/or host different than 
                         the session base URI is to be respected (default False).
+            outfile     if supplied, a file to which the body of a successful response is
+                        written as it is received, instead of being returned.
+            progress    if supplied with outfile, a function called as the response body
+                        is received, as progress(bytes received, content length or None).
 
         Return:
-             status, reason(text), response headers, response body
+             status, reason(text), response headers, response body (or number of bytes
+             written to outfile)
 
         """
         # Construct request path
         uriparts = urlparse.urlsplit(self.getpathuri(uripath))
         path     = uriparts.path
         if uriparts.query: path += ("?"+uriparts.query)
-        # Sort out HTTP connection to use: session or new
+        # Sort out host to use: session or other
         if ( (uriparts.scheme and uriparts.scheme != self._scheme) or
              (uriparts.netloc and uriparts.netloc != self._host) ):
             if exthost:
-                newhttpcon = httplib.HTTPConnection(uriparts.netloc)
-                usehttpcon = newhttpcon
-                usescheme  = uriparts.scheme
+                usescheme  = uriparts.scheme or self._scheme
+                usehost    = uriparts.netloc or self._host
                 usekey     = None
             elif (uriparts.scheme and uriparts.scheme != self._scheme):
                 raise HTTP_Error(
@@ -229,13 +824,12 @@ class HTTP_Session(object):
                     value=uriparts.netloc,
                     uri=self._baseuri)
         else:
-            newhttpcon = None
-            usehttpcon = self._httpcon
             usescheme  = self._scheme
+            usehost    = self._host
             usekey     = self._key
         # Assemble request headers
-        if not reqheaders:
-            reqheaders = {}
+        origheaders = reqheaders
+        reqheaders = dict(reqheaders or {})
         if usekey:
             reqheaders["authorization"] = "Bearer "+usekey
         if ctype:
@@ -246,17 +840,50 @@ class HTTP_Session(object):
         log.debug("HTTP_Session.doRequest method:     "+method)
         log.debug("HTTP_Session.doRequest path:       "+path)
         log.debug("HTTP_Session.doRequest reqheaders: "+repr(reqheaders))
-        log.debug("HTTP_Session.doRequest body:       "+repr(body))
-        usehttpcon.request(method, path, body, reqheaders)
+        if body is None or isinstance(body, basestring):
+            log.debug("HTTP_Session.doRequest body:       "+repr(body)[:1000])
+        else:
+            log.debug("HTTP_Session.doRequest body:       (stream) "+repr(body))
+        # Check for cached response
+        cacheuri   = usescheme+"://"+usehost+path
+        cacheentry = None
+        if ( self._cache and method == "GET" and body is None and outfile is None and
+             "if-none-match" not in reqheaders and "if-modified-since" not in reqheaders ):
+            cacheentry = self._cache.lookup(cacheuri, accept, reqheaders.get("authorization"))
+            if cacheentry:
+                if self._cache.isFresh(cacheentry):
+                    data = self._cache.readBody(cacheentry)
+                    if data is not None:
+                        log.debug("HTTP_Session.doRequest cached:     "+cacheuri)
+                        return self._cachedResponse(cacheentry, data)
+                reqheaders.update(self._cache.validators(cacheentry))
         # Pick out elements of response
         try:
-            response = usehttpcon.getresponse()
+            (response, data) = self._pool.request(usescheme, usehost,
+                method, path, body, reqheaders, outfile=outfile, progress=progress)
             status   = response.status
             reason   = response.reason
             headerlist = [ (h.lower(),v) for (h,v) in response.getheaders() ]
+            if self._cache:
+                if status == 304 and cacheentry:
+                    cacheentry = self._cache.refresh(cacheentry, headerlist)
+                    cachedata  = self._cache.readBody(cacheentry)
+                    if cachedata is not None:
+                        log.debug("HTTP_Session.doRequest revalidated: "+cacheuri)
+                        return self._cachedResponse(cacheentry, cachedata)
+                    # Stored body lost: repeat request unconditionally
+                    self._cache.invalidate(cacheuri)
+                    return self.doRequest(uripath, method=method, body=body, ctype=ctype,
+                        accept=accept, reqheaders=origheaders, exthost=exthost)
+                elif method == "GET" and status == 200 and outfile is None:
+                    cacheentry = self._cache.store(cacheuri, accept, status, reason, headerlist, data,
+                        credential=reqheaders.get("authorization"))
+                elif method not in ["GET", "HEAD", "OPTIONS"]:
+                    self._cache.invalidate(cacheuri)
             headers  = dict(headerlist)   # dict(...) keeps last result of multiple keys
             headers["_headerlist"] = headerlist
-            data = response.read()
+            if cacheentry and status == 200:
+                headers["_cacheentry"] = cacheentry
             if status < 200 or status >= 300: data = None
             log.debug("HTTP_Session.doRequest response:   "+str(status)+" "+reason)
             log.debug("HTTP_Session.doRequest rspheaders: "+repr(headers))
@@ -267,12 +894,21 @@ class HTTP_Session(object):
             headers = {"_headerlist": []}
             data = None
         ###log.debug("HTTP_Session.doRequest data:     "+repr(data))
-        if newhttpcon:
-            newhttpcon.close()
         return (status, reason, headers, data)
 
+    def _cachedResponse(self, cacheentry, data):
+        """
+        Assemble response values for a response taken from the response cache
+        """
+        headerlist = [ tuple(hv) for hv in cacheentry["headerlist"] ]
+        headers    = dict(headerlist)
+        headers["_headerlist"] = headerlist
+        headers["_cacheentry"] = cacheentry
+        return (cacheentry["status"], cacheentry["reason"], headers, data)
+
     def doRequestFollowRedirect(self, uripath, 
-            method="GET", body=None, ctype=None, accept=None, reqheaders=None, exthost=False):
+            method="GET", body=None, ctype=None, accept=None, reqheaders=None, exthost=False,
+            outfile=None, progress=None):
         """
         Perform HTTP request, following any redirect returned.
 
@@ -286,6 +922,9 @@ class HTTP_Session(object):
             reqheaders  dictionary of additional header fields to send with the HTTP request
             exthost     True if a request to a URI with a scheme and/or host different than 
                         the session base URI is to be respected (default False).
+            outfile     if supplied, a file to which the body of a successful response is
+                        written as it is received (see doRequest).
+            progress    function called to report progress in writing outfile (see doRequest).
 
         Return:
              status, reason(text), response headers, final URI, response body
@@ -294,20 +933,20 @@ class HTTP_Session(object):
         (status, reason, headers, data) = self.doRequest(uripath,
             method=method, accept=accept,
             body=body, ctype=ctype, reqheaders=reqheaders, 
-            exthost=exthost)
+            exthost=exthost, outfile=outfile, progress=progress)
         if status in [302,303,307]:
             uripath = headers["location"]
             (status, reason, headers, data) = self.doRequest(uripath,
                 method=method, accept=accept,
                 body=body, ctype=ctype, reqheaders=reqheaders,
-                exthost=exthost)
+                exthost=exthost, outfile=outfile, progress=progress)
         if status in [302,307]:
             # Allow second temporary redirect
             uripath = headers["location"]
             (status, reason, headers, data) = self.doRequest(uripath,
                 method=method,
                 body=body, ctype=ctype, reqheaders=reqheaders,
-                exthost=exthost)
+                exthost=exthost, outfile=outfile, progress=progress)
         return (status, reason, headers, uripath, data)
 
     def doRequestRDF(self, uripath, 
@@ -346,10 +985,22 @@ class HTTP_Session(object):
                 rdfgraph   = graph if graph != None else rdflib.graph.Graph()
                 baseuri    = self.getpathuri(uripath)
                 bodyformat = RDF_CONTENT_TYPES[content_type]
+                cacheentry = headers.get("_cacheentry")
                 # log.debug("HTTP_Session.doRequestRDF data:\n----\n"+data+"\n------------")
                 try:
-                    # rdfgraph.parse(data=data, location=baseuri, format=bodyformat)
-                    rdfgraph.parse(data=data, publicID=baseuri, format=bodyformat)
+                    if cacheentry and self._cache.readGraph(cacheentry, rdfgraph):
+                        pass
+                    elif cacheentry:
+                        # Save graph parsed from this body alone in the cache
+                        bodygraph = rdflib.graph.Graph()
+                        bodygraph.parse(data=data, publicID=baseuri, format=bodyformat)
+                        self._cache.storeGraph(cacheentry, bodygraph)
+                        rdfgraph += bodygraph
+                        for (prefix, uri) in bodygraph.namespaces():
+                            rdfgraph.bind(prefix, uri, override=False)
+                    else:
+                        # rdfgraph.parse(data=data, location=baseuri, format=bodyformat)
+                        rdfgraph.parse(data=data, publicID=baseuri, format=bodyformat)
                     data = rdfgraph
                 except Exception, e:
                     log.info("HTTP_Session.doRequestRDF: %s"%(e))
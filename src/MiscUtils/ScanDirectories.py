@@ -12,6 +12,14 @@ from os.path import join, isdir, normpath
 import os
 import logging
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir     # Backport for Python < 3.5, if installed
+    except ImportError:
+        scandir = None
+
 logger = logging.getLogger("ScanDirectories")
 #logger.setLevel(logging.INFO)
 
@@ -101,6 +109,56 @@ def CollectDirectoryContents(srcDir, baseDir="",
     ScanDirectoriesEx(srcDir, CollectDir, CollectFile, recursive)
     return collection
 
+# Generate directory contents found under the source directory
+#
+# This is like 'CollectDirectoryContents' above, except that results are generated
+# as the directory tree is walked, using os.scandir (or its backport) if available
+# to avoid separate system calls to test each entry, and hidden entries (whose
+# names start with '.') and their contents may be skipped without being scanned.
+#
+# srcdir    directory to search, maybe including sub-directories
+# baseDir   a base directory that is removed from all results returned.
+# listFiles is True if files are to be included in the listing returned
+# recursive is True if directories are to be scanned recursively,
+#           otherwise only the named directory is scanned.
+# appendSep is True if path separator character is to be appended to directory names
+# skipHidden is True if hidden files and directories are to be skipped
+#
+# Returns an iterator over directory contents
+#
+def IterDirectoryContents(srcDir, baseDir="",
+        listDirs=True, listFiles=False, recursive=True, appendSep=False, skipHidden=False):
+    """
+    Generate directory contents found under the source directory.
+    """
+    logger.debug("IterDirectoryContents: %s, %s"%(srcDir,baseDir))
+    dirsuffix = ""
+    if appendSep: dirsuffix = os.path.sep
+    if (baseDir != "") and (not baseDir.endswith(os.path.sep)):
+        baseDir = baseDir+os.path.sep
+    if not srcDir.endswith(os.path.sep): srcDir += os.path.sep
+    pending = [srcDir]
+    while pending:
+        scandir_path = pending.pop()
+        for (name, path, isdirectory) in _ListDirectory(scandir_path):
+            if skipHidden and name.startswith("."):
+                continue
+            if isdirectory:
+                if listDirs: yield path.replace(baseDir,"",1)+dirsuffix
+                if recursive: pending.append(path+os.path.sep)
+            elif listFiles:
+                yield path.replace(baseDir,"",1)
+    return
+
+def _ListDirectory(srcdir):
+    """
+    Return list of (name, path, isdir) for entries in the indicated directory,
+    whose name must end with a path separator.
+    """
+    if scandir:
+        return [ (e.name, srcdir+e.name, e.is_dir()) for e in scandir(srcdir) ]
+    return [ (n, srcdir+n, isdir(srcdir+n)) for n in os.listdir(srcdir) ]
+
 if __name__ == "__main__":
     directoryCollection = CollectDirectoryContents(".", baseDir=".", 
         listFiles=True, listDirs=False, appendSep=True)
@@ -0,0 +1,153 @@
+# Generate zip archive content as a stream of blocks.
+
+"""
+Function to generate the content of a zip archive incrementally, so that an
+archive can be sent (e.g. as an HTTP request body) while it is being created,
+without holding the whole archive in memory or writing it to a file.
+
+Each member is written with a data descriptor following its content, so there
+is no need to seek back and update the member header once its size and CRC are
+known.  The central directory is written by the standard zipfile module.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2011-2013, University of Oxford"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os
+import time
+import zlib
+import struct
+import zipfile
+import logging
+
+log = logging.getLogger(__name__)
+
+BLOCK_SIZE  = 64*1024       # Size of blocks read from member files and returned
+DATA_DESCRIPTOR_SIG = "PK\x07\x08"
+
+class _ZipOutput(object):
+    """
+    Write-only file-like object that collects data written to it, and keeps
+    track of the position in the output stream.
+    """
+
+    def __init__(self):
+        self._pos    = 0
+        self._blocks = []
+        self._size   = 0
+        return
+
+    def write(self, data):
+        self._blocks.append(data)
+        self._pos  += len(data)
+        self._size += len(data)
+        return
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        return
+
+    def pending(self):
+        return self._size
+
+    def take(self):
+        data = "".join(self._blocks)
+        self._blocks = []
+        self._size   = 0
+        return data
+
+def _sourceSize(f):
+    """
+    Return the number of bytes remaining to be read from a file-like object, or
+    None if this cannot be found without reading it (e.g. it is not seekable).
+    """
+    try:
+        pos = f.tell()
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        f.seek(pos)
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+    return end-pos
+
+def iterZipData(members, compression=zipfile.ZIP_DEFLATED, blocksize=BLOCK_SIZE):
+    """
+    Generate the content of a zip archive as a sequence of strings.
+
+    members     is an iterable of (arcname, source) pairs, where arcname is the name
+                of a member in the archive and source is either the name of a file
+                whose content is the member content, or a readable file-like object,
+                which is closed when its content has been read.  ZIP64 extensions
+                are used for members that may exceed the zip file size limits: those
+                whose size is close to the limits, and file-like objects that are
+                not seekable, whose size is unknown.
+    compression is the zipfile compression method used for members.
+    blocksize   is the approximate size of strings returned.
+    """
+    out = _ZipOutput()
+    zf  = zipfile.ZipFile(out, "w", compression, allowZip64=True)
+    for (arcname, source) in members:
+        if isinstance(source, basestring):
+            st    = os.stat(source)
+            mtime = st.st_mtime
+            size  = st.st_size
+            attr  = (st.st_mode & 0xFFFF) << 16L
+            f     = open(source, "rb")
+        else:
+            mtime = time.time()
+            size  = _sourceSize(source)
+            attr  = 0600 << 16L
+            f     = source
+        try:
+            zinfo = zipfile.ZipInfo(arcname, time.localtime(mtime)[0:6])
+            zinfo.external_attr = attr
+            zinfo.compress_type = compression
+            zinfo.flag_bits     = 0x08      # CRC and sizes follow the member content
+            zinfo.header_offset = out.tell()
+            zinfo.CRC = zinfo.compress_size = zinfo.file_size = 0
+            # If the size is not known in advance, assume it may be large
+            zip64 = size is None or size*1.05 > zipfile.ZIP64_LIMIT
+            out.write(zinfo.FileHeader(zip64))
+            cmpr = None
+            if compression == zipfile.ZIP_DEFLATED:
+                cmpr = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            crc = file_size = compress_size = 0
+            while True:
+                buf = f.read(blocksize)
+                if not buf: break
+                file_size += len(buf)
+                crc = zlib.crc32(buf, crc) & 0xffffffff
+                if cmpr: buf = cmpr.compress(buf)
+                compress_size += len(buf)
+                out.write(buf)
+                if out.pending() >= blocksize:
+                    yield out.take()
+            if cmpr:
+                buf = cmpr.flush()
+                compress_size += len(buf)
+                out.write(buf)
+        finally:
+            f.close()
+        zinfo.CRC           = crc
+        zinfo.file_size     = file_size
+        zinfo.compress_size = compress_size
+        if not zip64 and max(file_size, compress_size) > zipfile.ZIP64_LIMIT:
+            raise zipfile.LargeZipFile("Member %s grew while it was being read"%(arcname))
+        if zip64:
+            out.write(struct.pack("<4sLQQ", DATA_DESCRIPTOR_SIG, crc, compress_size, file_size))
+        else:
+            out.write(struct.pack("<4sLLL", DATA_DESCRIPTOR_SIG, crc, compress_size, file_size))
+        # Member is recorded for the central directory written by ZipFile.close()
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+        log.debug("iterZipData: %s, %d bytes"%(arcname, file_size))
+        if out.pending() >= blocksize:
+            yield out.take()
+    zf.close()
+    yield out.take()
+    return
+
+# End.
@@ -28,7 +28,7 @@ try:
 except ImportError:
     import uritemplate
 
-from rocommand.ro_uriutils   import isLiveUri, resolveUri
+from rocommand.ro_uriutils   import resolveUri
 from rocommand.ro_namespaces import RDF, RDFS, ORE, DCTERMS
 from rocommand.ro_metadata   import ro_metadata
 from rocommand.ro_prefixes   import make_sparql_prefixes
@@ -136,7 +136,7 @@ def evaluate(rometa, minim, target, purpose):
     #                )
     rodesc       = rometa.getAnnotationValue(rouri, DCTERMS.description) or rotitle
     minimuri     = rometa.getComponentUri(minim)
-    minimgraph   = ro_minim.readMinimGraph(minimuri)
+    minimgraph   = ro_minim.readMinimGraph(minimuri, rometa.readZipResource(minimuri))
     constraint   = ro_minim.getConstraint(minimgraph, rouri, target, purpose)
     assert constraint != None, "Missing minim:Constraint for target %s, purpose %s"%(target, purpose)
     (targetid, targetlabel) = getIdLabel(rometa, constraint['targetres_actual'])
@@ -316,7 +316,7 @@ def evalContentMatch(rometa, rule, constraintbinding):
                 fileuri = rometa.getComponentUri(fileref)
                 # Test if URI is live (accessible)
                 log.debug("evalContentMatch RO islive %s (%s)"%(fileref, str(fileuri)))
-                satisfied = isLiveUri(fileuri)
+                satisfied = rometa.isLiveResource(fileuri)
             log.debug("evalContentMatch (forall) RO satisfied %s"%(satisfied))
             if not satisfied: break
     elif rule['exists']:
@@ -429,7 +429,7 @@ def evalQueryTest(rometa, rule, constraintbinding):
                 fileuri   = rometa.getComponentUri(fileref)
                 simplebinding.update({'_fileref': fileref, '_fileuri': fileuri})
                 log.debug("evalQueryTest RO isLive %s (%s)"%(fileref, str(fileuri)))
-                satisfied = isLiveUri(fileuri)
+                satisfied = rometa.isLiveResource(fileuri)
                 failmsg   = failmsg or "Accessible %(_fileref)s"
             if exists:
                 existsparams = (
@@ -83,15 +83,21 @@ def getElementUri(minimbase, elemname):
     """
     return rdflib.URIRef(urlparse.urljoin(str(minimbase), elemname))
 
-def readMinimGraph(minimuri):
+def readMinimGraph(minimuri, data=None):
     """
     Read Minim file, return RDF Graph.
+
+    data    if supplied, is the content of the Minim file, which is not then read
+            from the supplied URI (e.g. when the Minim file is in a zipped RO).
     """
     log.debug("minimuri %s"%(repr(minimuri)))
     minimformat   = "xml"
     if re.search("\.(ttl|n3)$", str(minimuri)): minimformat="n3"
     minimgraph = rdflib.Graph()
-    minimgraph.parse(minimuri, format=minimformat)
+    if data is not None:
+        minimgraph.parse(data=data, publicID=str(minimuri), format=minimformat)
+    else:
+        minimgraph.parse(minimuri, format=minimformat)
     return minimgraph
 
 def iter2(iter1, iter2):
@@ -13,6 +13,8 @@ import urlparse
 import rdflib.graph
 import logging
 import time
+import threading
+from multiprocessing.pool import ThreadPool
 
 from xml.dom import minidom
 from urlparse import urljoin
@@ -21,6 +23,7 @@ from rdflib.term import URIRef
 
 from MiscUtils.HttpSession import HTTP_Session
 
+from rocommand import ro_settings
 import ro_prefixes
 from ro_namespaces import RDF, ORE, RO, AO, ROEVO
 from ro_utils import EvoType
@@ -81,6 +84,88 @@ def getResourceUri(rouri, resuriref):
 
 # Class for handling ROSRS access
 
+class ROSRS_RO(object):
+
+    """
+    Handle for a research object accessed through an ROSRS session.
+
+    The RO manifest is retrieved and parsed when first needed, and the same
+    manifest graph is then used for all operations on the RO until the handle
+    is invalidated by a request that may change the RO (see ROSRS_Session.doRequest).
+    """
+
+    def __init__(self, rosrs, rouri):
+        self._rosrs      = rosrs
+        self._rouri      = rouri
+        self._lock       = threading.Lock()
+        self._generation = 0
+        self._manifest   = None     # (status, reason, headers, manifesturi, manifest)
+        self._roheaders  = None
+        return
+
+    def getRoUri(self):
+        return self._rouri
+
+    def invalidate(self):
+        """
+        Discard retrieved manifest, so it is read again when next needed
+        """
+        self._generation += 1
+        self._manifest    = None
+        self._roheaders   = None
+        return
+
+    def isAffectedBy(self, uri):
+        """
+        Test if a request to change the indicated resource may change the RO manifest
+        """
+        manifest = self._manifest
+        return ( uri.startswith(self._rouri) or uri == self._rouri.rstrip("/") or
+                 (manifest is not None and uri == str(manifest[3])) )
+
+    def getManifest(self):
+        """
+        Return (status, reason, headers, uri, manifest) for the RO manifest, where
+        headers are those of the response from which the manifest was read.  Only a
+        manifest that is read successfully is kept: any other response is returned,
+        and the manifest is requested again when next needed.
+        """
+        with self._lock:
+            if self._manifest is None:
+                generation = self._generation
+                manifest   = self._readManifest()
+                if generation == self._generation and manifest[0] == 200:
+                    self._manifest = manifest
+                return manifest
+            return self._manifest
+
+    def getROHeaders(self):
+        """
+        Return headers of the response to a request for the RO URI, which may be
+        a redirect to the manifest.  These are from the last attempt to read the
+        manifest, even if it failed, so the RO is requested again only if it has
+        not been read since the handle was invalidated.
+        """
+        if self._roheaders is None:
+            self.getManifest()
+        return self._roheaders
+
+    def _readManifest(self):
+        # Redirects are followed here, rather than by doRequestRDFFollowRedirect,
+        # to keep the headers for the RO URI, which link to RO evolution information
+        uri = self._rouri
+        (status, reason, headers, data) = self._rosrs.doRequestRDF(uri)
+        self._roheaders = headers
+        if status in [302,303,307]:
+            uri = headers["location"]
+            (status, reason, headers, data) = self._rosrs.doRequestRDF(uri)
+        if status in [302,307]:
+            # Allow second temporary redirect
+            uri = headers["location"]
+            (status, reason, headers, data) = self._rosrs.doRequestRDF(uri)
+        log.debug("ROSRS_RO._readManifest %s, status %d"%(uri, status))
+        return (status, reason, headers, URIRef(self._rosrs.getpathuri(uri)), data)
+
 class ROSRS_Session(HTTP_Session):
     
     """
@@ -93,12 +178,17 @@ class ROSRS_Session(HTTP_Session):
     
     Related:
     * http://www.wf4ever-project.org/wiki/display/docs/User+Management+2
+
+    The manifest of each RO accessed is read once, and shared by operations on
+    the RO until a request that may change the RO is issued (see ROSRS_RO).
     """
 
-    def __init__(self, srsuri, accesskey = None):
+    def __init__(self, srsuri, accesskey = None, pool = None, cache = None):
         log.debug("ROSRS_Session.__init__: srsuri "+srsuri)
-        super(ROSRS_Session, self).__init__(srsuri, accesskey)
+        super(ROSRS_Session, self).__init__(srsuri, accesskey, pool=pool, cache=cache)
         self._srsuri    = srsuri
+        self._rohandles = {}
+        self._rolock    = threading.Lock()
         return
 
     def close(self):
@@ -113,6 +203,40 @@ class ROSRS_Session(HTTP_Session):
     def error(self, msg, value=None):
         return ROSRS_Error(msg=msg, value=value, srsuri=self._srsuri)
 
+    def getROHandle(self, rouri):
+        """
+        Return handle for accessing the indicated RO, shared by all operations
+        on that RO using this session.
+        """
+        rouri = self.getpathuri(rouri)
+        with self._rolock:
+            if rouri not in self._rohandles:
+                self._rohandles[rouri] = ROSRS_RO(self, rouri)
+            return self._rohandles[rouri]
+
+    def doRequest(self, uripath,
+            method="GET", body=None, ctype=None, accept=None, reqheaders=None, exthost=False,
+            outfile=None, progress=None):
+        """
+        Perform HTTP request (see HTTP_Session.doRequest).
+
+        A request other than GET, HEAD or OPTIONS invalidates the manifest of any
+        RO that contains the target resource.
+        """
+        result = super(ROSRS_Session, self).doRequest(uripath,
+            method=method, body=body, ctype=ctype, accept=accept,
+            reqheaders=reqheaders, exthost=exthost, outfile=outfile, progress=progress)
+        if method not in ["GET", "HEAD", "OPTIONS"]:
+            uri = self.getpathuri(uripath)
+            with self._rolock:
+                handles = self._rohandles.values()
+            for h in handles:
+                if h.isAffectedBy(uri):
+                    log.debug("ROSRS_Session.doRequest: %s %s invalidates %s"%
+                        (method, uri, h.getRoUri()))
+                    h.invalidate()
+        return result
+
     def listROs(self):
         """
         List ROs in service
@@ -214,11 +338,12 @@ class ROSRS_Session(HTTP_Session):
 
     def getROManifest(self, rouri):
         """
-        Retrieve an RO manifest
+        Retrieve an RO manifest, using a previously retrieved copy if the RO has
+        not been changed by this session.  The manifest graph returned must not
+        be modified.
         Return (status, reason, headers, uri, data), where status is 200 or 404
         """
-        (status, reason, headers, uri, data) = self.doRequestRDFFollowRedirect(rouri,
-            method="GET")
+        (status, reason, headers, uri, data) = self.getROHandle(rouri).getManifest()
         log.debug("getROManifest %s, status %d, len %d"%(uri, status, len(data or [])))
         if status in [200, 404]:
             return (status, reason, headers, URIRef(uri), data)
@@ -445,20 +570,23 @@ class ROSRS_Session(HTTP_Session):
                 yield a
         return
 
-    def getROAnnotationBodyUris(self, rouri, resuri=None):
+    def getROAnnotationBodyUris(self, rouri, resuri=None, manifest=None):
         """
         Enumerate annnotation body URIs associated with a resource
         (or all annotations for an RO) 
+
+        manifest    if supplied, is an already retrieved manifest graph for the RO
         
         Returns an iterator over annotation URIs
         """
         ### This works, but needs an additional HTTP operation for each annotation
         # for annuri in self.getROAnnotationUris(rouri, resuri):
         #     yield self.getROAnnotationBodyUri(annuri)
-        (status, reason, headers, manifesturi, manifest) = self.getROManifest(rouri)
-        if status != 200:
-            raise self.error("No manifest",
-                "%03d %s (%s)"%(status, reason, str(rouri)))
+        if manifest is None:
+            (status, reason, headers, manifesturi, manifest) = self.getROManifest(rouri)
+            if status != 200:
+                raise self.error("No manifest",
+                    "%03d %s (%s)"%(status, reason, str(rouri)))
         ###log.info(manifest.serialize(format="xml"))
         for (a,p) in manifest.subject_predicates(object=resuri):
             if p in [AO.annotatesResource,RO.annotatesAggregatedResource]:
@@ -478,24 +606,73 @@ class ROSRS_Session(HTTP_Session):
                 "%03d %s (%s)"%(status, reason, str(annuri)))
         return rdflib.URIRef(headers['location'])
 
-    def getROAnnotationGraph(self, rouri, resuri=None):
+    def getROAnnotationBodyGraph(self, buri):
+        """
+        Retrieve a single annotation body as a new RDF graph
+
+        Returns: (buri, status, reason, graph), where graph is None if the body
+        could not be read
+        """
+        (status, reason, headers, curi, data) = self.doRequestRDFFollowRedirect(buri, 
+            exthost=True)
+        log.debug("getROAnnotationBodyGraph: %03d %s reading %s"%(status, reason, buri))
+        if status != 200:
+            data = None
+        return (buri, status, reason, data)
+
+    def getROAnnotationBodyGraphs(self, buris, workers=None):
+        """
+        Retrieve a number of annotation bodies, using up to 'workers' concurrent
+        requests (default ro_settings.FETCH_WORKERS).  Each body is read and
+        parsed into its own graph, so a failure affects only that body.
+
+        Returns a list of (buri, status, reason, graph) values, in the order of
+        the supplied body URIs.
+        """
+        buris   = list(buris)
+        workers = workers or ro_settings.FETCH_WORKERS
+        if workers <= 1 or len(buris) <= 1:
+            return map(self.getROAnnotationBodyGraph, buris)
+        pool = ThreadPool(min(workers, len(buris)))
+        try:
+            results = pool.map(self.getROAnnotationBodyGraph, buris)
+        finally:
+            pool.close()
+            pool.join()
+        return results
+
+    def getROAnnotationGraph(self, rouri, resuri=None, manifest=None, manifesturi=None,
+            workers=None):
         """
         Build RDF graph of annnotations associated with a resource
         (or all annotations for an RO) 
+
+        manifest    if supplied, is an already retrieved manifest graph for the RO
+        manifesturi is the URI of the supplied manifest graph
+        workers     is the maximum number of annotation bodies read concurrently
         
-        Returns graph of merged annotations
+        Returns graph of merged annotations.  Annotation bodies that cannot be
+        read are logged and omitted.
         """
+        if manifest is None:
+            (status, reason, headers, manifesturi, manifest) = self.getROManifest(rouri)
+            if status != 200:
+                raise self.error("No manifest",
+                    "%03d %s (%s)"%(status, reason, str(rouri)))
         agraph = rdflib.graph.Graph()
         for (prefix, uri) in ro_prefixes.prefixes:
             agraph.bind(prefix, rdflib.namespace.Namespace(uri))
-        buris = set(self.getROAnnotationBodyUris(rouri, resuri))
+        buris = set(self.getROAnnotationBodyUris(rouri, resuri, manifest=manifest))
         ###log.info("getROAnnotationGraph: %r"%([ str(b) for b in buris]))
-        for buri in buris:
-            (status, reason, headers, curi, data) = self.doRequestRDFFollowRedirect(buri, 
-                graph=agraph, exthost=True)
-            log.debug("getROAnnotationGraph: %03d %s reading %s"%(status, reason, buri))
-            if status != 200:
+        if manifesturi in buris:
+            # The manifest is an annotation body: merge the graph already retrieved
+            agraph += manifest
+            buris.discard(manifesturi)
+        for (buri, status, reason, bgraph) in self.getROAnnotationBodyGraphs(buris, workers):
+            if bgraph is None:
                 log.error("getROAnnotationGraph: %03d %s reading %s"%(status, reason, buri))
+            else:
+                agraph += bgraph
         return agraph
 
     def getROAnnotation(self, annuri):
@@ -541,11 +718,11 @@ class ROSRS_Session(HTTP_Session):
     def getROEvolution(self, rouri):
         #if len(rouri.split(self._srsuri))>1:
             #rouri = rouri.split(self._srsuri)[-1]
-        (manifest_status, manifest_reason, manifest_headers, manifest_data) = (
-            self.doRequest(uripath=urljoin(rouri,".ro/manifest.rdf"), accept="application/rdf+xml"))
-        if manifest_status == 404:
-            return (manifest_status, manifest_reason, manifest_data, None)
-        (manifest_status, manifest_reason, manifest_headers, manifest_data) = self.doRequest(uripath=rouri, accept="application/rdf+xml")
+        # The RO handle supplies the manifest and RO URI response headers from one retrieval
+        rohandle = self.getROHandle(rouri)
+        (manifest_status, manifest_reason, manifest_headers, manifest_uri, manifest_data) = (
+            rohandle.getManifest())
+        manifest_headers = rohandle.getROHeaders()
         if manifest_status == 404 or not "link" in manifest_headers:
             if manifest_status == 401:
                 print "Unauthorised operation"
@@ -75,6 +75,12 @@ def run(configbase, options, args):
         status = ro_command.dump(progname, configbase, options, args)
     elif args[1] == "manifest":
         status = ro_command.manifest(progname, configbase, options, args)
+    elif args[1] == "compact":
+        status = ro_command.compact(progname, configbase, options, args)
+    elif args[1] == "compact-annotations":
+        status = ro_command.compact_annotations(progname, configbase, options, args)
+    elif args[1] == "migrate-format":
+        status = ro_command.migrate_format(progname, configbase, options, args)
     elif args[1] == "snapshot":
         status = ro_command.snapshot(progname, configbase, options, args)
     elif args[1] == "archive":
@@ -176,6 +182,40 @@ def parseCommandArgs(argv):
                       dest="new",
                       default=False,
                       help="force to create a new RO from zip")
+    parser.add_option("--from-file",
+                      dest="fromfile",
+                      help="annotate: read (resource, attribute, value) rows from CSV, TSV or JSON-lines file")
+    parser.add_option("--one-body",
+                      action="store_true",
+                      dest="onebody",
+                      default=False,
+                      help="annotate --from-file or -w: save all annotations in a single annotation body")
+    parser.add_option("--by-date",
+                      action="store_true",
+                      dest="bydate",
+                      default=False,
+                      help="compact-annotations: merge annotation bodies created on the same day")
+    parser.add_option("--zip",
+                      action="store_true",
+                      dest="zip",
+                      default=False,
+                      help="push -d: send RO directory as a zip file created while it is sent")
+    parser.add_option("--dry-run",
+                      action="store_true",
+                      dest="dryrun",
+                      default=False,
+                      help="push -d: show what would be pushed, without changing anything")
+    parser.add_option("--checksum",
+                      dest="checksum",
+                      help="checkout: MD5 or SHA-256 checksum (hexadecimal) of the RO zip file")
+    parser.add_option("--prune",
+                      action="store_true",
+                      dest="prune",
+                      default=False,
+                      help="add -a: remove resources no longer present in the directory from the RO")
+    parser.add_option("--compression",
+                      dest="compression",
+                      help="migrate-format: compression of RO metadata files: none, gzip or zstd")
     # parse command line now
     (options, args) = parser.parse_args(argv)
     if len(args) < 2: parser.error("No command present")
@@ -15,6 +15,13 @@ import datetime
 import logging
 import re
 import urlparse
+import csv
+
+try:
+    # Running Python 2.5 with simplejson?
+    import simplejson as json
+except ImportError:
+    import json
 
 log = logging.getLogger(__name__)
 
@@ -25,8 +32,9 @@ import rdflib
 
 import ro_settings
 import ro_manifest
+import ro_checksum
 from ro_namespaces import RDF, RDFS, RO, AO, ORE, DCTERMS, ROTERMS
-from ro_uriutils   import resolveUri, resolveFileAsUri
+from ro_uriutils   import resolveUri, resolveFileAsUri, UriCache
 from ro_prefixes   import prefix_dict
 
 #   Default list of annotation types
@@ -158,15 +166,67 @@ def readAnnotationBody(rodir, annotationfile):
     """
     log.debug("readAnnotationBody: %s, %s"%(rodir, annotationfile))
     annotationfilename = makeComponentFilename(rodir, annotationfile)
-    if not os.path.exists(annotationfilename): return None
-    annotationformat   = "xml"
-    # Look at file extension to figure format
-    if re.search("\.(ttl|n3)$", annotationfile): annotationformat="n3"
+    if not os.path.exists(ro_manifest.getMetadataStoredFilename(annotationfilename)): return None
     rdfGraph = rdflib.Graph()
-    rdfGraph.parse(annotationfilename, format=annotationformat)
+    ro_manifest.parseMetadataFile(rdfGraph, annotationfilename)
+    return rdfGraph
+
+# Per-process cache of recently used annotation body graphs, keyed by file name, with
+# values [stamp, graph], where stamp is the file stamp when the graph was read.
+_annotationbodycache = UriCache(ro_settings.ANNOTATION_CACHE_SIZE)
+
+def getAnnotationBody(rodir, annotationfile):
+    """
+    Return RDF Graph of annotation values from indicated file, using a graph already
+    read by this process if the file has not changed since it was read.
+
+    The graph returned is shared, and must not be modified by the caller: use
+    readAnnotationBody for a graph that is to be modified.
+    """
+    annotationfilename = os.path.abspath(makeComponentFilename(rodir, annotationfile))
+    storedfilename     = ro_manifest.getMetadataStoredFilename(annotationfilename)
+    if not os.path.exists(storedfilename): return None
+    stamp  = ro_checksum.getFileStamp(storedfilename)
+    cached = _annotationbodycache.lookup(annotationfilename)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    rdfGraph = readAnnotationBody(rodir, annotationfile)
+    _annotationbodycache.put(annotationfilename, [stamp, rdfGraph])
     return rdfGraph
 
-def createAnnotationGraphBody(ro_config, ro_dir, rofile, anngraph):
+def allocateAnnotationFilename(ro_dir, name_suffix, extension):
+    """
+    Allocate a name for a new annotation body in the RO metadata directory.
+
+    The last name index allocated today is kept in a counter file, so a new name is
+    normally found without probing for existing files.  Existing files are still
+    skipped, e.g. for bodies created before the counter file was introduced.
+
+    Returns the annotation body file name, relative to the RO metadata directory.
+    """
+    today   = datetime.date.today()
+    datestr = "%04d%02d%02d"%(today.year, today.month, today.day)
+    with open(makeAnnotationFilename(ro_dir, ro_settings.ANNOTATION_COUNTER), "a+") as cf:
+        ro_manifest._lockFile(cf, exclusive=True)
+        try:
+            cf.seek(0)
+            counter    = cf.read().split()
+            name_index = 0
+            if len(counter) == 2 and counter[0] == datestr and counter[1].isdigit():
+                name_index = int(counter[1])
+            while True:
+                name_index += 1
+                name = "Ann-%s-%04d-%s%s"%(datestr, name_index, name_suffix, extension)
+                storedname = ro_manifest.getMetadataStoredFilename(makeAnnotationFilename(ro_dir, name))
+                if not os.path.exists(storedname):
+                    break
+            cf.truncate(0)
+            cf.write("%s %d\n"%(datestr, name_index))
+        finally:
+            ro_manifest._unlockFile(cf)
+    return name
+
+def createAnnotationGraphBody(ro_config, ro_dir, rofile, anngraph, format=None, compression=None):
     """
     Create a new annotation body for a single resource in a research object, based
     on a supplied graph value.
@@ -181,31 +241,32 @@ def createAnnotationGraphBody(ro_config, ro_dir, rofile, anngraph):
     rofile      is the name of the Research Object component to be annotated, possibly
                 relative to the RO root directory.
     anngraph    is an annotation graph that is to be saved.
+    format      is the RDF syntax used for the annotation body (a key of
+                ro_manifest.METADATA_FORMATS), defaulting to that of the RO manifest.
+    compression is the compression used for the annotation body file (a key of
+                ro_manifest.METADATA_COMPRESSIONS), defaulting to that of the RO manifest.
 
     Returns the name of the annotation body created relative to the RO
     manifest and metadata directory.
     """
+    manifestfilename = ro_manifest.makeManifestFilename(ro_dir)
+    format      = format or ro_manifest.guessMetadataFormat(manifestfilename)
+    compression = compression or ro_manifest.getMetadataStoredCompression(manifestfilename)
+    extension = ro_manifest.METADATA_FORMATS[format][2]
     # Determine name for annotation body
     log.debug("createAnnotationGraphBody: %s, %s"%(ro_dir, rofile))
-    annotation_filename = None
-    name_index = 0
     name_suffix = os.path.basename(rofile)
     if name_suffix in [".",""]:
         name_suffix = os.path.basename(os.path.normpath(ro_dir))
-    today = datetime.date.today()
-    while annotation_filename == None:
-        name_index += 1
-        name = ("Ann-%04d%02d%02d-%04d-%s.rdf"%
-                (today.year, today.month, today.day, name_index, name_suffix))
-        if not os.path.exists(makeAnnotationFilename(ro_dir, name)):
-            annotation_filename = name
+    annotation_filename = allocateAnnotationFilename(ro_dir, name_suffix, extension)
     # Create annotation body file
     log.debug("createAnnotationGraphBody: %s"%(annotation_filename))
-    anngraph.serialize(destination=makeAnnotationFilename(ro_dir, annotation_filename),
-        format='xml', base=ro_manifest.getRoUri(ro_dir), xml_base="..")
+    ro_manifest.writeMetadataFile(anngraph, makeAnnotationFilename(ro_dir, annotation_filename),
+        ro_manifest.getRoUri(ro_dir), format, compression)
     return annotation_filename
 
-def createAnnotationBody(ro_config, ro_dir, rofile, attrdict, defaultType="string"):
+def createAnnotationBody(ro_config, ro_dir, rofile, attrdict, defaultType="string", format=None,
+        compression=None):
     """
     Create a new annotation body for a single resource in a research object.
 
@@ -220,6 +281,10 @@ def createAnnotationBody(ro_config, ro_dir, rofile, attrdict, defaultType="strin
                 relative to the RO root directory.
     attrdict    is a dictionary of attributes to be saved inthe annotation body.
                 Dictionary keys are attribute names that can be resolved via getAnnotationByName.
+    format      is the RDF syntax used for the annotation body, defaulting to that of
+                the RO manifest.
+    compression is the compression used for the annotation body file, defaulting to
+                that of the RO manifest.
 
     Returns the name of the annotation body created relative to the RO
     manifest and metadata directory.
@@ -231,7 +296,7 @@ def createAnnotationBody(ro_config, ro_dir, rofile, attrdict, defaultType="strin
         (p,t) = getAnnotationByName(ro_config, k, defaultType)
         anngraph.add((s, p, makeAnnotationValue(ro_config, attrdict[k],t)))
     # Write graph and return filename
-    return createAnnotationGraphBody(ro_config, ro_dir, rofile, anngraph)
+    return createAnnotationGraphBody(ro_config, ro_dir, rofile, anngraph, format, compression)
 
 def _addAnnotationBodyToRoGraph(ro_graph, ro_dir, rofile, annfile):
     """
@@ -277,7 +342,7 @@ def _addSimpleAnnotation(ro_config, ro_dir, rofile, attrname, attrvalue):
     attrvalue   is a value to be associated with the attribute
     """
     annfile = createAnnotationBody(ro_config, ro_dir, rofile, { attrname: attrvalue} )
-    ro_graph = ro_manifest.readManifestGraph(ro_dir)
+    ro_graph = ro_manifest.getManifestGraph(ro_dir)
     _addAnnotationBodyToRoGraph(ro_graph, ro_dir, rofile, annfile)
     ro_manifest.writeManifestGraph(ro_dir, ro_graph)
     return
@@ -301,7 +366,7 @@ def _removeSimpleAnnotation(ro_config, ro_dir, rofile, attrname, attrvalue):
     #     else:
     #         create new annotation graph witj annotation removed
     #         update aggregated annotation
-    ro_graph    = ro_manifest.readManifestGraph(ro_dir)
+    ro_graph    = ro_manifest.getManifestGraph(ro_dir)
     subject     = ro_manifest.getComponentUri(ro_dir, rofile)
     (predicate,valtype) = getAnnotationByName(ro_config, attrname)
     val         = attrvalue and makeAnnotationValue(ro_config, attrvalue, valtype)
@@ -340,7 +405,7 @@ def _replaceSimpleAnnotation(ro_config, ro_dir, rofile, attrname, attrvalue):
     attrname    names the attribute in a form recognized by getAnnotationByName
     attrvalue   is a new value to be associated with the attribute
     """
-    ro_graph = ro_manifest.readManifestGraph(ro_dir)
+    ro_graph = ro_manifest.getManifestGraph(ro_dir)
     subject  = ro_manifest.getComponentUri(ro_dir, rofile)
     (predicate,valtype) = getAnnotationByName(ro_config, attrname)
     log.debug("Replace annotation: subject %s, predicate %s, value %s"%(repr(subject), repr(predicate), repr(attrvalue)))
@@ -354,13 +419,13 @@ def _getAnnotationValues(ro_config, ro_dir, rofile, attrname):
     Returns iterator over annotation values for given subject and attribute
     """
     log.debug("getAnnotationValues: ro_dir %s, rofile %s, attrname %s"%(ro_dir, rofile, attrname))
-    ro_graph    = ro_manifest.readManifestGraph(ro_dir)
+    ro_graph    = ro_manifest.getManifestGraph(ro_dir)
     subject     = ro_manifest.getComponentUri(ro_dir, rofile)
     (predicate,valtype) = getAnnotationByName(ro_config, attrname)
     #@@TODO refactor common code with getRoAnnotations, etc.
     for ann_node in ro_graph.subjects(predicate=RO.annotatesAggregatedResource, object=subject):
         ann_uri   = ro_graph.value(subject=ann_node, predicate=AO.body)
-        ann_graph = readAnnotationBody(ro_dir, ro_manifest.getComponentUriRel(ro_dir, ann_uri))
+        ann_graph = getAnnotationBody(ro_dir, ro_manifest.getComponentUriRel(ro_dir, ann_uri))
         for v in ann_graph.objects(subject=subject, predicate=predicate):
             #log.debug("Triple: %s %s %s"%(subject,p,v))
             yield v
@@ -372,12 +437,12 @@ def _getRoAnnotations(ro_dir):
 
     Each value returned by the iterator is a (subject,predicate,object) triple.
     """
-    ro_graph = ro_manifest.readManifestGraph(ro_dir)
+    ro_graph = ro_manifest.getManifestGraph(ro_dir)
     subject  = ro_manifest.getRoUri(ro_dir)
     log.debug("getRoAnnotations %s"%str(subject))
     for ann_node in ro_graph.subjects(predicate=RO.annotatesAggregatedResource, object=subject):
         ann_uri   = ro_graph.value(subject=ann_node, predicate=AO.body)
-        ann_graph = readAnnotationBody(ro_dir, ro_manifest.getComponentUriRel(ro_dir, ann_uri))
+        ann_graph = getAnnotationBody(ro_dir, ro_manifest.getComponentUriRel(ro_dir, ann_uri))
         if ann_graph:
             for (p, v) in ann_graph.predicate_objects(subject=subject):
                 #log.debug("Triple: %s %s %s"%(subject,p,v))
@@ -391,13 +456,13 @@ def _getFileAnnotations(ro_dir, rofile):
     Each value returned by the iterator is a (subject,predicate,object) triple.
     """
     log.debug("getFileAnnotations: ro_dir %s, rofile %s"%(ro_dir, rofile))
-    ro_graph    = ro_manifest.readManifestGraph(ro_dir)
+    ro_graph    = ro_manifest.getManifestGraph(ro_dir)
     subject     = ro_manifest.getComponentUri(ro_dir, rofile)
     log.debug("getFileAnnotations: %s"%str(subject))
     #@@TODO refactor common code with getRoAnnotations, etc.
     for ann_node in ro_graph.subjects(predicate=RO.annotatesAggregatedResource, object=subject):
         ann_uri   = ro_graph.value(subject=ann_node, predicate=AO.body)
-        ann_graph = readAnnotationBody(ro_dir, ro_manifest.getComponentUriRel(ro_dir, ann_uri))
+        ann_graph = getAnnotationBody(ro_dir, ro_manifest.getComponentUriRel(ro_dir, ann_uri))
         if ann_graph:
             for (p, v) in ann_graph.predicate_objects(subject=subject):
                 #log.debug("Triple: %s %s %s"%(subject,p,v))
@@ -411,12 +476,12 @@ def getAllAnnotations(ro_dir):
     Each value returned by the iterator is a (subject,predicate,object) triple.
     """
     log.debug("getAllAnnotations %s"%str(ro_dir))
-    ro_graph    = ro_manifest.readManifestGraph(ro_dir)
+    ro_graph    = ro_manifest.getManifestGraph(ro_dir)
     #@@TODO refactor common code with getRoAnnotations, etc.
     for (ann_node, subject) in ro_graph.subject_objects(predicate=RO.annotatesAggregatedResource):
         ann_uri   = ro_graph.value(subject=ann_node, predicate=AO.body)
         log.debug("- ann_uri %s"%(str(ann_uri)))
-        ann_graph = readAnnotationBody(ro_dir, ro_manifest.getComponentUriRel(ro_dir, ann_uri))
+        ann_graph = getAnnotationBody(ro_dir, ro_manifest.getComponentUriRel(ro_dir, ann_uri))
         if ann_graph == None:
             log.debug("No annotation graph: ann_uri: "+str(ann_uri))
         else:
@@ -425,6 +490,51 @@ def getAllAnnotations(ro_dir):
                 yield (subject, p, v)
     return
 
+def readAnnotationRows(filename):
+    """
+    Read (resource, attribute-name, attribute-value) rows from a file.  The file
+    format is determined by its extension:
+
+    .csv            comma-separated values
+    .tsv, .tab      tab-separated values
+    .jsonl, .json   JSON lines, each of which is a list [resource, attribute, value],
+                    or an object with keys "resource", "attribute" and "value",
+                    whose values are strings.
+
+    Blank lines are skipped.
+
+    Returns an iterator over (resource, attribute-name, attribute-value) tuples.
+    A ValueError exception is raised for a row that cannot be interpreted.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    with open(filename, "rb") as f:
+        if ext in [".jsonl", ".json"]:
+            for (lineno, line) in enumerate(f, 1):
+                if not line.strip(): continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    raise ValueError("%s, line %d: %s"%(filename, lineno, e))
+                if isinstance(row, dict):
+                    row = [ row.get(k) for k in ("resource", "attribute", "value") ]
+                if ( not isinstance(row, list) or len(row) != 3 or
+                     not all(isinstance(v, basestring) for v in row) ):
+                    raise ValueError("%s, line %d: expected resource, attribute and value"%
+                                     (filename, lineno))
+                yield tuple(row)
+        elif ext in [".csv", ".tsv", ".tab"]:
+            delimiter = "," if ext == ".csv" else "\t"
+            for (lineno, row) in enumerate(csv.reader(f, delimiter=delimiter), 1):
+                if not row or row == [""]: continue
+                if len(row) != 3:
+                    raise ValueError("%s, line %d: expected resource, attribute and value"%
+                                     (filename, lineno))
+                yield tuple(row)
+        else:
+            raise ValueError("%s: unrecognized annotation file type (use .csv, .tsv or .jsonl)"%
+                             (filename))
+    return
+
 def makeAnnotationValue(ro_config, aval, atype):
     """
     atype is one of "string", "resurce", ...
@@ -0,0 +1,85 @@
+# ro_checksum.py
+
+"""
+Research Object resource content checksum functions
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2011-2013, University of Oxford"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os
+import hashlib
+import logging
+from multiprocessing.pool import ThreadPool
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE  = 1024*1024     # Size of blocks read when calculating checksums
+ALGORITHMS  = ["md5", "sha256"]
+
+def calculateChecksum(filename, algorithm="md5"):
+    """
+    Calculate checksum of file content, reading the file in blocks.
+
+    filename    is the name of the file whose checksum is calculated
+    algorithm   is the name of the hash algorithm used: "md5" or "sha256"
+
+    Returns the checksum as a hexadecimal string.
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError("Unsupported checksum algorithm: %s"%(algorithm))
+    m = hashlib.new(algorithm)
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(CHUNK_SIZE)
+            if not block: break
+            m.update(block)
+    return m.hexdigest()
+
+def calculateChecksums(filenames, algorithm="md5", workers=1, errors=None):
+    """
+    Calculate checksums for a number of files, using a pool of worker threads.
+    (hashlib releases the interpreter lock while hashing large blocks, so the
+    threads can hash files concurrently.)
+
+    errors      if supplied, is a dictionary in which an IOError or OSError raised
+                when reading a file is saved, keyed by the file name, and the file
+                is omitted from the result.  Otherwise, the exception is raised.
+
+    Returns a dictionary mapping each file name to its checksum.
+    """
+    def checksum(f):
+        try:
+            return calculateChecksum(f, algorithm)
+        except (IOError, OSError) as e:
+            if errors is None: raise
+            return e
+    filenames = list(filenames)
+    if workers <= 1 or len(filenames) <= 1:
+        checksums = map(checksum, filenames)
+    else:
+        pool = ThreadPool(min(workers, len(filenames)))
+        try:
+            checksums = pool.map(checksum, filenames)
+        finally:
+            pool.close()
+            pool.join()
+    result = {}
+    for (f, c) in zip(filenames, checksums):
+        if isinstance(c, Exception):
+            errors[f] = c
+        else:
+            result[f] = c
+    return result
+
+def getFileStamp(filename):
+    """
+    Returns a value that changes when the content of the indicated file may have
+    changed: a list of inode number, size and modification time in nanoseconds.
+    """
+    st = os.stat(filename)
+    mtime_ns = getattr(st, "st_mtime_ns", None) or int(st.st_mtime*1000000000)
+    return [st.st_ino, st.st_size, mtime_ns]
+
+# End.
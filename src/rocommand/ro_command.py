@@ -29,10 +29,14 @@ except ImportError:
 log = logging.getLogger(__name__)
 
 import MiscUtils.ScanDirectories
+from MiscUtils import HttpSession
+from MiscUtils import ZipStream
 
 import ro_settings
 import ro_utils
 import ro_uriutils
+import ro_manifest
+import ro_annotation
 from ro_annotation import annotationTypes, annotationPrefixes
 from ro_metadata   import ro_metadata
 import ro_remote_metadata
@@ -41,7 +45,6 @@ from ROSRS_Session import ROSRS_Error
 import ro_rosrs_sync
 import ro_evo
 from iaeval import ro_eval_minim
-from zipfile import ZipFile
 
 RDFTYP = ["RDFXML","N3","TURTLE","NT","JSONLD","RDFA"]
 VARTYP = ["JSON","CSV","XML"]
@@ -80,8 +83,22 @@ def getroconfig(configbase, options, rouri=None):
         ro_config['rosrs_access_token'] = options.rosrs_access_token
     if rouri:
         ro_config['rosrs_uri'] = rouri
+    setupHttpCache(configbase, ro_config)
     return ro_config
 
+def setupHttpCache(configbase, ro_config):
+    """
+    Set up cache used for responses to HTTP requests made by RO manager.  The
+    cache directory may be set by configuration value "httpCacheDir" (which
+    may be empty to disable caching), relative to the configuration base directory.
+    """
+    cachedir = ro_config.get("httpCacheDir", ro_settings.HTTP_CACHE_DIR)
+    if cachedir:
+        HttpSession.setHttpCache(HttpSession.HTTP_Cache(os.path.join(configbase, cachedir)))
+    else:
+        HttpSession.setHttpCache(None)
+    return
+
 def ro_root_directory(cmdname, ro_config, rodir, restricted=True):
     """
     Find research object root directory
@@ -136,7 +153,7 @@ def ro_root_reference(cmdname, ro_config, rodir, roref=None):
     if not roref:
         # Process supplied directory option
         roref = ro_uriutils.resolveFileAsUri(rodir)
-        if ro_uriutils.isFileUri(roref):
+        if ro_uriutils.isFileUri(roref) and not ro_uriutils.isZipFileUri(roref):
             roref = ro_root_directory(cmdname, ro_config, rodir, restricted=False)
     else:
         if rodir:
@@ -160,7 +177,7 @@ ro_command_usage = (
     , (["status"],argminmax(2, 3),
           ["status [ -d <dir> | <uri> ]"])
     , (["add"], argminmax(2, 3),
-          ["add [ -d <dir> ] [ -a ] [ file | directory ]"])
+          ["add [ -d <dir> ] [ -a [ --prune ] ] [ file | directory ]"])
     , (["remove"], argminmax(3, 3),
           ["remove [ -d <dir> ] <file-or-uri>"
           , "remove -d <dir> -w <pattern>"
@@ -169,30 +186,40 @@ ro_command_usage = (
           ["list [ -a ] [ -s ] [ -d <dir> | <uri> ]"
           , "ls   [ -a ] [ -s ] [ -d <dir> | <uri> ]"
           ])
-    , (["annotate"], (lambda options, args: (len(args) == 3 if options.graph else len(args) in [4, 5])),
+    , (["annotate"], (lambda options, args: (len(args) == 2 if options.fromfile else
+                                              len(args) == 3 if options.graph else len(args) in [4, 5])),
           ["annotate [ -d <dir> ] <file-or-uri> <attribute-name> <attribute-value>"
           , "annotate [ -d <dir> ] <file-or-uri> -g <RDF-graph>"
-          , "annotate -d <dir> -w <pattern> <attribute-name> <attribute-value>"
-          , "annotate -d <dir> -w <pattern> -g <RDF-graph>"
+          , "annotate -d <dir> -w <pattern> <attribute-name> <attribute-value> [ --one-body ]"
+          , "annotate -d <dir> -w <pattern> -g <RDF-graph> [ --one-body ]"
+          , "annotate [ -d <dir> ] --from-file <annotations-file> [ --one-body ]"
           ])
-    , (["link"], (lambda options, args: (len(args) == 3 if options.graph else len(args) in [4, 5])),
+    , (["link"], (lambda options, args: (len(args) == 2 if options.fromfile else
+                                          len(args) == 3 if options.graph else len(args) in [4, 5])),
           ["link [ -d <dir> ] <file-or-uri> <attribute-name> <attribute-value>"
           , "link [ -d <dir> ] <file-or-uri> -g <RDF-graph>"
-          , "link -d <dir> -w <pattern> <attribute-name> <attribute-value>"
-          , "link -d <dir> -w <pattern> -g <RDF-graph>"
+          , "link -d <dir> -w <pattern> <attribute-name> <attribute-value> [ --one-body ]"
+          , "link -d <dir> -w <pattern> -g <RDF-graph> [ --one-body ]"
+          , "link [ -d <dir> ] --from-file <annotations-file> [ --one-body ]"
           ])
     , (["annotations"], argminmax(2, 3),
           ["annotations [ <file> | -d <dir> ] [ -o <format> ]"])
     , (["evaluate", "eval"], argminmax(5, 6),
           ["evaluate checklist [ -d <dir> ] [ -a | -l <level> ] [ -o <format> ] <minim> <purpose> [ <target> ]"])
     , (["push"], (lambda options, args: (argminmax(2, 3) if options.rodir else len(args) == 3)),
-          ["push <zip> | -d <dir> [ -f ] [ -r <rosrs_uri> ] [ -t <access_token> ] [ --asynchronous ]"])
+          ["push <zip> | [ --zip ] -d <dir> [ -f ] [ -r <rosrs_uri> ] [ -t <access_token> ] [ --asynchronous ] [ --dry-run ]"])
     , (["checkout"], argminmax(2, 3),
-          ["checkout <RO-name> [ -d <dir>] [ -r <rosrs_uri> ] [ -t <access_token> ]"])
+          ["checkout <RO-name> [ -d <dir>] [ -r <rosrs_uri> ] [ -t <access_token> ] [ --checksum <md5-or-sha256> ]"])
     , (["dump"], argminmax(2, 3),
           ["dump [ -d <dir> | <rouri> ] [ -o <format> ]"])
     , (["manifest"], argminmax(2, 3),
           ["manifest [ -d <dir> | <rouri> ] [ -o <format> ]"])
+    , (["compact"], argminmax(2, 2),
+          ["compact [ -d <dir> ]"])
+    , (["compact-annotations"], argminmax(2, 2),
+          ["compact-annotations [ -d <dir> ] [ --by-date ]"])
+    , (["migrate-format"], argminmax(2, 2),
+          ["migrate-format [ -d <dir> ] [ -o <format> ] [ --compression <method> ]"])
     , (["snapshot"],  argminmax(4, 4),
           ["snapshot <live-RO> <snapshot-id> [ --asynchronous ] [ --freeze ] [ -t <access_token> ] [ -r <rosrs_uri> ]"])
     , (["archive"],  argminmax(4, 4),
@@ -353,6 +380,12 @@ def create(progname, configbase, options, args):
     manifestfile = open(manifestfilename, 'w')
     manifestfile.write(manifest)
     manifestfile.close()
+    # Rewrite manifest if configured to use a different RDF syntax or compression
+    format      = ro_manifest.getMetadataFormat(ro_config)
+    compression = ro_manifest.getMetadataCompression(ro_config)
+    if format != "RDFXML" or compression != "none":
+        ro_manifest.writeManifestGraph(ro_dir, ro_manifest.readManifestGraph(ro_dir),
+            format=format, compression=compression)
     return 0
 
 def status(progname, configbase, options, args):
@@ -378,8 +411,10 @@ def status(progname, configbase, options, args):
     # Read manifest and display status
     if options.verbose:
         print "ro status -d \"%(rodir)s\"" % ro_options
-    rometa = ro_metadata(ro_config, ro_dir)
-    rodict = rometa.getRoMetadataDict()
+    # Only RO-level properties are needed, so avoid reading the whole manifest
+    rodict = ro_manifest.readManifestHeader(ro_dir)
+    if rodict['rouri'] and ro_uriutils.isFileUri(rodict['rouri']):
+        rodict['ropath'] = ro_uriutils.getFilenameFromUri(rodict['rouri'])
     print "Research Object status"
     print "  identifier:  %(roident)s, title: %(rotitle)s" % rodict
     print "  creator:     %(rocreator)s, created: %(rocreated)s" % rodict
@@ -455,9 +490,10 @@ def add(progname, configbase, options, args):
     Add files to a research object manifest
 
     ro add [ -d dir ] file
-    ro add [ -d dir ] [-a] [directory]
+    ro add [ -d dir ] [-a [--prune]] [directory]
 
-    Use -a/--all to add subdirectories recursively
+    Use -a/--all to add subdirectories recursively, and --prune to also remove
+    resources that are no longer present in the directory from the RO.
 
     If no file or directory specified, defaults to current directory.
     """
@@ -466,18 +502,34 @@ def add(progname, configbase, options, args):
         "rodir":        options.rodir or "",
         "rofile":       args[2] if len(args) == 3 else ".",
         "recurse":      options.all,
-        "recurseopt":   "-a" if options.all else ""
+        "recurseopt":   "-a" if options.all else "",
+        "prune":        options.prune,
+        "pruneopt":     " --prune" if options.prune else ""
         }
     log.debug("ro_options: " + repr(ro_options))
+    if ro_options['prune'] and not (ro_options['recurse'] and os.path.isdir(ro_options['rofile'])):
+        print ("%s add: --prune option requires -a and a directory" % (progname))
+        return 1
     # Find RO root directory
     ro_dir = ro_root_directory(progname + " add", ro_config, ro_options['rodir'])
     if not ro_dir: return 1
     # Read and update manifest
     if options.verbose:
-        print "ro add -d %(rodir)s %(recurseopt)s %(rofile)s" % ro_options
+        print "ro add -d %(rodir)s %(recurseopt)s%(pruneopt)s %(rofile)s" % ro_options
+    def showProgress(count):
+        print "%d entries scanned" % (count)
+        sys.stdout.flush()
+        return
     rometa = ro_metadata(ro_config, ro_dir)
-    rometa.addAggregatedResources(ro_options['rofile'],
-        recurse=ro_options['recurse'], includeDirs=not ro_options['recurse'])
+    added = rometa.addAggregatedResources(ro_options['rofile'],
+        recurse=ro_options['recurse'], includeDirs=not ro_options['recurse'],
+        progress=showProgress if options.verbose else None)
+    if options.verbose:
+        print "%d resources added" % (added)
+    if ro_options['prune']:
+        removed = rometa.pruneAggregatedResources(ro_options['rofile'])
+        if options.verbose:
+            print "%d resources removed" % (removed)
     return 0
 
 def remove(progname, configbase, options, args):
@@ -519,6 +571,99 @@ def remove(progname, configbase, options, args):
         rometa.removeAggregatedResource(rofile)
     return 0
 
+def compact(progname, configbase, options, args):
+    """
+    Fold a research object's manifest journal into its manifest file
+
+    ro compact [ -d dir ]
+    """
+    ro_config = getroconfig(configbase, options)
+    ro_options = {
+        "rodir":        options.rodir or "",
+        }
+    log.debug("ro_options: " + repr(ro_options))
+    # Find RO root directory
+    ro_dir = ro_root_directory(progname + " compact", ro_config, ro_options['rodir'])
+    if not ro_dir: return 1
+    if options.verbose:
+        print "ro compact -d %(rodir)s" % ro_options
+    rometa = ro_metadata(ro_config, ro_dir)
+    folded = rometa.compactManifest()
+    if options.verbose:
+        if folded is None:
+            print "No manifest journal for %s" % (ro_dir)
+        else:
+            print "%d manifest journal records folded into manifest" % (folded)
+    return 0
+
+def compact_annotations(progname, configbase, options, args):
+    """
+    Merge a research object's annotation bodies into one body for each annotated
+    resource, or for each day on which bodies were created
+
+    ro compact-annotations [ -d dir ] [ --by-date ]
+    """
+    ro_config = getroconfig(configbase, options)
+    ro_options = {
+        "rodir":        options.rodir or "",
+        "bydate":       " --by-date" if options.bydate else ""
+        }
+    log.debug("ro_options: " + repr(ro_options))
+    # Find RO root directory
+    ro_dir = ro_root_directory(progname + " compact-annotations", ro_config, ro_options['rodir'])
+    if not ro_dir: return 1
+    if options.verbose:
+        print "ro compact-annotations -d %(rodir)s%(bydate)s" % ro_options
+    rometa = ro_metadata(ro_config, ro_dir)
+    (merged, created) = rometa.compactAnnotations(bydate=options.bydate)
+    if options.verbose:
+        print "%d annotation bodies merged into %d" % (merged, created)
+    return 0
+
+def migrate_format(progname, configbase, options, args):
+    """
+    Convert a research object's manifest and annotation bodies to a different RDF syntax
+    and/or compression
+
+    ro migrate-format [ -d dir ] [ -o format ] [ --compression method ]
+    """
+    ro_config = getroconfig(configbase, options)
+    ro_options = {
+        "rodir":        options.rodir or "",
+        "format":       (options.outformat or "").upper(),
+        "formats":      ", ".join(sorted(ro_manifest.METADATA_FORMATS.keys())),
+        "compression":  (options.compression or "").lower(),
+        "compressions": ", ".join(sorted(ro_manifest.METADATA_COMPRESSIONS.keys()))
+        }
+    log.debug("ro_options: " + repr(ro_options))
+    if not ro_options['format'] and not ro_options['compression']:
+        print ("%s migrate-format: -o or --compression option must be specified" % (progname))
+        return 1
+    if ro_options['format'] and ro_options['format'] not in ro_manifest.METADATA_FORMATS:
+        print ("%s migrate-format: -o option must specify one of: %s" %
+               (progname, ro_options['formats']))
+        return 1
+    if ( ro_options['compression'] and
+         ro_options['compression'] not in ro_manifest.METADATA_COMPRESSIONS ):
+        print ("%s migrate-format: --compression option must specify one of: %s" %
+               (progname, ro_options['compressions']))
+        return 1
+    if ro_options['compression'] == "zstd" and ro_manifest.zstandard is None:
+        print ("%s migrate-format: zstd compression requires the zstandard package" % (progname))
+        return 1
+    # Find RO root directory
+    ro_dir = ro_root_directory(progname + " migrate-format", ro_config, ro_options['rodir'])
+    if not ro_dir: return 1
+    if options.verbose:
+        print "ro migrate-format -d %(rodir)s -o %(format)s --compression %(compression)s" % ro_options
+    rometa = ro_metadata(ro_config, ro_dir)
+    converted = rometa.migrateMetadataFormat(
+        ro_options['format'] or None, ro_options['compression'] or None)
+    if options.verbose:
+        for f in converted:
+            print "Converted %s" % (f)
+    return 0
+
 def mapmerge(f1, l1, f2, l2):
     """
     Helper function to merge lists of values with different map functions.
@@ -607,10 +752,10 @@ def list(progname, configbase, options, args):
     # Scan RO and collect aggregated resources
     try:
         rometa = ro_metadata(ro_config, rouri)
-    except ROSRS_Error, e:
+        roaggs = [ str(rometa.getComponentUriRel(a)) for a in rometa.getAggregatedResources() ]
+    except (ROSRS_Error, IOError), e:
         print str(e)
         return 2
-    roaggs = [ str(rometa.getComponentUriRel(a)) for a in rometa.getAggregatedResources() ]
     # Assemble and output listing
     print "\n".join(mapmerge(prepend_f(prep_a), roaggs, prepend_f(prep_f), rofiles))
     return 0
@@ -622,6 +767,8 @@ def annotate(progname, configbase, options, args):
     ro annotate file attribute-name [ attribute-value ]
     ro link file attribute-name [ attribute-value ]
     """
+    if options.fromfile:
+        return annotate_from_file(progname, configbase, options, args)
     ro_config = getroconfig(configbase, options)
     rodir = options.rodir or (not options.wildcard and os.path.dirname(args[2]))
     if len(args) == 3:
@@ -679,13 +826,58 @@ def annotate(progname, configbase, options, args):
             ro_options["err"] = str(e)
             print '''%(rocmd)s %(anncmd)s -w "%(rofile)s" <...> : %(err)s''' % ro_options
             return 1
-        for rofile in [ str(r) for r in rometa.getAggregatedResources() if rofilepattern.search(str(r)) ]:
-            annotate_single(rofile)
+        rofiles = [ str(r) for r in rometa.getAggregatedResources() if rofilepattern.search(str(r)) ]
+        if not options.onebody:
+            for rofile in rofiles:
+                annotate_single(rofile)
+        elif len(args) == 3:
+            # Add existing graph as annotation, with a single manifest update
+            rometa.addGraphAnnotations(rofiles, ro_options['graph'])
+        else:
+            # Create one annotation graph for all matching resources
+            rometa.addSharedSimpleAnnotation(rofiles,
+                ro_options['roattribute'], ro_options['rovalue'],
+                ro_options['defaultType'])
     else:
         rofile = ro_uriutils.resolveFileAsUri(ro_options['rofile'])  # Relative to CWD
         annotate_single(rofile)
     return 0
 
+def annotate_from_file(progname, configbase, options, args):
+    """
+    Annotate research object components with (resource, attribute, value) rows read
+    from a CSV, TSV or JSON-lines file.  Resources are relative to the RO directory.
+
+    ro annotate [ -d dir ] --from-file file [ --one-body ]
+    ro link [ -d dir ] --from-file file [ --one-body ]
+    """
+    ro_config = getroconfig(configbase, options)
+    ro_options = {
+        "rodir":        options.rodir or "",
+        "fromfile":     options.fromfile,
+        "onebody":      " --one-body" if options.onebody else "",
+        "defaultType":  "resource" if args[1] == "link" else "string",
+        "rocmd":        progname,
+        "anncmd":       args[1]
+        }
+    log.debug("ro_options: " + repr(ro_options))
+    ro_dir = ro_root_directory("%s %s" % (progname, args[1]), ro_config, ro_options['rodir'])
+    if not ro_dir: return 1
+    if options.verbose:
+        print "%(rocmd)s %(anncmd)s -d %(rodir)s --from-file %(fromfile)s%(onebody)s" % ro_options
+    rometa = ro_metadata(ro_config, ro_dir)
+    try:
+        (count, bodies) = rometa.addSimpleAnnotations(
+            ro_annotation.readAnnotationRows(ro_options['fromfile']),
+            defaultType=ro_options['defaultType'], onebody=options.onebody)
+    except (IOError, ValueError) as e:
+        ro_options["err"] = str(e)
+        print "%(rocmd)s %(anncmd)s --from-file %(fromfile)s: %(err)s" % ro_options
+        return 1
+    if options.verbose:
+        print "%d annotations added in %d annotation bodies" % (count, bodies)
+    return 0
+
 def annotations(progname, configbase, options, args):
     """
     Display annotations
@@ -710,19 +902,23 @@ def annotations(progname, configbase, options, args):
         print cmdname + " -d \"%(rodir)s\" %(rofile)s " % ro_options
     # Enumerate and display annotations
     log.debug("- displaying annotations for %s"%(rouri))
-    rometa = ro_metadata(ro_config, rouri)
-    if ro_options['rofile']:
-        rofile = ro_uriutils.resolveFileAsUri(ro_options['rofile'])  # Relative to CWD
-        log.debug("Annotations for %s" % str(rofile))
-        annotations = rometa.getFileAnnotations(rofile)
-    else:
-        annotations = rometa.getAllAnnotations()
-    if options.debug:
-        log.debug("---- Annotations:")
-        for a in annotations:
-            log.debug("  %s" % repr(a))
-        log.debug("----")
-    rometa.showAnnotations(annotations, sys.stdout)
+    try:
+        rometa = ro_metadata(ro_config, rouri)
+        if ro_options['rofile']:
+            rofile = ro_uriutils.resolveFileAsUri(ro_options['rofile'])  # Relative to CWD
+            log.debug("Annotations for %s" % str(rofile))
+            annotations = rometa.getFileAnnotations(rofile)
+        else:
+            annotations = rometa.getAllAnnotations()
+        if options.debug:
+            log.debug("---- Annotations:")
+            for a in annotations:
+                log.debug("  %s" % repr(a))
+            log.debug("----")
+        rometa.showAnnotations(annotations, sys.stdout)
+    except (ROSRS_Error, IOError), e:
+        print str(e)
+        return 2
     return 0
 
 def snapshot(progname, configbase, options, args):
@@ -780,21 +976,35 @@ def push_zip(progname, configbase, options, args):
     """
     push RO in zip format
     
-    ro push <zip> | -d <dir> [ -f ] [-- new ] [ -r <rosrs_uri> ] [ -t <access_token> [ --asynchronous ] ]    
+    ro push <zip> | --zip -d <dir> [ -f ] [-- new ] [ -r <rosrs_uri> ] [ -t <access_token> [ --asynchronous ] ]    
+
+    With --zip -d <dir>, the zip file is created from the RO directory as it is
+    sent, without writing a temporary file.
     """
     ro_config = getroconfig(configbase, options)
+    if len(args) == 3:
+        zipsource = args[2]
+        roId      = args[2].replace(".zip", "").split("/")[-1]
+        # Zip file is read as it is sent
+        zipdata   = open(args[2], 'rb')
+    else:
+        ro_dir = ro_root_directory(progname + " push", ro_config, options.rodir)
+        if not ro_dir: return 1
+        zipsource = "--zip -d "+options.rodir
+        roId      = os.path.basename(os.path.normpath(ro_dir))
+        zipdata   = ZipStream.iterZipData(ro_manifest.iterROZipMembers(ro_dir))
     ro_options = {
-        "zip": args[2],
+        "zip": zipsource,
         "rosrs_uri":          ro_config['rosrs_uri'],
         "rosrs_access_token": ro_config['rosrs_access_token'],
         "force":          options.force,
-        "roId": args[2].replace(".zip", "").split("/")[-1]
+        "roId": roId
         }
 
     if options.roident:
         ro_options["roId"] = options.roident
     if options.verbose:
-        echo = "ro push %(zip)s -r %(rosrs_uri)s -t %(rosrs_access_token)s -i %(roId)s" % dict(ro_options.items() + {'zip':args[2], 'roId':ro_options["roId"]}.items())
+        echo = "ro push %(zip)s -r %(rosrs_uri)s -t %(rosrs_access_token)s -i %(roId)s" % ro_options
         if options.asynchronous:
          echo+=" --asynchronous"
         if options.new:
@@ -802,9 +1012,12 @@ def push_zip(progname, configbase, options, args):
         print echo
     rosrs = ROSRS_Session(ro_options["rosrs_uri"], ro_options["rosrs_access_token"])
     if options.new:
-        (status, reason, headers, data) = ro_remote_metadata.sendZipRO(rosrs, ro_options["rosrs_uri"], ro_options["roId"], open(args[2], 'rb').read(),"zip/create")
+        (status, reason, headers, data) = ro_remote_metadata.sendZipRO(rosrs, ro_options["rosrs_uri"], ro_options["roId"], zipdata,"zip/create")
     else:
-        (status, reason, headers, data) = ro_remote_metadata.sendZipRO(rosrs, ro_options["rosrs_uri"], ro_options["roId"], open(args[2], 'rb').read())
+        (status, reason, headers, data) = ro_remote_metadata.sendZipRO(rosrs, ro_options["rosrs_uri"], ro_options["roId"], zipdata)
+    if "location" not in headers:
+        print "Error sending RO zip: %03d %s" % (status, reason)
+        return 1
     jobUri = headers["location"]
     (job_status, target_id, processed_resources, submitted_resources) = ro_utils.parse_job(rosrs, headers["location"])
     print "Your Research Object %s is already processed" % target_id
@@ -876,7 +1089,10 @@ def push(progname, configbase, options, args):
     """
     Push all or selected ROs and their resources to ROSRS
 
-    ro push <zip> | -d <dir> [ -f ] [ -r <rosrs_uri> ] [ -t <access_token> ]
+    ro push <zip> | -d <dir> [ -f ] [ -r <rosrs_uri> ] [ -t <access_token> ] [ --dry-run ]
+
+    With --dry-run, the actions that would be performed to push the RO directory
+    are displayed, and nothing is changed.
     """
     ro_config = getroconfig(configbase, options)
     ro_options = {
@@ -887,7 +1103,7 @@ def push(progname, configbase, options, args):
         }
     log.debug("ro_options: " + repr(ro_options))
     
-    if len(args) == 3:
+    if len(args) == 3 or options.zip:
         return push_zip(progname, configbase, options, args)
     if options.verbose:
         print "ro push -d %(rodir)s -r %(rosrs_uri)s -t %(rosrs_access_token)s" % ro_options
@@ -898,6 +1114,8 @@ def push(progname, configbase, options, args):
     if roId.startswith("/"): 
         roId = roId.replace("/", "", 1)
     rosrs = ROSRS_Session(ro_options["rosrs_uri"], ro_options["rosrs_access_token"])
+    if getattr(options, "dryrun", False):
+        return push_plan(rosrs, ro_config, localRo, roId, options.verbose)
     (status, _, rouri, _) = ro_remote_metadata.createRO(rosrs, roId)
     if status == 201:
         print "Created RO: %s" % (rouri)
@@ -905,11 +1123,16 @@ def push(progname, configbase, options, args):
         rouri = urlparse.urljoin(ro_options["rosrs_uri"], roId + "/")
         print "RO already exists: %s" % (rouri)
     remoteRo = ro_remote_metadata.ro_remote_metadata(ro_config, rosrs, rouri)
+    # Resources are uploaded concurrently, optionally limiting the request rate
+    HttpSession.getConnectionPool().setRateLimit(
+        ro_config.get("pushRateLimit", ro_settings.PUSH_RATE_LIMIT))
     pushedResCnt = 0
     pushedAnnCnt = 0
     deletedResCnt = 0
     deletedAnnCnt = 0
-    for (action, resuri) in ro_rosrs_sync.pushResearchObject(localRo, remoteRo):
+    for (action, resuri) in ro_rosrs_sync.pushResearchObject(localRo, remoteRo,
+            workers=ro_config.get("pushWorkers", ro_settings.PUSH_WORKERS),
+            trustetags=ro_config.get("pushTrustETags", ro_settings.PUSH_TRUST_ETAGS)):
         if action == ro_rosrs_sync.ACTION_AGGREGATE_INTERNAL:
             print "Resource uploaded: %s" % (resuri)
             log.debug("Resource uploaded: %s" % (resuri))
@@ -940,6 +1163,10 @@ def push(progname, configbase, options, args):
         elif action == ro_rosrs_sync.ACTION_SKIP:
             print "Resource skipped: %s" % (resuri)
             log.debug("Resource skipped: %s" % (resuri))
+        elif action == ro_rosrs_sync.ACTION_SKIP_ANNOTATION:
+            if options.verbose:
+                print "Annotation skipped: %s" % (resuri)
+            log.debug("Annotation skipped: %s" % (resuri))
         elif action == ro_rosrs_sync.ACTION_DELETE:
             # TODO ask user for confirmation
             print "Resource deleted in ROSRS: %s" % (resuri)
@@ -956,11 +1183,62 @@ def push(progname, configbase, options, args):
         % (pushedResCnt, pushedAnnCnt, deletedResCnt, deletedAnnCnt)
     return 0
 
+def push_plan(rosrs, ro_config, localRo, roId, verbose):
+    """
+    Display the actions that would be performed to push an RO directory, without
+    changing anything in ROSRS.
+    """
+    rouri = urlparse.urljoin(rosrs.baseuri(), roId + "/")
+    (status, reason, _, _) = rosrs.doRequest(rouri, method="HEAD")
+    if status == 404:
+        # Plan against an empty RO
+        print "RO would be created: %s" % (rouri)
+        remoteRo = ro_remote_metadata.ro_remote_metadata(ro_config, rosrs, rouri, empty=True)
+    elif status in [200, 302, 303, 307]:
+        print "RO already exists: %s" % (rouri)
+        remoteRo = ro_remote_metadata.ro_remote_metadata(ro_config, rosrs, rouri)
+    else:
+        print "Error accessing RO %s: %03d %s" % (rouri, status, reason)
+        return 2
+    descriptions = (
+        { ro_rosrs_sync.ACTION_AGGREGATE_INTERNAL:   "Resource to upload: %s"
+        , ro_rosrs_sync.ACTION_AGGREGATE_EXTERNAL:   "External resource to push: %s"
+        , ro_rosrs_sync.ACTION_AGGREGATE_ANNOTATION: "Annotation to push: %s"
+        , ro_rosrs_sync.ACTION_UPDATE_OVERWRITE:     "Resource to upload (WARNING: it will overwrite changes in RODL): %s"
+        , ro_rosrs_sync.ACTION_UPDATE:               "Resource to upload: %s"
+        , ro_rosrs_sync.ACTION_UPDATE_ANNOTATION:    "Annotation to update: %s"
+        , ro_rosrs_sync.ACTION_SKIP:                 "Resource to skip: %s"
+        , ro_rosrs_sync.ACTION_SKIP_ANNOTATION:      "Annotation to skip: %s"
+        , ro_rosrs_sync.ACTION_DELETE:               "Resource to delete in ROSRS: %s"
+        , ro_rosrs_sync.ACTION_DELETE_ANNOTATION:    "Annotation to delete in ROSRS: %s"
+        , ro_rosrs_sync.ACTION_ERROR:                "%s"
+        })
+    counts = {}
+    for (action, resuri) in ro_rosrs_sync.pushResearchObject(localRo, remoteRo,
+            workers=ro_config.get("pushWorkers", ro_settings.PUSH_WORKERS), dryrun=True,
+            trustetags=ro_config.get("pushTrustETags", ro_settings.PUSH_TRUST_ETAGS)):
+        if verbose or action not in ro_rosrs_sync.ANNOTATION_ACTIONS:
+            print descriptions[action] % (resuri)
+        counts[action] = counts.get(action, 0) + 1
+    def count(actions):
+        return sum( counts.get(a, 0) for a in actions )
+    print "%d resources to push, %d annotations to push, %d resources to delete, %d annotations to delete" \
+        % ( count([ ro_rosrs_sync.ACTION_AGGREGATE_INTERNAL, ro_rosrs_sync.ACTION_AGGREGATE_EXTERNAL
+                  , ro_rosrs_sync.ACTION_UPDATE_OVERWRITE, ro_rosrs_sync.ACTION_UPDATE ])
+          , count([ ro_rosrs_sync.ACTION_AGGREGATE_ANNOTATION, ro_rosrs_sync.ACTION_UPDATE_ANNOTATION ])
+          , count([ ro_rosrs_sync.ACTION_DELETE ])
+          , count([ ro_rosrs_sync.ACTION_DELETE_ANNOTATION ])
+          )
+    return 0
+
 def checkout(progname, configbase, options, args):
     """
     Checkout a RO from ROSRS
 
-    ro checkout <RO-identifier> [-d <dir> ] [ -r <rosrs_uri> ] [ -t <access_token> ]
+    ro checkout <RO-identifier> [-d <dir> ] [ -r <rosrs_uri> ] [ -t <access_token> ] [ --checksum <md5-or-sha256> ]
+
+    The RO zip is written to a temporary file as it is received, checked against
+    any Content-MD5 header and the checksum option, then extracted concurrently.
     """
     ro_config = getroconfig(configbase, options)
     ro_options = {
@@ -975,25 +1253,33 @@ def checkout(progname, configbase, options, args):
     ro_dir = os.path.join(ro_options['rodir'], ro_options["roident"])
     if not ro_dir: return 1
     rouri = urlparse.urljoin(ro_options["rosrs_uri"], ro_options["roident"])
+    rosrs = ROSRS_Session(ro_options["rosrs_uri"], ro_options["rosrs_access_token"])
+    progress = None
+    if options.verbose:
+        reported = [0]
+        def progress(size, length):
+            if size - reported[0] >= 1024*1024 or size == length:
+                reported[0] = size
+                print "%d of %s bytes received" % (size, length or "?")
     try:
-        zipdata = ro_remote_metadata.getAsZip(rouri)
-        __unpackZip(zipdata, ro_dir, options.verbose)
-    except urllib2.URLError as e:
+        zipdata = ro_remote_metadata.getAsZip(rouri, httpsession=rosrs,
+            progress=progress, checksum=getattr(options, "checksum", None))
+        try:
+            __unpackZip(zipdata, ro_dir, options.verbose)
+        finally:
+            zipdata.close()
+    except (urllib2.URLError, IOError, ROSRS_Error, ro_remote_metadata.ROSRS_Error) as e:
         print "Could not checkout %s: %s" % (rouri, e)
     return 0
 
 def __unpackZip(verzip, rodir, verbose):
-    zipfile = ZipFile(verzip)
+    members = ro_remote_metadata.extractZip(verzip.name, rodir)
 
     if verbose:
-        for l in zipfile.namelist():
+        for l in members:
             print os.path.join(rodir, l)
 
-    if not os.path.exists(rodir) or not os.path.isdir(rodir):
-        os.mkdir(rodir)
-    zipfile.extractall(rodir)
-
-    print "%d files checked out" % len(zipfile.namelist())
+    print "%d files checked out" % len(members)
     return 0
 
 def evaluate(progname, configbase, options, args):
@@ -1028,9 +1314,13 @@ def evaluate(progname, configbase, options, args):
         ro_options["target"]  = ((len(args) > 5) and args[5]) or "."
         if options.verbose:
             print "ro evaluate %(function)s -d \"%(rodir)s\" %(minim)s %(purpose)s %(target)s" % ro_options
-        rometa = ro_metadata(ro_config, ro_ref)
-        (minimgraph, evalresult) = ro_eval_minim.evaluate(rometa,
-            ro_options["minim"], ro_options["target"], ro_options["purpose"])
+        try:
+            rometa = ro_metadata(ro_config, ro_ref)
+            (minimgraph, evalresult) = ro_eval_minim.evaluate(rometa,
+                ro_options["minim"], ro_options["target"], ro_options["purpose"])
+        except (ROSRS_Error, IOError), e:
+            print str(e)
+            return 2
         if options.verbose:
             print "== Evaluation result =="
             print json.dumps(evalresult, indent=2)
@@ -1072,11 +1362,14 @@ def dump(progname, configbase, options, args):
         else:
             print cmdname + (" -d \"%(rodir)s\" " % ro_options)
     # Enumerate and display annotations
-    rometa = ro_metadata(ro_config, rouri)
     format = "RDFXML"
     if options.outformat and options.outformat.upper() in RDFTYPSERIALIZERMAP:
         format = options.outformat.upper()
-    graph = rometa.getAnnotationGraph()
+    try:
+        graph = ro_metadata(ro_config, rouri).getAnnotationGraph()
+    except (ROSRS_Error, IOError), e:
+        print str(e)
+        return 2
     graph.serialize(destination=sys.stdout, format=RDFTYPSERIALIZERMAP[format])
     return 0
 
@@ -1101,11 +1394,14 @@ def manifest(progname, configbase, options, args):
         else:
             print cmdname + (" -d \"%(rodir)s\" " % ro_options)
     # Enumerate and display annotations
-    rometa = ro_metadata(ro_config, rouri)
     format = "RDFXML"
     if options.outformat and options.outformat.upper() in RDFTYPSERIALIZERMAP:
         format = options.outformat.upper()
-    graph = rometa.getManifestGraph()
+    try:
+        graph = ro_metadata(ro_config, rouri).getManifestGraph()
+    except (ROSRS_Error, IOError), e:
+        print str(e)
+        return 2
     graph.serialize(destination=sys.stdout, format=RDFTYPSERIALIZERMAP[format])
     return 0
 
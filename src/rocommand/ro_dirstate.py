@@ -0,0 +1,164 @@
+# ro_dirstate.py
+
+"""
+Research Object directory state: a record, saved in the RO metadata directory, of
+the files and sub-directories found in each directory of a research object.  This
+is used to enumerate the RO content without listing directories that have not
+been modified since they were last listed.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2011-2013, University of Oxford"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os
+import os.path
+import time
+import logging
+
+try:
+    # Running Python 2.5 with simplejson?
+    import simplejson as json
+except ImportError:
+    import json
+
+log = logging.getLogger(__name__)
+
+import MiscUtils.ScanDirectories
+
+import ro_settings
+from ro_checksum import getFileStamp
+
+# A directory modified less than this long (in nanoseconds) before it is listed may
+# be modified again without its modification time changing, so its listing is not
+# trusted when the directory is next scanned.
+RACY_INTERVAL = 2*1000000000
+
+def makeDirStateFilename(rodir):
+    return os.path.join(rodir, ro_settings.MANIFEST_DIR+"/", ro_settings.DIRECTORY_STATE)
+
+def readDirState(rodir):
+    """
+    Read saved directory state for research object.
+
+    Returns a dictionary mapping the path of each directory listed, relative to the
+    RO directory and ending with a path separator ("" for the RO directory itself),
+    to a dictionary with keys:
+        "mtime"     directory modification time in nanoseconds, or None if the
+                    directory listing is not to be trusted
+        "files"     a dictionary mapping names of files in the directory to file
+                    stamps (see ro_checksum.getFileStamp)
+        "dirs"      a list of names of sub-directories
+    An empty dictionary is returned if there is no valid saved state.
+    """
+    try:
+        with open(makeDirStateFilename(rodir), "r") as f:
+            dirstate = json.load(f)
+        # File names are saved as Latin-1 so that any byte string can be restored
+        return dict(
+            ( d.encode("latin-1")
+            , { "mtime": e["mtime"]
+              , "files": dict( (n.encode("latin-1"), v) for (n, v) in e["files"].iteritems() )
+              , "dirs":  [ n.encode("latin-1") for n in e["dirs"] ]
+              }
+            ) for (d, e) in dirstate.iteritems() )
+    except (IOError, ValueError, KeyError, AttributeError) as e:
+        log.debug("readDirState: %s"%(repr(e)))
+    return {}
+
+def writeDirState(rodir, dirstate):
+    """
+    Save directory state for research object.  The state file is replaced in
+    a single operation, so concurrent readers see the old or new state.
+    """
+    filename = makeDirStateFilename(rodir)
+    tempname = filename+".tmp"
+    with open(tempname, "w") as f:
+        json.dump(dirstate, f, encoding="latin-1")
+    os.rename(tempname, filename)
+    return
+
+def _getMtime(path):
+    st = os.stat(path)
+    return getattr(st, "st_mtime_ns", None) or int(st.st_mtime*1000000000)
+
+def _getEntryStamp(path):
+    """
+    Returns a file stamp for a directory entry (see ro_checksum.getFileStamp).  For a
+    symbolic link whose target does not exist, the stamp of the link itself is used,
+    so the entry is still listed.  Returns None if the entry no longer exists.
+    """
+    try:
+        return getFileStamp(path)
+    except OSError:
+        try:
+            st = os.lstat(path)
+        except OSError as e:
+            log.debug("iterDirectoryContents: %s"%(repr(e)))
+            return None
+        return [st.st_ino, st.st_size, int(st.st_mtime*1000000000)]
+
+def iterDirectoryContents(rodir, srcdir, dirstate, listDirs=False, listFiles=True):
+    """
+    Generate the contents of a directory within a research object and all its
+    sub-directories, skipping hidden files and directories.  Paths generated are
+    relative to the RO directory, with directory names ending in a separator.
+
+    Directories whose modification time is unchanged since they were recorded in the
+    directory state are not listed, and the recorded contents are used: files and
+    sub-directories added or removed change the modification time of the directory
+    that contains them.  Only files not already recorded are examined.
+
+    rodir       is the RO directory
+    srcdir      is the directory to be scanned, which must be rodir or one of its
+                sub-directories
+    dirstate    is a directory state, as returned by readDirState, which is updated
+                with the directory contents found.  Directories under srcdir that are
+                no longer present are removed from the state when all the contents
+                have been generated.
+    """
+    if not rodir.endswith(os.path.sep):  rodir  += os.path.sep
+    if not srcdir.endswith(os.path.sep): srcdir += os.path.sep
+    srcrel  = srcdir.replace(rodir, "", 1) if srcdir != rodir else ""
+    visited = set()
+    pending = [srcrel]
+    while pending:
+        dirrel = pending.pop()
+        try:
+            mtime = _getMtime(rodir+dirrel)
+        except OSError as e:
+            log.debug("iterDirectoryContents: %s"%(repr(e)))
+            continue
+        visited.add(dirrel)
+        entry = dirstate.get(dirrel)
+        if entry is None or entry["mtime"] is None or entry["mtime"] != mtime:
+            log.debug("iterDirectoryContents: listing %s"%(dirrel))
+            oldfiles = entry["files"] if entry else {}
+            listed   = time.time()
+            files    = {}
+            dirs     = []
+            for (name, path, isdirectory) in MiscUtils.ScanDirectories._ListDirectory(rodir+dirrel):
+                if name.startswith("."):
+                    continue
+                if isdirectory:
+                    dirs.append(name)
+                else:
+                    stamp = oldfiles.get(name) or _getEntryStamp(path)
+                    if stamp is not None:
+                        files[name] = stamp
+            if int(listed*1000000000) - mtime < RACY_INTERVAL:
+                mtime = None
+            entry = { "mtime": mtime, "files": files, "dirs": sorted(dirs) }
+            dirstate[dirrel] = entry
+        for name in entry["dirs"]:
+            if listDirs: yield dirrel+name+os.path.sep
+            pending.append(dirrel+name+os.path.sep)
+        if listFiles:
+            for name in entry["files"]:
+                yield dirrel+name
+    # Forget directories that have been removed
+    for dirrel in [ d for d in dirstate if d.startswith(srcrel) and d not in visited ]:
+        del dirstate[dirrel]
+    return
+
+# End.
@@ -15,45 +15,537 @@ import re
 import urlparse
 import urllib
 import logging
+import StringIO
+import io
+import gzip
+import xml.etree.cElementTree as ElementTree
+
+try:
+    # Running Python 2.5 with simplejson?
+    import simplejson as json
+except ImportError:
+    import json
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None    # No advisory file locking on this platform (e.g. Windows)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None    # zstd compression of RO metadata is not available
 
 log = logging.getLogger(__name__)
 
 import MiscUtils.ScanDirectories
 
 import rdflib
-###import rdflib.namespace
+import rdflib.namespace
 #from rdflib import URIRef, Namespace, BNode
 #from rdflib import Literal
 
 import ro_settings
+import ro_prefixes
 from ro_namespaces import RDF, DCTERMS, RO, AO, ORE
+from ro_checksum   import getFileStamp
+from ro_uriutils   import UriCache
 
 def makeManifestFilename(rodir):
     return os.path.join(rodir, ro_settings.MANIFEST_DIR+"/", ro_settings.MANIFEST_FILE)
 
-def readManifestGraph(rodir):
+def makeManifestJournalFilename(rodir):
+    return os.path.join(rodir, ro_settings.MANIFEST_DIR+"/", ro_settings.MANIFEST_JOURNAL)
+
+# RDF syntaxes used for storing RO metadata: rdflib parser and serializer format
+# names, and the file extension used for new annotation bodies.
+METADATA_FORMATS = (
+    { "RDFXML": ("xml", "xml",    ".rdf")
+    , "TURTLE": ("n3",  "turtle", ".ttl")
+    , "NT":     ("nt",  "nt",     ".nt")
+    })
+
+# Compression of stored RO metadata files: suffix added to the metadata file name.
+# URIs of RO metadata resources do not include the suffix, so compression is not
+# visible outside the RO metadata directory.
+METADATA_COMPRESSIONS = (
+    { "none": ""
+    , "gzip": ".gz"
+    , "zstd": ".zst"
+    })
+
+NTRIPLE_LINE = re.compile(
+    r'^(<[^>\s]*>|_:\S+)\s+<[^>\s]*>\s+(<[^>\s]*>|_:\S+|".*"(@[\w-]+|\^\^<[^>\s]*>)?)\s*\.\s*$')
+
+def getMetadataFormat(ro_config):
+    """
+    Return RDF syntax configured for new RO metadata (a key of METADATA_FORMATS)
+    """
+    format = (ro_config.get("metadataFormat") or ro_settings.METADATA_FORMAT).upper()
+    if format not in METADATA_FORMATS:
+        log.warning("Unrecognized metadata format %s, using %s"%(format, ro_settings.METADATA_FORMAT))
+        format = ro_settings.METADATA_FORMAT
+    return format
+
+def getMetadataCompression(ro_config):
+    """
+    Return compression configured for new RO metadata files (a key of
+    METADATA_COMPRESSIONS)
+    """
+    compression = (ro_config.get("metadataCompression") or
+                   ro_settings.METADATA_COMPRESSION).lower()
+    if compression not in METADATA_COMPRESSIONS:
+        log.warning("Unrecognized metadata compression %s, using none"%(compression))
+        compression = "none"
+    if compression == "zstd" and zstandard is None:
+        log.warning("zstd compression requires the zstandard package, using gzip")
+        compression = "gzip"
+    return compression
+
+def getMetadataStoredFile(filename):
+    """
+    Return (storedname, compression) for the file that stores the indicated RO
+    metadata file, where storedname is the supplied name, or the name with a
+    compression suffix if the metadata is stored compressed, and compression is a
+    key of METADATA_COMPRESSIONS.  If no such file exists, the supplied name is
+    returned with no compression.
+    """
+    if os.path.exists(filename):
+        return (filename, "none")
+    for (compression, suffix) in METADATA_COMPRESSIONS.iteritems():
+        if suffix and os.path.exists(filename+suffix):
+            return (filename+suffix, compression)
+    return (filename, "none")
+
+def getMetadataStoredFilename(filename):
+    """
+    Return name of the file that stores the indicated RO metadata file (see
+    getMetadataStoredFile).
+    """
+    return getMetadataStoredFile(filename)[0]
+
+def getMetadataStoredCompression(filename):
+    """
+    Return compression (a key of METADATA_COMPRESSIONS) of stored RO metadata file
+    """
+    return getMetadataStoredFile(filename)[1]
+
+def openMetadataFile(filename):
+    """
+    Open RO metadata file for reading, decompressing its content if it is stored
+    compressed.  Raises IOError if the file does not exist.
+    """
+    (storedname, compression) = getMetadataStoredFile(filename)
+    if compression == "gzip":
+        return gzip.GzipFile(storedname, "rb")
+    if compression == "zstd":
+        with open(storedname, "rb") as f:
+            return io.BytesIO(decompressMetadataData(f.read(), compression, storedname))
+    return open(storedname, "rb")
+
+def decompressMetadataData(data, compression, name=""):
+    """
+    Return content of RO metadata stored with the indicated compression (a key of
+    METADATA_COMPRESSIONS).  name is used only in error messages.
+    """
+    if compression == "gzip":
+        with gzip.GzipFile(fileobj=io.BytesIO(data), mode="rb") as f:
+            return f.read()
+    if compression == "zstd":
+        if zstandard is None:
+            raise IOError("Can't read %s: zstandard package not installed"%(name))
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+def readMetadataData(filename):
+    """
+    Return content of RO metadata file, decompressed if it is stored compressed.
+    """
+    with openMetadataFile(filename) as f:
+        return f.read()
+
+def writeMetadataData(filename, data, compression=None):
+    """
+    Write content of RO metadata file, compressed as indicated (a key of
+    METADATA_COMPRESSIONS), defaulting to the compression of the existing file.
+    Any copy of the file stored with a different compression is removed.
+    """
+    compression = compression or getMetadataStoredCompression(filename)
+    storedname  = filename+METADATA_COMPRESSIONS[compression]
+    if compression == "gzip":
+        with gzip.GzipFile(storedname, "wb") as f:
+            f.write(data)
+    else:
+        if compression == "zstd":
+            data = zstandard.ZstdCompressor().compress(data)
+        with open(storedname, "wb") as f:
+            f.write(data)
+    for suffix in METADATA_COMPRESSIONS.itervalues():
+        if filename+suffix != storedname and os.path.exists(filename+suffix):
+            os.remove(filename+suffix)
+    return
+
+def guessMetadataFormat(filename, data=None):
+    """
+    Return RDF syntax (a key of METADATA_FORMATS) of an RO metadata file, based on
+    the start of its content and its file extension.
+
+    data        if supplied, is the content of the file, which is then not read.
+
+    RDF/XML is assumed if the file cannot be read.
+    """
+    if data is not None:
+        head = data[:4096]
+    else:
+        try:
+            with openMetadataFile(filename) as f:
+                head = f.read(4096)
+        except IOError:
+            return "RDFXML"
+    text = head.lstrip()
+    if text.startswith("<?xml") or text.startswith("<!"):
+        return "RDFXML"
+    lines = [ l for l in text.splitlines() if l.strip() and not l.lstrip().startswith("#") ]
+    if lines and NTRIPLE_LINE.match(lines[0].strip()) and not re.search(r"\.(ttl|n3)$", filename):
+        return "NT"
+    if text.startswith("<") and "xmlns" in text:
+        return "RDFXML"
+    if text:
+        return "TURTLE"     # Turtle syntax subsumes N-Triples
+    return "RDFXML"
+
+def parseMetadataFile(rograph, filename, source=None, **args):
+    """
+    Parse RO metadata file into supplied graph, using the RDF syntax of the file.
+
+    rograph     is the RDF graph to which the parsed statements are added
+    filename    is the name of the local file to be parsed
+    source      if supplied, is the URI from which the file is read
+    args        are additional rdflib parser arguments, used only for RDF/XML
+
+    Returns the RDF syntax of the file (a key of METADATA_FORMATS).
+    """
+    # The file is read and decompressed once, and the content used both to
+    # determine the RDF syntax and to parse it
+    (storedname, compression) = getMetadataStoredFile(filename)
+    with open(storedname, "rb") as f:
+        data = decompressMetadataData(f.read(), compression, storedname)
+    format = guessMetadataFormat(filename, data=data)
+    if format != "RDFXML": args = {}
+    rograph.parse(data=data, publicID=source or getFileUri(filename),
+        format=METADATA_FORMATS[format][0], **args)
+    return format
+
+def writeMetadataFile(rograph, filename, rouri, format="RDFXML", compression=None):
+    """
+    Write RO metadata file in indicated RDF syntax.  URIs within the RO are written
+    relative to the RO, where the syntax allows, assuming the file is in the RO
+    metadata directory.
+
+    compression is the compression used for the stored file (a key of
+    METADATA_COMPRESSIONS), defaulting to that of the existing file.
+    """
+    writeMetadataData(filename, serializeMetadata(rograph, rouri, format), compression)
+    return
+
+def serializeMetadata(rograph, rouri, format="RDFXML"):
+    """
+    Return RO metadata graph serialized in the indicated RDF syntax, as it is
+    written to a file in the RO metadata directory.
+    """
+    if format == "RDFXML":
+        return rograph.serialize(format='xml', base=rouri, xml_base="..")
+    if format == "TURTLE":
+        # rdflib's Turtle serializer makes URIs relative to base, but does not declare it
+        return "@base <..> .\n" + rograph.serialize(format='turtle', base=rouri)
+    return rograph.serialize(format=METADATA_FORMATS[format][1])
+
+def readMetadataAsRdfXml(filename, rouri):
+    """
+    Returns content of RO metadata file as RDF/XML, converting from other RDF syntaxes
+    as required.  (ROSRS services expect RO metadata in RDF/XML.)
+    """
+    if guessMetadataFormat(filename) == "RDFXML":
+        return readMetadataData(filename)
+    rograph = rdflib.Graph()
+    for (prefix, uri) in ro_prefixes.prefixes:
+        rograph.bind(prefix, rdflib.namespace.Namespace(uri))
+    parseMetadataFile(rograph, filename)
+    return rograph.serialize(format='xml', base=rouri, xml_base="..")
+
+def readManifestGraph(rodir, rograph=None, manifesturi=None):
     """
     Read manifest file for research object, return RDF Graph of manifest values.
+
+    If a manifest journal is present, the changes it records are replayed over the
+    manifest file contents.
+
+    rodir       is the research object directory
+    rograph     if supplied, is an RDF graph to which the manifest values are added
+    manifesturi if supplied, is the URI from which the manifest file is read
     """
     manifestfilename = makeManifestFilename(rodir)
     log.debug("readManifestGraph: "+manifestfilename)
-    rdfGraph = rdflib.Graph()
-    rdfGraph.parse(manifestfilename)
-    return rdfGraph
+    if rograph is None:
+        rograph = rdflib.Graph()
+    source = manifesturi     # Default is URI of manifest file
+    journalfilename = makeManifestJournalFilename(rodir)
+    if not os.path.exists(journalfilename):
+        parseMetadataFile(rograph, manifestfilename, source=source)
+        return rograph
+    with open(journalfilename, "r") as jf:
+        _lockFile(jf, exclusive=False)
+        try:
+            # Journal records refer to blank nodes by the ids written to the manifest
+            parseMetadataFile(rograph, manifestfilename, source=source, preserve_bnode_ids=True)
+            count = _replayManifestJournal(jf.read(), rograph)
+            log.debug("readManifestGraph: replayed %d journal records"%(count))
+        finally:
+            _unlockFile(jf)
+    return rograph
+
+# Per-process cache of recently used manifest graphs, keyed by RO directory, with values
+# [stamp, graph], where stamp is the value of getManifestStamp when the graph was read.
+_manifestcache = UriCache(ro_settings.MANIFEST_CACHE_SIZE)
+
+def getManifestStamp(rodir):
+    """
+    Returns a value that changes when the manifest file or manifest journal changes.
+    """
+    journalfilename = makeManifestJournalFilename(rodir)
+    journalstamp    = None
+    if os.path.exists(journalfilename):
+        journalstamp = getFileStamp(journalfilename)
+    return [getFileStamp(getMetadataStoredFilename(makeManifestFilename(rodir))), journalstamp]
+
+def getManifestGraph(rodir):
+    """
+    Return manifest graph for research object, using a graph already read by this
+    process if the manifest and journal files have not changed since it was read.
+
+    The graph returned is shared: a caller that modifies it must write it back
+    using writeManifestGraph.  If the write fails, the graph is no longer used.
+    """
+    key    = os.path.abspath(rodir)
+    stamp  = getManifestStamp(rodir)
+    cached = _manifestcache.lookup(key)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    rograph = readManifestGraph(rodir)
+    _manifestcache.put(key, [stamp, rograph])
+    return rograph
+
+def _detachManifestCache(rodir, rograph):
+    """
+    Called before the manifest is written: the cached manifest graph is discarded, so
+    it is not used if the write fails.  Returns True if the cached graph is the graph
+    being written.
+    """
+    key    = os.path.abspath(rodir)
+    cached = _manifestcache.lookup(key)
+    _manifestcache.discard(key)
+    return bool(cached) and cached[1] is rograph
+
+def _updateManifestCache(rodir, rograph):
+    """
+    Called after the manifest has been written from the previously cached graph:
+    the graph is cached again with the new manifest stamp.
+    """
+    _manifestcache.put(os.path.abspath(rodir), [getManifestStamp(rodir), rograph])
+    return
 
-def writeManifestGraph(rodir, rograph):
+def writeManifestGraph(rodir, rograph, rouri=None, format=None, compression=None):
     """
     Write manifest file for research object given RDF graph of contents
+
+    The manifest is written in the indicated RDF syntax (a key of METADATA_FORMATS)
+    and compression (a key of METADATA_COMPRESSIONS), defaulting to those of the
+    existing manifest file.
+
+    Any manifest journal is emptied, as its changes are assumed to be reflected
+    in the graph supplied.
     """
+    journalfilename = makeManifestJournalFilename(rodir)
+    wascached = _detachManifestCache(rodir, rograph)
+    if not os.path.exists(journalfilename):
+        _serializeManifestGraph(rodir, rograph, rouri, format, compression)
+    else:
+        with open(journalfilename, "a+") as jf:
+            _lockFile(jf, exclusive=True)
+            try:
+                _serializeManifestGraph(rodir, rograph, rouri, format, compression)
+                jf.truncate(0)
+            finally:
+                _unlockFile(jf)
+    if wascached:
+        _updateManifestCache(rodir, rograph)
+    return
+
+def _serializeManifestGraph(rodir, rograph, rouri=None, format=None, compression=None):
     manifestfilename = makeManifestFilename(rodir)
-    rograph.serialize(destination=manifestfilename, format='xml', base=getRoUri(rodir), xml_base="..")
+    format = format or guessMetadataFormat(manifestfilename)
+    writeMetadataFile(rograph, manifestfilename, rouri or getRoUri(rodir), format, compression)
+    return
+
+# Manifest journal support
+#
+# When a research object has a manifest journal, changes to the manifest are
+# appended to the journal as add/remove triple records rather than rewriting
+# the whole manifest file.  The journal is replayed over the manifest file when
+# the manifest is read, and is folded back into the manifest file by
+# compactManifest, or when it grows beyond a size limit.
+#
+# Each journal record is a line containing a JSON list:
+#   [op, subject, predicate, object]
+# where op is "+" (add) or "-" (remove), and each term is one of:
+#   ["u", uri], ["b", bnode-id] or ["l", lexical-value, datatype, language]
+
+def hasManifestJournal(rodir):
+    """
+    Returns True if the research object has a manifest journal
+    """
+    return os.path.exists(makeManifestJournalFilename(rodir))
+
+def stopManifestJournal(rodir):
+    """
+    Fold any manifest journal into the manifest file, and remove the journal so that
+    subsequent manifest updates rewrite the manifest file.
+    """
+    journalfilename = makeManifestJournalFilename(rodir)
+    if not os.path.exists(journalfilename):
+        return
+    with open(journalfilename, "a+") as jf:
+        _lockFile(jf, exclusive=True)
+        try:
+            _foldManifestJournal(rodir, jf, None)
+            os.remove(journalfilename)
+        finally:
+            _unlockFile(jf)
+    return
+
+def startManifestJournal(rodir):
+    """
+    Create an empty manifest journal, if none exists, so that subsequent manifest
+    updates are appended to the journal.
+
+    The manifest file should have been written by rdflib (e.g. using writeManifestGraph)
+    so that all blank nodes have stable identifiers.
+    """
+    open(makeManifestJournalFilename(rodir), "a").close()
+    return
+
+def appendManifestJournal(rodir, changes, rouri=None, limit=None):
+    """
+    Append changes to the manifest journal, and fold the journal into the manifest
+    file if it has grown beyond the indicated size limit.
+
+    rodir       is the research object directory
+    changes     is a list of (op, stmt) pairs, where op is "+" to add the statement
+                to the manifest, or "-" to remove it.
+    rouri       is the RO URI used as base when the manifest file is rewritten
+    limit       is the journal size in bytes above which the journal is folded into
+                the manifest file, defaulting to ro_settings.MANIFEST_JOURNAL_LIMIT.
+
+    Returns the number of journal records folded into the manifest file, or 0.
+    """
+    if limit is None: limit = ro_settings.MANIFEST_JOURNAL_LIMIT
+    folded = 0
+    with open(makeManifestJournalFilename(rodir), "a+") as jf:
+        _lockFile(jf, exclusive=True)
+        try:
+            jf.seek(0, os.SEEK_END)
+            jf.write("".join([ _encodeJournalRecord(op, stmt) for (op, stmt) in changes ]))
+            jf.flush()
+            if limit and jf.tell() > limit:
+                folded = _foldManifestJournal(rodir, jf, rouri)
+        finally:
+            _unlockFile(jf)
+    return folded
+
+def compactManifest(rodir, rouri=None):
+    """
+    Fold the manifest journal into the manifest file, leaving an empty journal.
+
+    Returns the number of journal records folded, or None if there is no journal.
+    """
+    journalfilename = makeManifestJournalFilename(rodir)
+    if not os.path.exists(journalfilename):
+        return None
+    with open(journalfilename, "a+") as jf:
+        _lockFile(jf, exclusive=True)
+        try:
+            folded = _foldManifestJournal(rodir, jf, rouri)
+        finally:
+            _unlockFile(jf)
+    return folded
+
+def _foldManifestJournal(rodir, jf, rouri):
+    """
+    Rewrite manifest file with journal changes applied, and empty the journal.
+    The caller must hold an exclusive lock on the open journal file jf.
+    """
+    rograph = rdflib.Graph()
+    for (prefix, uri) in ro_prefixes.prefixes:
+        rograph.bind(prefix, rdflib.namespace.Namespace(uri))
+    parseMetadataFile(rograph, makeManifestFilename(rodir), preserve_bnode_ids=True)
+    jf.seek(0)
+    count = _replayManifestJournal(jf.read(), rograph)
+    _serializeManifestGraph(rodir, rograph, rouri)
+    jf.seek(0)
+    jf.truncate(0)
+    log.debug("_foldManifestJournal: %d records folded into manifest"%(count))
+    return count
+
+def _replayManifestJournal(journal, rograph):
+    count = 0
+    for line in journal.splitlines():
+        if not line.strip(): continue
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            # Probably an incomplete record from an interrupted update
+            log.warning("Ignoring malformed manifest journal record: %s"%(line))
+            continue
+        stmt = tuple([ _decodeJournalTerm(t) for t in rec[1:4] ])
+        if rec[0] == "+":
+            rograph.add(stmt)
+        else:
+            rograph.remove(stmt)
+        count += 1
+    return count
+
+def _encodeJournalRecord(op, stmt):
+    return json.dumps([op]+[ _encodeJournalTerm(t) for t in stmt ])+"\n"
+
+def _encodeJournalTerm(node):
+    if isinstance(node, rdflib.BNode):
+        return ["b", unicode(node)]
+    if isinstance(node, rdflib.Literal):
+        return ["l", unicode(node), node.datatype and unicode(node.datatype), node.language]
+    return ["u", unicode(node)]
+
+def _decodeJournalTerm(term):
+    if term[0] == "b":
+        return rdflib.BNode(term[1])
+    if term[0] == "l":
+        return rdflib.Literal(term[1], lang=term[3], datatype=term[2] and rdflib.URIRef(term[2]))
+    return rdflib.URIRef(term[1])
+
+def _lockFile(f, exclusive):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    return
+
+def _unlockFile(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
     return
 
 def readManifest(rodir):
     """
     Read manifest file for research object, return dictionary of manifest values.
     """
-    rdfGraph = readManifestGraph(rodir)
+    rdfGraph = getManifestGraph(rodir)
     subject  = rdfGraph.value(None, RDF.type, RO.ResearchObject)
     strsubject = ""
     if isinstance(subject, rdflib.URIRef): strsubject = str(subject)
@@ -68,12 +560,184 @@ def readManifest(rodir):
         }
     return manifestDict
 
+# RO-level properties read by readManifestHeader, keyed by readManifest dictionary key
+MANIFEST_HEADER_PROPERTIES = (
+    { 'roident':        DCTERMS.identifier
+    , 'rotitle':        DCTERMS.title
+    , 'rocreator':      DCTERMS.creator
+    , 'rocreated':      DCTERMS.created
+    , 'rodescription':  DCTERMS.description
+    })
+
+def readManifestHeader(rodir):
+    """
+    Read RO-level properties from manifest file, returning a dictionary like
+    readManifest, but without building an RDF graph of the manifest.
+
+    RDF/XML manifests are read element by element, and N-Triples manifests line
+    by line, stopping when all the RO properties have been seen (RDF/XML reading
+    stops at the end of the top-level element in which the last was found).  Other
+    syntaxes, or a manifest with a journal, are read in full using readManifest.
+    """
+    manifestfilename = makeManifestFilename(rodir)
+    format = guessMetadataFormat(manifestfilename)
+    if hasManifestJournal(rodir) or format not in ["RDFXML", "NT"]:
+        return readManifest(rodir)
+    props = dict( (p, k) for (k, p) in MANIFEST_HEADER_PROPERTIES.iteritems() )
+    if format == "RDFXML":
+        baseuri = urlparse.urljoin(str(getRoUri(rodir)), ro_settings.MANIFEST_REF)
+        (subject, values) = _readRdfXmlHeader(manifestfilename, baseuri, props)
+    else:
+        (subject, values) = _readNTriplesHeader(manifestfilename, props)
+    strsubject = ""
+    if isinstance(subject, rdflib.URIRef): strsubject = str(subject)
+    manifestDict = { 'ropath': rodir, 'rouri': strsubject }
+    for k in MANIFEST_HEADER_PROPERTIES:
+        manifestDict[k] = values.get(subject, {}).get(k, None)
+    return manifestDict
+
+RDF_NS = str(RDF.type)[:-len("type")]
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+
+def _readRdfXmlHeader(filename, baseuri, props):
+    """
+    Scan RDF/XML file for RO subject and values of the indicated properties,
+    stopping at the end of a top-level element when values for all properties of
+    the RO subject have been seen.  Otherwise the whole file is read, as properties
+    of the RO may be given in more than one element.
+
+    props       is a dictionary mapping property URIs to result keys
+
+    Returns a pair (subject, values), where values maps subjects to dictionaries
+    of property values.  Only values given as literals or as rdf:resource
+    attributes are recognized.
+    """
+    def tagUri(tag):
+        return tag[1:].replace("}", "", 1) if tag.startswith("{") else tag
+    def addValue(s, p, o):
+        if p == RDF.type and o == RO.ResearchObject and rosubject[0] is None:
+            rosubject[0] = s
+        if p in props:
+            values.setdefault(s, {}).setdefault(props[p], o)
+        return
+    def nodeSubject(elem, base):
+        about  = elem.get("{%s}about"%RDF_NS)
+        nodeid = elem.get("{%s}nodeID"%RDF_NS)
+        ident  = elem.get("{%s}ID"%RDF_NS)
+        if about is not None:  return rdflib.URIRef(urlparse.urljoin(base, about))
+        if nodeid is not None: return rdflib.BNode(nodeid)
+        if ident is not None:  return rdflib.URIRef(urlparse.urljoin(base, "#"+ident))
+        return rdflib.BNode()
+    rosubject = [None]
+    values    = {}
+    # Stack entries are [kind, subject, base, predicate, object], where kind is one of
+    # "nodes" (element content is node elements), "props" (element content is property
+    # elements), "value" (property element with literal or node content), "skip"
+    stack     = []
+    with openMetadataFile(filename) as f:
+        for (event, elem) in ElementTree.iterparse(f, events=("start", "end")):
+            if event == "start":
+                base = stack[-1][2] if stack else baseuri
+                base = urlparse.urljoin(base, elem.get("{%s}base"%XML_NS, ""))
+                kind = stack[-1][0] if stack else "nodes"
+                if kind == "value":
+                    # Nested node element: property value is its subject
+                    kind = "nodes"
+                if kind == "nodes":
+                    if not stack and elem.tag == "{%s}RDF"%RDF_NS:
+                        stack.append(["nodes", None, base, None, None])
+                        continue
+                    s = nodeSubject(elem, base)
+                    if stack and stack[-1][0] == "value":
+                        stack[-1][4] = s
+                    if elem.tag != "{%s}Description"%RDF_NS:
+                        addValue(s, RDF.type, rdflib.URIRef(tagUri(elem.tag)))
+                    for (a, v) in elem.attrib.iteritems():
+                        if not a.startswith("{%s}"%RDF_NS) and not a.startswith("{%s}"%XML_NS):
+                            addValue(s, rdflib.URIRef(tagUri(a)), rdflib.Literal(v))
+                    if elem.get("{%s}type"%RDF_NS):
+                        addValue(s, RDF.type, rdflib.URIRef(elem.get("{%s}type"%RDF_NS)))
+                    stack.append(["props", s, base, None, None])
+                elif kind == "props":
+                    s = stack[-1][1]
+                    p = rdflib.URIRef(tagUri(elem.tag))
+                    parsetype = elem.get("{%s}parseType"%RDF_NS)
+                    resource  = elem.get("{%s}resource"%RDF_NS)
+                    if parsetype == "Resource":
+                        b = rdflib.BNode()
+                        addValue(s, p, b)
+                        stack.append(["props", b, base, None, None])
+                    elif parsetype is not None:
+                        stack.append(["skip", s, base, None, None])
+                    elif resource is not None:
+                        addValue(s, p, rdflib.URIRef(urlparse.urljoin(base, resource)))
+                        stack.append(["skip", s, base, None, None])
+                    else:
+                        stack.append(["value", s, base, p, elem])
+                else:
+                    stack.append(["skip", None, base, None, None])
+            else:
+                (kind, s, base, p, o) = stack.pop()
+                if kind == "value":
+                    if isinstance(o, rdflib.term.Identifier):
+                        addValue(s, p, o)
+                    else:
+                        lang = elem.get("{%s}lang"%XML_NS)
+                        dt   = elem.get("{%s}datatype"%RDF_NS)
+                        dt   = dt and rdflib.URIRef(urlparse.urljoin(base, dt))
+                        addValue(s, p, rdflib.Literal(elem.text or "", lang=lang, datatype=dt))
+                if len(stack) == 1 and stack[0][1] is None:
+                    # End of top-level node element
+                    if ( rosubject[0] is not None and
+                         len(values.get(rosubject[0], {})) == len(props) ):
+                        break
+                    elem.clear()
+    return (rosubject[0], values)
+
+NTRIPLE_TERM = r'(<[^>\s]*>|_:\S+|"(?:[^"\\]|\\.)*"(?:@[\w-]+|\^\^<[^>\s]*>)?)'
+NTRIPLE_STMT = re.compile(r'^\s*'+NTRIPLE_TERM+r'\s+<([^>\s]*)>\s+'+NTRIPLE_TERM+r'\s*\.\s*$')
+
+def _readNTriplesHeader(filename, props):
+    """
+    Scan N-Triples file for RO subject and values of the indicated properties,
+    stopping when values for all properties of the RO subject have been seen.
+
+    Returns a pair (subject, values), as _readRdfXmlHeader.
+    """
+    def decodeTerm(term):
+        if term.startswith("<"):
+            return rdflib.URIRef(term[1:-1].decode("unicode_escape"))
+        if term.startswith("_:"):
+            return rdflib.BNode(term[2:])
+        m = re.match(r'^"(.*)"(?:@([\w-]+)|\^\^<([^>]*)>)?$', term, re.S)
+        return rdflib.Literal(m.group(1).decode("unicode_escape"),
+            lang=m.group(2), datatype=m.group(3) and rdflib.URIRef(m.group(3)))
+    rotype    = "<%s>"%str(RO.ResearchObject)
+    prefixes  = set( str(p).rsplit("/", 1)[0] for p in props ) | set([str(RDF.type)])
+    rosubject = None
+    values    = {}
+    with openMetadataFile(filename) as f:
+        for line in f:
+            if not any( p in line for p in prefixes ): continue
+            m = NTRIPLE_STMT.match(line)
+            if not m: continue
+            p = rdflib.URIRef(m.group(2))
+            if p == RDF.type:
+                if m.group(3) == rotype and rosubject is None:
+                    rosubject = decodeTerm(m.group(1))
+            elif p in props:
+                values.setdefault(decodeTerm(m.group(1)), {}).setdefault(
+                    props[p], decodeTerm(m.group(3)))
+            if rosubject is not None and len(values.get(rosubject, {})) == len(props):
+                break
+    return (rosubject, values)
+
 def notHidden(f):
     return re.match("\.|.*/\.", f) == None
 
 def addAggregatedResources(ro_dir, ro_file, recurse=True):
     log.debug("addAggregatedResources: dir %s, file %s"%(ro_dir, ro_file))
-    ro_graph = readManifestGraph(ro_dir)
+    ro_graph = getManifestGraph(ro_dir)
     if ro_file.endswith(os.path.sep):
         ro_file = ro_file[0:-1]
     rofiles = [ro_file]
@@ -97,7 +761,7 @@ def getAggregatedResources(ro_dir):
     
     Each value returned by the iterator is a resource URI.
     """
-    ro_graph = readManifestGraph(ro_dir)
+    ro_graph = getManifestGraph(ro_dir)
     subject  = getRoUri(ro_dir)
     log.debug("getAggregatedResources %s"%str(subject))
     for r in ro_graph.objects(subject=subject, predicate=ORE.aggregates):
@@ -163,4 +827,48 @@ def getGraphRoUri(rodir, rograph):
     """
     return rograph.value(None, RDF.type, RO.ResearchObject)
 
+def iterROZipMembers(rodir):
+    """
+    Generate (arcname, source) pairs for the files of a research object, for
+    assembling a zip archive of the RO (see MiscUtils.ZipStream.iterZipData).
+
+    RO metadata is supplied as it is read: compressed metadata files are
+    decompressed, and any manifest journal is applied to the manifest.  Files used
+    only for local management of the RO, and other hidden files, are omitted.
+    """
+    rodir    = os.path.abspath(rodir)
+    internal = [ ro_settings.MANIFEST_JOURNAL
+               , ro_settings.ANNOTATION_COUNTER
+               , ro_settings.DIRECTORY_STATE
+               ]
+    manifestfilename = makeManifestFilename(rodir)
+    for (dirpath, dirnames, filenames) in os.walk(rodir):
+        reldir = os.path.relpath(dirpath, rodir)
+        inmeta = reldir.split(os.sep)[0] == ro_settings.MANIFEST_DIR
+        # Hidden directories other than the RO metadata directory are skipped
+        dirnames[:] = sorted( d for d in dirnames
+            if not d.startswith(".") or (reldir == "." and d == ro_settings.MANIFEST_DIR) )
+        for f in sorted(filenames):
+            if f.startswith("."): continue
+            filename = os.path.join(dirpath, f)
+            arcname  = os.path.normpath(os.path.join(reldir, f)).replace(os.sep, "/")
+            if not inmeta:
+                yield (arcname, filename)
+                continue
+            if f in internal: continue
+            name = filename
+            for suffix in METADATA_COMPRESSIONS.itervalues():
+                if suffix and filename.endswith(suffix):
+                    name    = filename[:-len(suffix)]
+                    arcname = arcname[:-len(suffix)]
+            if name == manifestfilename and hasManifestJournal(rodir):
+                data = serializeMetadata(readManifestGraph(rodir), getRoUri(rodir),
+                    guessMetadataFormat(manifestfilename))
+                yield (arcname, StringIO.StringIO(data))
+            elif name != filename:
+                yield (arcname, openMetadataFile(name))
+            else:
+                yield (arcname, filename)
+    return
+
 # End.
@@ -10,12 +10,15 @@ __license__     = "MIT (http://opensource.org/licenses/MIT)"
 
 import sys
 import os
+import errno
 import os.path
 import re
 import urllib
 import urlparse
 import logging
 import traceback
+import datetime
+import zipfile
 
 log = logging.getLogger(__name__)
 
@@ -27,12 +30,13 @@ import rdflib.namespace
 import ro_settings
 import ro_prefixes
 from ro_namespaces import RDF, RO, ORE, AO, DCTERMS
-from ro_uriutils import isFileUri, resolveUri, resolveFileAsUri, getFilenameFromUri, isLiveUri, retrieveUri
+from ro_uriutils import isFileUri, isZipFileUri, resolveUri, UriCache, resolveFileAsUri, getFilenameFromUri, isLiveUri, retrieveUri
 from ROSRS_Session import ROSRS_Error, ROSRS_Session
 import ro_manifest
 import ro_annotation
+import ro_checksum
+import ro_dirstate
 import json
-import hashlib
 
 
 class ro_metadata(object):
@@ -46,7 +50,9 @@ class ro_metadata(object):
 
         roconfig    is the research object manager configuration, supplied as a dictionary
         roref       a URI reference that refers to the Research Object to be accessed, or
-                    relative path name (see ro_uriutils.resolveFileAsUri for interpretation)
+                    relative path name (see ro_uriutils.resolveFileAsUri for interpretation).
+                    This may also refer to a zip file containing the RO, which is then
+                    accessed read-only without extracting the zip file contents.
         dummysetupfortest is an optional parameter that, if True, suppresses some aspects of
                     the setup (does not attempt to read a RO manifest) for isolated testing.
         """
@@ -54,9 +60,18 @@ class ro_metadata(object):
         self.roref    = roref
         self.dummyfortest  = dummysetupfortest
         self.manifestgraph = None
+        self.manifestchanges = []
+        self.metadataformat = ro_settings.METADATA_FORMAT
+        self.metadatacompression = "none"
         self.roannotations = None
+        self.roannotationbodies = set()
         self.registries = None
+        self.uricache   = None
+        self.uricacherouri = None
+        self.rozip    = None
         uri = resolveFileAsUri(roref)
+        if isZipFileUri(uri):
+            uri = self._openZip(uri)
         if not uri.endswith("/"): uri += "/"
         self.rouri    = rdflib.URIRef(uri)
         if self._isLocal():
@@ -81,6 +96,114 @@ class ro_metadata(object):
     def _isLocal(self):
         return isFileUri(self.rouri)
 
+    def _openZip(self, zipuri):
+        """
+        Open a zip file containing an RO for read-only access.  The RO is the
+        outermost directory in the zip file that contains RO metadata.
+
+        Returns the URI of the RO: the zip file URI followed by the path of the RO
+        directory within the zip file.
+        """
+        zipuri = zipuri.rstrip("/")
+        self.rozip      = zipfile.ZipFile(getFilenameFromUri(zipuri))
+        self.rozipnames = set(self.rozip.namelist())
+        self.rozipdirs  = set()
+        for name in self.rozipnames:
+            dirs = name.split("/")[:-1]
+            for i in range(1, len(dirs)+1):
+                self.rozipdirs.add("/".join(dirs[:i])+"/")
+        # RO directories, identified by manifests that may be stored compressed
+        roprefixes = []
+        for suffix in ro_manifest.METADATA_COMPRESSIONS.itervalues():
+            manifestref = ro_settings.MANIFEST_REF+suffix
+            roprefixes.extend( n[:-len(manifestref)] for n in self.rozipnames
+                if n == manifestref or n.endswith("/"+manifestref) )
+        if not roprefixes:
+            raise IOError("No RO manifest in zip file %s"%(getFilenameFromUri(zipuri)))
+        self.rozipprefix = min(roprefixes, key=len)
+        log.debug("_openZip: %s, RO directory '%s'"%(zipuri, self.rozipprefix))
+        return zipuri + "/" + urllib.pathname2url(self.rozipprefix)
+
+    def _getZipMemberName(self, uri):
+        """
+        Return name in the RO zip file of the entry for a resource URI, or None if the
+        URI does not refer to RO content.
+        """
+        ref = str(self.getComponentUriRel(uri))
+        if urlparse.urlsplit(ref).scheme != "":
+            return None
+        return self.rozipprefix + urllib.unquote(urlparse.urlsplit(ref).path)
+
+    def _readZipMetadataData(self, name):
+        """
+        Return content of the RO zip file entry for RO metadata, decompressed if the
+        entry is stored with a compression suffix, or None if there is no such entry.
+        """
+        if name in self.rozipnames:
+            return self.rozip.read(name)
+        for (compression, suffix) in ro_manifest.METADATA_COMPRESSIONS.iteritems():
+            if suffix and name+suffix in self.rozipnames:
+                return ro_manifest.decompressMetadataData(
+                    self.rozip.read(name+suffix), compression, name+suffix)
+        return None
+
+    def _readZipMetadata(self, uri, graph, **args):
+        """
+        Parse RO metadata from the RO zip file into the supplied graph.  The metadata
+        may be stored compressed.  A KeyError exception is raised if the zip file has
+        no entry for the URI.
+
+        args    are additional rdflib parser arguments, used only for RDF/XML
+
+        Returns the RDF syntax of the metadata (a key of ro_manifest.METADATA_FORMATS).
+        """
+        name = self._getZipMemberName(uri)
+        data = self._readZipMetadataData(name) if name is not None else None
+        if data is None:
+            raise KeyError(str(uri))
+        format = ro_manifest.guessMetadataFormat(name, data)
+        if format != "RDFXML": args = {}
+        graph.parse(data=data, publicID=str(uri), format=ro_manifest.METADATA_FORMATS[format][0], **args)
+        return format
+
+    def readZipResource(self, uri):
+        """
+        Returns content of an RO resource read from the zip file containing the RO,
+        or None if the RO is not accessed from a zip file or the zip file contains
+        no such resource.
+        """
+        if self.rozip is None:
+            return None
+        name = self._getZipMemberName(uri)
+        if name is None:
+            return None
+        if self.isRoMetadataRef(uri):
+            # RO metadata may be stored compressed
+            return self._readZipMetadataData(name)
+        if name not in self.rozipnames:
+            return None
+        return self.rozip.read(name)
+
+    def isLiveResource(self, uri):
+        """
+        Test if URI refers to an accessible resource.  For an RO accessed from a zip
+        file, references to RO content are checked against the zip file index.
+        """
+        if self.rozip is not None:
+            name = self._getZipMemberName(uri)
+            if name is not None:
+                names = [name]
+                if self.isRoMetadataRef(uri):
+                    # RO metadata may be stored compressed
+                    names = [ name+suffix for suffix in ro_manifest.METADATA_COMPRESSIONS.itervalues() ]
+                return ( any( n in self.rozipnames for n in names ) or
+                         (name.rstrip("/")+"/") in self.rozipdirs )
+        elif self._isLocal() and self.isRoMetadataRef(uri):
+            # RO metadata may be stored compressed
+            filename = getFilenameFromUri(self.getComponentUriAbs(uri))
+            return os.path.exists(ro_manifest.getMetadataStoredFilename(filename))
+        return isLiveUri(uri)
+
     def _getLocalManifestUri(self):
         return self.getComponentUri(ro_settings.MANIFEST_DIR+"/"+ro_settings.MANIFEST_FILE)
 
@@ -91,13 +214,33 @@ class ro_metadata(object):
             self.manifestgraph = rdflib.Graph()
             self.manifestgraph.add( (self.rouri, RDF.type, RO.ResearchObject) )
             self.manifesturi   = self.rouri
+        elif self.rozip is not None:
+            # Read manifest graph from zip file
+            self.manifestgraph = rdflib.Graph()
+            for (prefix, uri) in ro_prefixes.prefixes:
+                self.manifestgraph.bind(prefix, rdflib.namespace.Namespace(uri))
+            self.manifesturi    = self._getLocalManifestUri()
+            journalname = self.rozipprefix+ro_settings.MANIFEST_DIR+"/"+ro_settings.MANIFEST_JOURNAL
+            if journalname in self.rozipnames:
+                # Journal records refer to blank nodes by the ids written to the manifest
+                self.metadataformat = self._readZipMetadata(
+                    self.manifesturi, self.manifestgraph, preserve_bnode_ids=True)
+                ro_manifest._replayManifestJournal(self.rozip.read(journalname), self.manifestgraph)
+            else:
+                self.metadataformat = self._readZipMetadata(self.manifesturi, self.manifestgraph)
         elif self._isLocal():
             # Read manifest graph
             self.manifestgraph = rdflib.Graph()
             for (prefix, uri) in ro_prefixes.prefixes:
                 self.manifestgraph.bind(prefix, rdflib.namespace.Namespace(uri))
             self.manifesturi   = self._getLocalManifestUri()
-            self.manifestgraph.parse(self.manifesturi)
+            ro_manifest.readManifestGraph(self.getRoFilename(),
+                rograph=self.manifestgraph, manifesturi=self.manifesturi)
+            # New metadata files are written using the same syntax and compression
+            # as the manifest
+            self.metadataformat = ro_manifest.guessMetadataFormat(self.getManifestFilename())
+            self.metadatacompression = ro_manifest.getMetadataStoredCompression(
+                self.getManifestFilename())
         else:
             (status, reason, _h, manifesturi, manifest) = self.rosrs.getROManifest(self.rouri)
             if status != 200:
@@ -117,13 +260,120 @@ class ro_metadata(object):
     def _updateManifest(self):
         """
         Write updated manifest file for research object
+
+        If the RO has a manifest journal, changes made since the last update are
+        appended to the journal; otherwise the full manifest is written, and a
+        journal is started if the configuration option "manifestJournal" is set.
+        (The journal is used only with RDF/XML manifests, as other syntaxes do not
+        preserve the blank node identifiers used by journal records.)
         """
         assert self._isLocal()
-        self._loadManifest().serialize(
-            destination=self.getManifestFilename(), format='xml',
-            base=self.rouri, xml_base="..")
+        ro_dir = self.getRoFilename()
+        journal = self.metadataformat == "RDFXML"
+        if journal and ro_manifest.hasManifestJournal(ro_dir):
+            if self.manifestchanges:
+                ro_manifest.appendManifestJournal(ro_dir, self.manifestchanges,
+                    rouri=self.rouri, limit=self.roconfig.get("manifestJournalLimit"))
+        else:
+            ro_manifest.writeManifestGraph(ro_dir, self._loadManifest(),
+                rouri=self.rouri, format=self.metadataformat, compression=self.metadatacompression)
+            if journal and self.roconfig.get("manifestJournal", False):
+                ro_manifest.startManifestJournal(ro_dir)
+        self.manifestchanges = []
+        return
+
+    def _addManifestStmt(self, stmt):
+        """
+        Add statement to the manifest graph, noting the change for the manifest journal
+        """
+        manifest = self._loadManifest()
+        if stmt not in manifest:
+            manifest.add(stmt)
+            self.manifestchanges.append(("+", stmt))
+            if self.manifesturi in self.roannotationbodies:
+                self.roannotations.get_context(self.manifesturi).add(stmt)
+        return
+
+    def _addManifestStmts(self, stmts):
+        """
+        Add a batch of new statements to the manifest graph, noting the changes for
+        the manifest journal.  The statements must not already be in the manifest.
+        """
+        manifest = self._loadManifest()
+        manifest.addN( (s, p, o, manifest) for (s, p, o) in stmts )
+        self.manifestchanges.extend( ("+", stmt) for stmt in stmts )
+        if self.manifesturi in self.roannotationbodies:
+            anngr = self.roannotations.get_context(self.manifesturi)
+            anngr.addN( (s, p, o, anngr) for (s, p, o) in stmts )
         return
 
+    def _removeManifestStmts(self, pattern):
+        """
+        Remove statements matching the supplied pattern from the manifest graph, noting
+        the changes for the manifest journal
+        """
+        manifest = self._loadManifest()
+        for stmt in list(manifest.triples(pattern)):
+            manifest.remove(stmt)
+            self.manifestchanges.append(("-", stmt))
+            if self.manifesturi in self.roannotationbodies:
+                self.roannotations.get_context(self.manifesturi).remove(stmt)
+        return
+
+    def migrateMetadataFormat(self, format=None, compression=None):
+        """
+        Convert RO manifest and annotation bodies in the RO metadata directory to the
+        indicated RDF syntax (a key of ro_manifest.METADATA_FORMATS) and compression
+        (a key of ro_manifest.METADATA_COMPRESSIONS).  If either is not supplied, the
+        current syntax or compression of each file is kept.
+
+        Annotation body file names are not changed, so that references to them
+        remain valid.
+
+        Returns a list of metadata file names that have been converted.
+        """
+        assert self._isLocal()
+        ro_dir    = self.getRoFilename()
+        manifest  = self._loadManifest()
+        converted = []
+        if format is not None and format != "RDFXML":
+            ro_manifest.stopManifestJournal(ro_dir)
+        for (ann_node, ann_body, ann_target) in self.getAllAnnotationNodes():
+            if ann_body == self.manifesturi or not self.isRoMetadataRef(ann_body):
+                continue
+            filename = getFilenameFromUri(ann_body)
+            if ( filename in converted or
+                 not os.path.exists(ro_manifest.getMetadataStoredFilename(filename)) ):
+                continue
+            oldformat      = ro_manifest.guessMetadataFormat(filename)
+            oldcompression = ro_manifest.getMetadataStoredCompression(filename)
+            if (format or oldformat) != oldformat:
+                anngr = self._readAnnotationBody(self.getComponentUriRel(ann_body))
+                ro_manifest.writeMetadataFile(anngr, filename, self.rouri, format, compression)
+                converted.append(filename)
+            elif (compression or oldcompression) != oldcompression:
+                ro_manifest.writeMetadataData(filename,
+                    ro_manifest.readMetadataData(filename), compression)
+                converted.append(filename)
+        if ( (format or self.metadataformat) != self.metadataformat or
+             (compression or self.metadatacompression) != self.metadatacompression ):
+            ro_manifest.writeManifestGraph(ro_dir, manifest, rouri=self.rouri,
+                format=format, compression=compression)
+            converted.append(self.getManifestFilename())
+        self.metadataformat      = format or self.metadataformat
+        self.metadatacompression = compression or self.metadatacompression
+        self.manifestchanges = []
+        return converted
+
+    def compactManifest(self):
+        """
+        Fold any manifest journal into the manifest file.
+
+        Returns the number of journal records folded, or None if there is no journal.
+        """
+        assert self._isLocal()
+        return ro_manifest.compactManifest(self.getRoFilename(), rouri=self.rouri)
+
     def _iterAnnotations(self, subject=None):
         """
         Return iterator over annotation stubs in the current RO, either for
@@ -150,28 +400,52 @@ class ro_metadata(object):
         return (self.rouri, ORE.aggregates, resuri) in self.manifestgraph
 
     def _loadAnnotations(self):
-        if self.roannotations: return self.roannotations
+        if self.roannotations is not None: return self.roannotations
         log.debug("_loadannotations")
-        # Assemble annotation graph
+        # Assemble annotation dataset, with a named graph for each annotation body.
+        # Queries are evaluated over the union of these graphs.
         # NOTE: the manifest itself is included as an annotation by the RO setup
         if self._isLocal():
             manifest = self._loadManifest()
-            self.roannotations = rdflib.Graph()
-            annotation_uris_loaded = set()
+            self.roannotations = rdflib.ConjunctiveGraph()
+            self.roannotationbodies = set()
             for anode in self._iterAnnotations():
-                auri = manifest.value(subject=anode, predicate=AO.body)
-                if auri not in annotation_uris_loaded:
-                    aref = self.getComponentUriRel(auri)
-                    log.debug("_loadAnnotations: aref "+str(aref))
-                    self._readAnnotationBody(aref, self.roannotations)
-                    annotation_uris_loaded.add(auri)
+                self._loadAnnotationBody(manifest.value(subject=anode, predicate=AO.body))
         else:
-            self.roannotations = self.rosrs.getROAnnotationGraph(self.rouri)
+            self.roannotations = self.rosrs.getROAnnotationGraph(self.rouri,
+                manifest=self._loadManifest(), manifesturi=self.manifesturi)
         # log.debug("roannotations graph:\n"+self.roannotations.serialize())
         for (prefix, uri) in ro_prefixes.prefixes:
             self.manifestgraph.bind(prefix, rdflib.namespace.Namespace(uri))
         return self.roannotations
 
+    def _loadAnnotationBody(self, auri):
+        """
+        Load annotation body into its own named graph in the annotation dataset,
+        if it is not already loaded.
+        """
+        if auri in self.roannotationbodies: return
+        anngr = self.roannotations.get_context(auri)
+        if auri == self.manifesturi:
+            # Use manifest graph as loaded, which includes any journalled changes,
+            # rather than parsing the manifest file again
+            anngr.addN( (s, p, o, anngr) for (s, p, o) in self._loadManifest() )
+        else:
+            aref = self.getComponentUriRel(auri)
+            log.debug("_loadAnnotationBody: aref "+str(aref))
+            self._readAnnotationBody(aref, anngr)
+        self.roannotationbodies.add(auri)
+        return
+
+    def _unloadAnnotationBody(self, auri):
+        """
+        Remove annotation body named graph from the annotation dataset
+        """
+        if auri not in self.roannotationbodies: return
+        self.roannotations.remove_context(self.roannotations.get_context(auri))
+        self.roannotationbodies.discard(auri)
+        return
+
     def isInternalResource(self, resuri):
         '''
         Check if the resource is internal, i.e. should the resource content be uploaded
@@ -207,7 +481,8 @@ class ro_metadata(object):
         """
         assert self._isLocal()
         af = ro_annotation.createAnnotationBody(
-            self.roconfig, self.getRoFilename(), roresource, attrdict, defaultType)
+            self.roconfig, self.getRoFilename(), roresource, attrdict, defaultType,
+            self.metadataformat, self.metadatacompression)
         return os.path.join(ro_settings.MANIFEST_DIR+"/", af)
 
     def _createAnnotationGraphBody(self, roresource, anngraph):
@@ -229,7 +504,8 @@ class ro_metadata(object):
         """
         assert self._isLocal()
         af = ro_annotation.createAnnotationGraphBody(
-            self.roconfig, self.getRoFilename(), roresource, anngraph)
+            self.roconfig, self.getRoFilename(), roresource, anngraph,
+            self.metadataformat, self.metadatacompression)
         return os.path.join(ro_settings.MANIFEST_DIR+"/", af)
 
     def _readAnnotationBody(self, annotationref, anngr=None):
@@ -243,22 +519,29 @@ class ro_metadata(object):
         assert self._isLocal()
         log.debug("_readAnnotationBody %s"%(annotationref))
         annotationuri    = self.getComponentUri(annotationref)
-        annotationformat = "xml"
-        # Look at file extension to figure format
-        # (rdflib.Graph.parse says;
-        #   "used if format can not be determined from the source")
-        if re.search("\.(ttl|n3)$", annotationuri): annotationformat="n3"
+        if self.rozip is not None:
+            if anngr == None:
+                anngr = rdflib.Graph()
+            try:
+                self._readZipMetadata(annotationuri, anngr)
+            except KeyError as e:
+                log.debug("_readAnnotationBody %s, %s"%(str(annotationref), repr(e)))
+                anngr = None
+            return anngr
         if anngr == None:
             log.debug("_readAnnotationBody: new graph")
             anngr = rdflib.Graph()
         try:
-            anngr.parse(annotationuri, format=annotationformat)
+            # Format is determined from file content and extension, and the file is
+            # decompressed if it is stored compressed
+            annotationformat = ro_manifest.parseMetadataFile(
+                anngr, getFilenameFromUri(annotationuri), source=annotationuri)
             log.debug("_readAnnotationBody parse %s, len %i"%(annotationuri, len(anngr)))
         except IOError as e:
             log.debug("_readAnnotationBody %s, %s"%(str(annotationref), repr(e)))
             anngr = None
         except Exception as e:
-            log.debug("Failed to load annotation %s as %s"%(annotationuri, annotationformat))
+            log.debug("Failed to load annotation %s"%(annotationuri))
             log.debug("Exception %s"%(repr(e)))
             raise
             anngr = None
@@ -272,6 +555,8 @@ class ro_metadata(object):
         annfile     is the file name of the annotation body to be added,
                     possibly relative to the RO URI, with special characters
                     already URI-escaped.
+
+        Returns the annotation node added.
         """
         assert self._isLocal()
         # <ore:aggregates>
@@ -284,17 +569,18 @@ class ro_metadata(object):
         ann     = rdflib.BNode()
         resuri  = self.getComponentUri(rofile)
         bodyuri = self.getComponentUriAbs(annfile)
-        self.manifestgraph.add((ann, RDF.type, RO.AggregatedAnnotation))
-        self.manifestgraph.add((ann, RO.annotatesAggregatedResource, resuri))
-        self.manifestgraph.add((ann, AO.body, bodyuri))
+        self._addManifestStmt((ann, RDF.type, RO.AggregatedAnnotation))
+        self._addManifestStmt((ann, RO.annotatesAggregatedResource, resuri))
+        self._addManifestStmt((ann, AO.body, bodyuri))
         # Aggregate the annotation
-        self.manifestgraph.add((self.getRoUri(), ORE.aggregates, ann))
+        self._addManifestStmt((self.getRoUri(), ORE.aggregates, ann))
         # Aggregate annotation body if it is RO metadata.
         # Otherwise aggregation is the caller's responsibility
         if self.isRoMetadataRef(bodyuri):
-            self.manifestgraph.add((self.getRoUri(), ORE.aggregates, bodyuri))
-        self.roannotations = None   # Flush cached annotation graph
-        return
+            self._addManifestStmt((self.getRoUri(), ORE.aggregates, bodyuri))
+        if self.roannotations is not None:
+            self._loadAnnotationBody(bodyuri)
+        return ann
 
     def _removeAnnotationFromManifest(self, ann):
         """
@@ -304,18 +590,123 @@ class ro_metadata(object):
         """
         assert self._isLocal()
         bodyuri = self.manifestgraph.value(subject=ann, predicate=AO.body)
-        self.manifestgraph.remove((ann, None, None   ))
+        self._removeManifestStmts((ann, None, None   ))
         # If annotation body is RO Metadata, and there are no other uses as an annotation,
         # remove it from the RO aggregation.
         if self.isRoMetadataRef(bodyuri):
-            if not self.manifestgraph.value(subject=ann, predicate=AO.body):
-                self.manifestgraph.remove((None, ORE.aggregates, bodyuri))
-        self.roannotations = None   # Flush cached annotation graph
+            if (None, AO.body, bodyuri) not in self.manifestgraph:
+                self._removeManifestStmts((None, ORE.aggregates, bodyuri))
+        # Drop annotation body graph unless used by another annotation
+        if self.roannotations is not None and (None, AO.body, bodyuri) not in self.manifestgraph:
+            self._unloadAnnotationBody(bodyuri)
         return
 
-    def addAggregatedResources(self, ro_file, recurse=True, includeDirs=False):
+    def _replaceAnnotationBody(self, bodyuri, annfile):
+        """
+        Replace references to an annotation body with references to a new body
+
+        bodyuri     is the URI of the annotation body to be replaced
+        annfile     is the file name of the new annotation body, possibly relative
+                    to the RO URI.
+        """
+        assert self._isLocal()
+        newuri = self.getComponentUriAbs(annfile)
+        for ann in list(self.manifestgraph.subjects(predicate=AO.body, object=bodyuri)):
+            self._removeManifestStmts((ann, AO.body, bodyuri))
+            self._addManifestStmt((ann, AO.body, newuri))
+        self._removeManifestStmts((self.getRoUri(), ORE.aggregates, bodyuri))
+        if self.isRoMetadataRef(newuri):
+            self._addManifestStmt((self.getRoUri(), ORE.aggregates, newuri))
+        if self.roannotations is not None:
+            self._unloadAnnotationBody(bodyuri)
+            self._loadAnnotationBody(newuri)
+        return
+
+    def compactAnnotations(self, bydate=False):
+        """
+        Merge annotation bodies in the RO metadata directory into consolidated bodies,
+        one for each annotated resource, or (if bydate is True) one for each day on
+        which the original bodies were last modified.  The annotations referring to
+        the merged bodies are replaced by one annotation for each annotated resource,
+        referring to the consolidated body, the manifest is written once, and the
+        merged body files are then deleted.  When merging by resource, bodies shared
+        by several annotations (see addSharedSimpleAnnotation) are left unchanged.
+
+        Returns a pair (merged, created): the number of annotation bodies merged, and
+        the number of consolidated bodies created.
+        """
+        assert self._isLocal()
+        manifest = self._loadManifest()
+        # Group annotations: key -> [annotation nodes, body URIs, annotated resources]
+        groups = {}
+        for anode in set(self._iterAnnotations()):
+            bodyuri = manifest.value(subject=anode, predicate=AO.body)
+            targets = set(manifest.objects(subject=anode, predicate=RO.annotatesAggregatedResource))
+            if ( bodyuri is None or bodyuri == self.manifesturi or not targets or
+                 not self.isRoMetadataRef(bodyuri) ):
+                continue
+            filename = ro_manifest.getMetadataStoredFilename(getFilenameFromUri(bodyuri))
+            if not os.path.isfile(filename):
+                continue
+            if not bydate and len(set(manifest.subjects(AO.body, bodyuri))) > 1:
+                continue
+            if bydate:
+                key = datetime.date.fromtimestamp(os.stat(filename).st_mtime)
+            else:
+                key = tuple(sorted(targets))
+            group = groups.setdefault(key, [set(), set(), set()])
+            group[0].add(anode)
+            group[1].add(bodyuri)
+            group[2].update(targets)
+        merged  = set()
+        created = 0
+        for key in sorted(groups):
+            (anodes, bodyuris, targets) = groups[key]
+            if len(bodyuris) < 2:
+                continue
+            anngraph = rdflib.Graph()
+            for (prefix, uri) in ro_prefixes.prefixes:
+                anngraph.bind(prefix, rdflib.namespace.Namespace(uri))
+            for bodyuri in bodyuris:
+                self._readAnnotationBody(self.getComponentUriRel(bodyuri), anngraph)
+            if len(targets) == 1:
+                rofile = self.getComponentUriRel(list(targets)[0])
+            else:
+                rofile = "."
+            annfile = self._createAnnotationGraphBody(rofile, anngraph)
+            for anode in anodes:
+                self._removeAnnotationFromManifest(anode)
+                self._removeManifestStmts((None, ORE.aggregates, anode))
+            for target in sorted(targets):
+                self._addAnnotationToManifest(target, annfile)
+            merged.update(bodyuris)
+            created += 1
+        # Bodies also used by annotations not merged are kept
+        for bodyuri in list(merged):
+            if (None, AO.body, bodyuri) in manifest:
+                merged.discard(bodyuri)
+        if created:
+            self._updateManifest()
+        for bodyuri in merged:
+            os.remove(ro_manifest.getMetadataStoredFilename(getFilenameFromUri(bodyuri)))
+        return (len(merged), created)
+
+    def addAggregatedResources(self, ro_file, recurse=True, includeDirs=False, progress=None):
         """
         Scan a local directory and add files found to the RO aggregation
+
+        Resources not already aggregated are added to the manifest as a single batch,
+        and the manifest is written once.
+
+        When a directory is scanned recursively, the saved RO directory state (see
+        ro_dirstate) is used so that only directories modified since the previous
+        scan are listed.
+
+        progress    if supplied, is a function called as progress(count) each time
+                    ro_settings.PROGRESS_INTERVAL further directory entries have been
+                    scanned, and when the scan is complete.
+
+        Returns the number of resources added to the aggregation.
         """
         assert self._isLocal()
         def notHidden(f):
@@ -323,37 +714,87 @@ class ro_metadata(object):
         log.debug("addAggregatedResources: roref %s, file %s"%(self.roref, ro_file))
         self.getRoFilename()  # Check that we have one
         basedir = os.path.abspath(self.roref)+os.path.sep
+        s = self.getRoUri()
         ### print "- ro_file: %s"%(ro_file)
         if os.path.isdir(ro_file):
             ro_file = os.path.abspath(ro_file)+os.path.sep
             ### print "- ro_file: %s"%(ro_file)
             ### print "- basedir: %s"%(basedir)
-            #if ro_file.endswith(os.path.sep):
-            #    ro_file = ro_file[0:-1]
             if recurse:
-                rofiles = filter(notHidden,
-                    MiscUtils.ScanDirectories.CollectDirectoryContents(ro_file, 
-                          baseDir=basedir,
-                          listDirs=includeDirs, 
-                          listFiles=True, 
-                          recursive=recurse, 
-                          appendSep=True
-                          )
-                    )
-                log.debug("- rofiles: %s"%(repr(rofiles)))
+                # Paths are relative to the RO directory, with directory names ending in
+                # a separator, so can be appended directly to the RO URI
+                resuris = []
+                if notHidden(ro_file.replace(basedir,"",1)):
+                    resuris = self._iterLocalResources(ro_file, includeDirs)
             else:
-                rofiles = [ro_file.split(basedir+os.path.sep,1)[-1]]
+                resuris = [self.getComponentUri(ro_file.split(basedir+os.path.sep,1)[-1], isdir=True)]
         else:
-            rofiles = [self.getComponentUriRel(ro_file)]
+            resuris = [self.getComponentUri(self.getComponentUriRel(ro_file))]
+        # Find resources not already aggregated
+        aggregated = set(self._loadManifest().objects(subject=s, predicate=ORE.aggregates))
+        newstmts   = []
+        count      = 0
+        for resuri in resuris:
+            count += 1
+            if progress and count % ro_settings.PROGRESS_INTERVAL == 0:
+                progress(count)
+            if resuri not in aggregated:
+                log.debug("- resource %s"%resuri)
+                aggregated.add(resuri)
+                newstmts.append((s, ORE.aggregates, resuri))
+        if progress: progress(count)
+        if newstmts:
+            self._addManifestStmts(newstmts)
+            self._updateManifest()
+        return len(newstmts)
+
+    def _iterLocalResources(self, ro_file, includeDirs):
+        """
+        Generate URIs of resources in a local directory of the RO and all its
+        sub-directories, excluding hidden files, using and updating the saved RO
+        directory state.  The directory state is saved when all URIs have been
+        generated.
+        """
+        basedir  = os.path.abspath(self.roref)+os.path.sep
+        dirstate = ro_dirstate.readDirState(basedir)
         s = self.getRoUri()
-        for f in rofiles:
-            ### print "- file %s"%f
-            log.debug("- file %s"%f)
-            stmt = (s, ORE.aggregates, self.getComponentUri(f))
-            if stmt not in self.manifestgraph: self.manifestgraph.add(stmt)
-        self._updateManifest()
+        for f in ro_dirstate.iterDirectoryContents(basedir, ro_file, dirstate,
+                listDirs=includeDirs, listFiles=True):
+            yield s+urllib.pathname2url(f)
+        ro_dirstate.writeDirState(basedir, dirstate)
         return
 
+    def pruneAggregatedResources(self, ro_file):
+        """
+        Remove from the RO aggregation any resources in a local directory of the RO
+        (or its sub-directories) that are no longer present.  Annotations aggregated
+        by the RO (which have URIs in the RO once pushed to ROSRS) are not removed,
+        and annotations of removed resources are not changed.
+
+        Returns the number of resources removed from the aggregation.
+        """
+        assert self._isLocal()
+        def notHidden(f):
+            return re.match("\.|.*/\.", f) == None
+        basedir = os.path.abspath(self.roref)+os.path.sep
+        ro_file = os.path.abspath(ro_file)+os.path.sep
+        s       = self.getRoUri()
+        prefix  = s+urllib.pathname2url(ro_file.replace(basedir,"",1))
+        present = set(self._iterLocalResources(ro_file, includeDirs=True))
+        removed = []
+        for resuri in self._loadManifest().objects(subject=s, predicate=ORE.aggregates):
+            if ( isinstance(resuri, rdflib.URIRef) and resuri.startswith(prefix) and
+                 resuri not in present and notHidden(resuri[len(s):]) and
+                 not self.isAnnotationNode(resuri) and
+                 not os.path.exists(getFilenameFromUri(resuri)) ):
+                log.debug("- remove resource %s"%resuri)
+                removed.append(resuri)
+        for resuri in removed:
+            self._removeManifestStmts((s, ORE.aggregates, resuri))
+        if removed:
+            self._updateManifest()
+        return len(removed)
+
     def removeAggregatedResource(self, resuri):
         """
         Remove a specified resource.
@@ -366,7 +807,7 @@ class ro_metadata(object):
         manifest = self._loadManifest()
         for anode in self._iterAnnotations(subject=resuri):
             self._removeAnnotationFromManifest(anode)
-        manifest.remove((None, ORE.aggregates, resuri))
+        self._removeManifestStmts((None, ORE.aggregates, resuri))
         self._updateManifest()
         return
 
@@ -401,6 +842,17 @@ class ro_metadata(object):
         self._updateManifest()
         return
 
+    def addGraphAnnotations(self, rofiles, graph):
+        """
+        Add an existing annotation graph for each of a number of resources, as for
+        addGraphAnnotation, writing the manifest once.
+        """
+        assert self._isLocal()
+        for rofile in rofiles:
+            self._addAnnotationToManifest(rofile, graph)
+        self._updateManifest()
+        return
+
     def isAnnotationNode(self, respath):
         '''
         Returns true if the manifest says that the research object aggregates the
@@ -427,6 +879,85 @@ class ro_metadata(object):
         self._updateManifest()
         return annfile
 
+    def addSharedSimpleAnnotation(self, rofiles, attrname, attrvalue, defaultType="string"):
+        """
+        Add the same simple annotation to a number of resources in a research object.
+        A single annotation body is created containing the annotation statement for
+        every resource, and is referenced by one annotation for each resource.  The
+        manifest is written once.
+
+        rofiles     is a list of files or resources to be annotated, possibly relative
+                    to the RO.
+        attrname    names the attribute in a form recognized by getAnnotationByName
+        attrvalue   is a value to be associated with the attribute
+
+        Returns the name of the annotation body created, or None if no resources are
+        supplied.
+        """
+        assert self._isLocal()
+        rofiles = list(rofiles)
+        if not rofiles: return None
+        (predicate, valtype) = ro_annotation.getAnnotationByName(self.roconfig, attrname, defaultType)
+        value    = ro_annotation.makeAnnotationValue(self.roconfig, attrvalue, valtype)
+        resuris  = [ self.getComponentUri(rofile) for rofile in rofiles ]
+        anngraph = rdflib.Graph()
+        anngraph.addN( (resuri, predicate, value, anngraph) for resuri in resuris )
+        annfile  = self._createAnnotationGraphBody(rofiles[0] if len(rofiles) == 1 else ".", anngraph)
+        for resuri in resuris:
+            self._addAnnotationToManifest(resuri, annfile)
+        self._updateManifest()
+        return annfile
+
+    def addSimpleAnnotations(self, annotations, defaultType="string", onebody=False):
+        """
+        Add a number of simple annotations to resources in a research object.  Values
+        for each resource are saved in a single new annotation body (or, if onebody is
+        True, all values are saved in one annotation body, referenced by one annotation
+        for each resource as for addSharedSimpleAnnotation), and the manifest is written
+        once when all annotations have been added.
+
+        annotations is an iterable of (rofile, attrname, attrvalue) tuples, where rofile
+                    names the file or resource to be annotated, possibly relative to
+                    the RO, and attrname and attrvalue are as for addSimpleAnnotation.
+
+        Returns a pair (count, bodies): the number of annotations added and the number
+        of annotation bodies created.
+        """
+        assert self._isLocal()
+        attrtypes = {}      # Attribute name -> (predicate, type)
+        resgraphs = {}      # Resource URI -> (rofile, annotation graph)
+        resorder  = []
+        count     = 0
+        for (rofile, attrname, attrvalue) in annotations:
+            if attrname not in attrtypes:
+                attrtypes[attrname] = ro_annotation.getAnnotationByName(
+                    self.roconfig, attrname, defaultType)
+            (predicate, valtype) = attrtypes[attrname]
+            resuri = self.getComponentUri(rofile)
+            if resuri not in resgraphs:
+                resgraphs[resuri] = (rofile, rdflib.Graph())
+                resorder.append(resuri)
+            anngraph = resgraphs[resuri if not onebody else resorder[0]][1]
+            anngraph.add( (resuri, predicate,
+                ro_annotation.makeAnnotationValue(self.roconfig, attrvalue, valtype)) )
+            count += 1
+        if not count:
+            return (0, 0)
+        if onebody:
+            rofile = resgraphs[resorder[0]][0] if len(resorder) == 1 else "."
+            annfile = self._createAnnotationGraphBody(rofile, resgraphs[resorder[0]][1])
+            for resuri in resorder:
+                self._addAnnotationToManifest(resuri, annfile)
+            bodies = 1
+        else:
+            for resuri in resorder:
+                (rofile, anngraph) = resgraphs[resuri]
+                annfile = self._createAnnotationGraphBody(rofile, anngraph)
+                self._addAnnotationToManifest(resuri, annfile)
+            bodies = len(resorder)
+        self._updateManifest()
+        return (count, bodies)
+
     def removeSimpleAnnotation(self, rofile, attrname, attrvalue):
         """
         Remove a simple annotation or multiple matching annotations a research object.
@@ -434,6 +965,11 @@ class ro_metadata(object):
         rofile      names the annotated file or resource, possibly relative to the RO.
         attrname    names the attribute in a form recognized by getAnnotationByName
         attrvalue   is the attribute value to be deleted, or Nomne to delete all vaues
+
+        An annotation body may be shared by several annotations (e.g. see
+        addSharedSimpleAnnotation): if other statements remain in the body, a new body
+        is written without the removed statements and all annotations using the body
+        are updated to refer to it.
         """
         assert self._isLocal()
         ro_dir    = self.getRoFilename()
@@ -441,33 +977,44 @@ class ro_metadata(object):
         subject     = self.getComponentUri(rofile)
         (predicate,valtype) = ro_annotation.getAnnotationByName(self.roconfig, attrname)
         val         = attrvalue and ro_annotation.makeAnnotationValue(self.roconfig, attrvalue, valtype)
-        add_annotations    = []
+        replace_bodies     = []
+        remove_targets     = []
         remove_annotations = []
         log.debug("removeSimpleAnnotation subject %s, predicate %s, val %s"%
                   (str(subject), str(predicate), val))
         # Scan for annotation graph resources containing this annotation
-        for ann_node in self._iterAnnotations(subject=subject):
+        ann_uris = set()
+        for ann_node in list(self._iterAnnotations(subject=subject)):
             ann_uri   = ro_graph.value(subject=ann_node, predicate=AO.body)
             log.debug("removeSimpleAnnotation ann_uri %s"%(str(ann_uri)))
-            if self.isRoMetadataRef(ann_uri):
-                ann_graph = self._readAnnotationBody(self.getComponentUriRel(ann_uri))
-                log.debug("removeSimpleAnnotation ann_graph %s"%(ann_graph))
-                if (subject, predicate, val) in ann_graph:
-                    ann_graph.remove((subject, predicate, val))
-                    if (subject, None, None) in ann_graph:
-                        # Triples remain in annotation body: write new body and update RO graph
-                        ann_name = self._createAnnotationGraphBody(rofile, ann_graph)
-                        remove_annotations.append(ann_node)
-                        add_annotations.append(ann_name)
-                    else:
-                        # Remove annotation from RO graph
-                        remove_annotations.append(ann_node)
+            if ann_uri in ann_uris or not self.isRoMetadataRef(ann_uri):
+                continue
+            ann_uris.add(ann_uri)
+            ann_graph = self._readAnnotationBody(self.getComponentUriRel(ann_uri))
+            log.debug("removeSimpleAnnotation ann_graph %s"%(ann_graph))
+            if (subject, predicate, val) in ann_graph:
+                ann_graph.remove((subject, predicate, val))
+                ann_nodes = list(ro_graph.subjects(predicate=AO.body, object=ann_uri))
+                if len(ann_graph) == 0:
+                    # Nothing remains in annotation body: remove annotations from RO graph
+                    remove_annotations.extend(ann_nodes)
+                    continue
+                # Triples remain in annotation body: write new body and update RO graph
+                ann_name = self._createAnnotationGraphBody(rofile, ann_graph)
+                replace_bodies.append((ann_uri, ann_name))
+                if (subject, None, None) not in ann_graph:
+                    remove_targets.extend( (a, subject) for a in ann_nodes )
         # Update RO manifest graph if needed
-        if add_annotations or remove_annotations:
+        if replace_bodies or remove_targets or remove_annotations:
+            for (ann_uri, ann_name) in replace_bodies:
+                self._replaceAnnotationBody(ann_uri, ann_name)
+            for (a, s) in remove_targets:
+                self._removeManifestStmts((a, RO.annotatesAggregatedResource, s))
+                if ( (a, RO.annotatesAggregatedResource, None) not in ro_graph and
+                     (a, AO.annotatesResource, None) not in ro_graph ):
+                    remove_annotations.append(a)
             for a in remove_annotations:
                 self._removeAnnotationFromManifest(a)
-            for a in add_annotations:
-                self._addAnnotationToManifest(rofile, a)
             self._updateManifest()
         return
 
@@ -486,11 +1033,10 @@ class ro_metadata(object):
         (predicate,valtype) = ro_annotation.getAnnotationByName(self.roconfig, attrname)
         log.debug("Replace annotation: subject %s, predicate %s, value %s"%
                   (repr(subject), repr(predicate), repr(attrvalue)))
-        ro_graph.remove((subject, predicate, None))
-        ro_graph.add((subject, predicate,
+        self._removeManifestStmts((subject, predicate, None))
+        self._addManifestStmt((subject, predicate,
                       ro_annotation.makeAnnotationValue(self.roconfig, attrvalue, valtype)))
         self._updateManifest()
-        self.roannotations = None   # Flush cached annotation graph
         return
 
     def iterateAnnotations(self, subject=None, property=None):
@@ -587,16 +1133,20 @@ class ro_metadata(object):
         return self._loadAnnotations().value(subject=resource, predicate=predicate, object=None)
 
     def showAnnotations(self, annotations, outstr):
-        ro_annotation.showAnnotations(self.roconfig, self.getRoFilename(), annotations, outstr)
+        if self.rozip is not None:
+            ro_dir = str(self.getRoUri())
+        else:
+            ro_dir = self.getRoFilename()
+        ro_annotation.showAnnotations(self.roconfig, ro_dir, annotations, outstr)
         return
     
     def replaceUri(self, ann_node, remote_ann_node_uri):
-        for (p, o) in self.manifestgraph.predicate_objects(subject = ann_node):
-            self.manifestgraph.remove((ann_node, p, o))
-            self.manifestgraph.add((remote_ann_node_uri, p, o))
-        for (s, p) in self.manifestgraph.subject_predicates(object = ann_node):
-            self.manifestgraph.remove((s, p, ann_node))
-            self.manifestgraph.add((s, p, remote_ann_node_uri))
+        for (p, o) in list(self.manifestgraph.predicate_objects(subject = ann_node)):
+            self._removeManifestStmts((ann_node, p, o))
+            self._addManifestStmt((remote_ann_node_uri, p, o))
+        for (s, p) in list(self.manifestgraph.subject_predicates(object = ann_node)):
+            self._removeManifestStmts((s, p, ann_node))
+            self._addManifestStmt((s, p, remote_ann_node_uri))
         self._updateManifest()
         return
 
@@ -655,38 +1205,58 @@ class ro_metadata(object):
     def getRoUri(self):
         return self.rouri
 
-    def getComponentUri(self, path):
+    def _getUriCache(self):
+        """
+        Return cache of URI conversions for the current RO URI, creating a new one
+        (and recomputing the RO base prefix) if the RO URI has changed.
+        """
+        if self.uricache is None or self.uricacherouri != self.rouri:
+            self.uricache      = UriCache(ro_settings.URI_CACHE_SIZE)
+            self.uricacherouri = self.rouri
+            self.uriprefix     = urlparse.urlunsplit(urlparse.urlsplit(str(self.rouri)))
+        return self.uricache
+
+    def getComponentUri(self, path, isdir=None):
         """
         Return URI for component where relative reference is treated as a file path
+
+        isdir   if not None, indicates whether the path refers to a directory, so the
+                file system does not need to be consulted.  Results are memoized, so a
+                directory created after a path has been resolved is not noticed.
         """
-        if urlparse.urlsplit(path).scheme == "":
-            path = resolveUri("", str(self.getRoUri()), path)
-        return rdflib.URIRef(path)
+        def resolve():
+            if urlparse.urlsplit(path).scheme == "":
+                return rdflib.URIRef(resolveUri("", str(self.getRoUri()), path, isdir))
+            return rdflib.URIRef(path)
+        return self._getUriCache().get(("file", path, isdir), resolve)
 
     def getComponentUriAbs(self, path):
         """
         Return absolute URI for component where relative reference is treated as a URI reference
         """
-        return rdflib.URIRef(urlparse.urljoin(str(self.getRoUri()), path))
+        def resolve():
+            return rdflib.URIRef(urlparse.urljoin(str(self.getRoUri()), path))
+        return self._getUriCache().get(("abs", path), resolve)
 
     def getComponentUriRel(self, path):
         """
         Return reference relative to RO for a supplied URI
         """
-        file_uri = urlparse.urlunsplit(urlparse.urlsplit(str(self.getComponentUriAbs(path))))
-        ro_uri   = urlparse.urlunsplit(urlparse.urlsplit(str(self.getRoUri())))
-        if ro_uri is not None and file_uri.startswith(ro_uri):
-            file_uri_rel = file_uri.replace(ro_uri, "", 1)
-        else:
-            file_uri_rel = path
-        return rdflib.URIRef(file_uri_rel)
+        def relative():
+            file_uri = urlparse.urlunsplit(urlparse.urlsplit(str(self.getComponentUriAbs(path))))
+            if file_uri.startswith(self.uriprefix):
+                return rdflib.URIRef(file_uri[len(self.uriprefix):])
+            return rdflib.URIRef(path)
+        return self._getUriCache().get(("rel", path), relative)
 
     def isRoMetadataRef(self, uri):
         """
         Test if supplied URI is a reference to the current RO metadata area
         """
-        urirel = self.getComponentUriRel(uri)
-        return str(urirel).startswith(ro_settings.MANIFEST_DIR+"/")
+        def test():
+            urirel = self.getComponentUriRel(uri)
+            return str(urirel).startswith(ro_settings.MANIFEST_DIR+"/")
+        return self._getUriCache().get(("meta", uri), test)
 
     def isLocalFileRo(self):
         """
@@ -695,7 +1265,13 @@ class ro_metadata(object):
         return isFileUri(self.getRoUri())
 
     def getRoFilename(self):
+        """
+        Return RO directory name: used for local updates.  An IOError is raised if
+        the RO is accessed from a zip file, which is read-only.
+        """
         assert self._isLocal()
+        if self.rozip is not None:
+            raise IOError(errno.EROFS, "RO in zip file is read-only", str(self.roref))
         return getFilenameFromUri(self.getRoUri())
 
     def getManifestFilename(self):
@@ -737,12 +1313,44 @@ class ro_metadata(object):
         '''
         Calculate a file checksum.
         '''
-        m = hashlib.md5()
-        with open(rofile) as f:
-            for line in f:
-                m.update(line)
-            f.close()
-        return m.hexdigest()
+        return self.calculateChecksums([rofile])[rofile]
+
+    def calculateChecksums(self, rofiles, errors=None):
+        '''
+        Calculate checksums for a number of files, returning a dictionary that maps
+        each file name to its checksum.
+
+        If errors is supplied, it is a dictionary in which an IOError or OSError raised
+        for a file that cannot be read is saved, keyed by the file name, and the file
+        is omitted from the result.  Otherwise, the exception is raised.
+
+        Checksums are cached in the synchronization registries, keyed by the file's
+        inode, size and modification time, so unchanged files are not read again.
+        Other files are read by a pool of worker threads.  The checksum algorithm and
+        number of threads are taken from configuration options "checksumAlgorithm"
+        and "checksumWorkers".
+        '''
+        algorithm  = self.roconfig.get("checksumAlgorithm", ro_settings.CHECKSUM_ALGORITHM)
+        workers    = self.roconfig.get("checksumWorkers", ro_settings.CHECKSUM_WORKERS)
+        registries = self.getRegistries()
+        checksums  = {}
+        stamps     = {}
+        for f in rofiles:
+            try:
+                stamps[f] = [algorithm] + ro_checksum.getFileStamp(f)
+            except OSError as e:
+                if errors is None: raise
+                errors[f] = e
+                continue
+            cached = registries.get("%s,checksumcache"%f, None)
+            if cached and cached[:-1] == stamps[f]:
+                checksums[f] = cached[-1]
+        pending = [ f for f in stamps if f not in checksums ]
+        log.debug("calculateChecksums: %d cached, %d to calculate"%(len(checksums), len(pending)))
+        for (f, c) in ro_checksum.calculateChecksums(pending, algorithm, workers, errors).items():
+            registries["%s,checksumcache"%f] = stamps[f] + [c]
+            checksums[f] = c
+        return checksums
 
 # End.
 
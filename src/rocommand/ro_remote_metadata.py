@@ -39,6 +39,12 @@ import ro_annotation
 import json
 import urllib2
 import tempfile
+import base64
+import zipfile
+from multiprocessing.pool import ThreadPool
+
+from MiscUtils.HttpSession import HTTP_Session
+import ro_checksum
 
 # Class for ROSRS errors
 
@@ -103,29 +109,119 @@ def deleteRO(httpsession, rouri):
         return (status, reason)
     raise ROSRS_Error("Error deleting RO", "%03d %s"%(status, reason), httpsession.baseuri())
 
-def getAsZip(rouri):
+def getAsZip(rouri, httpsession=None, progress=None, checksum=None):
     """
     Retrieves a Research Object version from ROSRS as a zip.
-    
-    Parameters: ROSRS URL, username, password, RO id, version id
+
+    The zip data is written to a temporary file as it is received, so the whole
+    archive is never held in memory.  If the response has a Content-MD5 header,
+    or if a checksum is supplied, the content of the file is checked against it.
+
+    rouri       is the URI of the RO to retrieve
+    httpsession is an HTTP session used for the request; if not supplied, a new
+                session is created for the RO URI
+    progress    if supplied, is called as data is received, as
+                progress(bytes received, content length or None)
+    checksum    if supplied, is an MD5 (32 hex digits) or SHA-256 (64 hex digits)
+                checksum of the expected zip file content
+
+    Returns an open temporary file positioned at the start of the zip data.
+    The file has a name, so it can be reopened (e.g. by extractZip).
     """
-    req = urllib2.Request(rouri)
-    req.add_header("Accept", "application/zip")
-    res = urllib2.urlopen(req)
-    
-    tmp = tempfile.TemporaryFile()
-    while True:
-        packet = res.read()
-        if not packet:
-            break
-        tmp.write(packet)
-    res.close()
-    log.debug("Ro %s retrieved as zip" % rouri)
+    if httpsession is None:
+        httpsession = HTTP_Session(str(rouri))
+    tmp = tempfile.NamedTemporaryFile(prefix="ro_checkout", suffix=".zip")
+    try:
+        (status, reason, headers, uri, size) = httpsession.doRequestFollowRedirect(rouri,
+            accept="application/zip", exthost=True, outfile=tmp, progress=progress)
+        if status != 200:
+            raise ROSRS_Error("Error retrieving RO as zip", "%03d %s"%(status, reason), rouri)
+        tmp.flush()
+        if headers.get("content-md5"):
+            expected = base64.b64decode(headers["content-md5"]).encode("hex")
+            if ro_checksum.calculateChecksum(tmp.name, "md5") != expected:
+                raise ROSRS_Error("Retrieved zip does not match Content-MD5", expected, rouri)
+        if checksum:
+            algorithm = { 32: "md5", 64: "sha256" }.get(len(checksum))
+            if not algorithm:
+                raise ROSRS_Error("Unrecognized checksum", checksum, rouri)
+            if ro_checksum.calculateChecksum(tmp.name, algorithm) != checksum.lower():
+                raise ROSRS_Error("Retrieved zip does not match %s checksum"%(algorithm), checksum, rouri)
+    except:
+        tmp.close()
+        raise
+    tmp.seek(0)
+    log.debug("Ro %s retrieved as zip, %d bytes" % (rouri, size))
     return tmp
 
+def extractZip(zipname, rodir, workers=None):
+    """
+    Extract the content of a zip file into a directory, which is created if
+    needed.  Before anything is written, the sizes recorded in the zip central
+    directory are checked against the free space on the target file system.
+    Directories are created first, then files are extracted by a pool of worker
+    threads, each reading the zip file through a separate handle.
+
+    zipname     is the name of the zip file to extract
+    rodir       is the directory into which the zip content is extracted
+    workers     is the number of worker threads used (default ro_settings.EXTRACT_WORKERS)
+
+    Returns a list of the names of the extracted members.
+    """
+    zf = zipfile.ZipFile(zipname)
+    try:
+        members = zf.infolist()
+    finally:
+        zf.close()
+    rodir  = os.path.abspath(rodir)
+    needed = sum( m.file_size for m in members )
+    if hasattr(os, "statvfs"):
+        fsdir = rodir
+        while not os.path.isdir(fsdir):
+            fsdir = os.path.dirname(fsdir)
+        st   = os.statvfs(fsdir)
+        free = st.f_bavail * st.f_frsize
+        if needed > free:
+            raise ROSRS_Error("Insufficient disk space to extract RO",
+                "%d bytes needed, %d available"%(needed, free))
+    files = []
+    for m in members:
+        path = os.path.normpath(os.path.join(rodir, m.filename))
+        if not (path+os.sep).startswith(rodir+os.sep):
+            raise ROSRS_Error("Zip member outside RO directory", m.filename)
+        if m.filename.endswith("/"):
+            if not os.path.isdir(path): os.makedirs(path)
+        else:
+            if not os.path.isdir(os.path.dirname(path)): os.makedirs(os.path.dirname(path))
+            files.append(m)
+    workers = min(workers or ro_settings.EXTRACT_WORKERS, len(files))
+    def extractFiles(group):
+        zf = zipfile.ZipFile(zipname)
+        try:
+            for m in group:
+                zf.extract(m, rodir)
+        finally:
+            zf.close()
+        return
+    if workers <= 1:
+        extractFiles(files)
+    else:
+        pool = ThreadPool(workers)
+        try:
+            pool.map(extractFiles, [ files[i::workers] for i in range(workers) ])
+        finally:
+            pool.close()
+    log.debug("extractZip: %d members extracted to %s"%(len(members), rodir))
+    return [ m.filename for m in members ]
+
 def sendZipRO(httpsession, uripath, roId, zip, service_path="zip/upload"):
     """
     Send a research object in the zip format. 
+
+    zip is the zip file content, which may be supplied as a string, as a file
+    object or as an iterator over blocks of zip data (see ro_manifest.iterROZipMembers
+    and MiscUtils.ZipStream.iterZipData); the latter are sent as they are read.
+
     Returns: status
     """
     reqheaders   = {
@@ -138,12 +234,14 @@ class ro_remote_metadata(object):
     Class for accessing metadata of an RO stored by a ROSR service
     """
 
-    def __init__(self, roconfig, httpsession, rouri, dummysetupfortest=False):
+    def __init__(self, roconfig, httpsession, rouri, dummysetupfortest=False, empty=False):
         """
         Initialize: read manifest from object at given directory into local RDF graph
 
         roconfig    is the research object manager configuration, supplied as a dictionary
         rouri       a URI reference that refers to the Research Object to be accessed
+        empty       if True, represents an RO not yet created in the ROSRS: the
+                    manifest is empty and nothing is requested from the service
         """
         self.roconfig = roconfig 
         self.httpsession = httpsession       
@@ -153,6 +251,7 @@ class ro_remote_metadata(object):
         self.roannotations = None
         self.manifesturi  = self.getManifestUri()
         self.dummyfortest = dummysetupfortest
+        self.empty        = empty
         self._loadManifest()
         # Get RO URI from manifest
         # May be different from computed value if manifest has absolute URI
@@ -179,12 +278,22 @@ class ro_remote_metadata(object):
     def _loadManifest(self, refresh = False):
         if self.manifestgraph and not refresh: return self.manifestgraph
         self.manifestgraph = rdflib.Graph()
-        if self.dummyfortest:
-            # Fake minimal manifest graph for testing
-            self.manifestgraph.add( (self.rouri, RDF.type, RO.ResearchObject) )
+        if self.dummyfortest or self.empty:
+            # Minimal manifest graph for an RO that does not (yet) exist
+            self.manifestgraph.add( (rdflib.URIRef(self.rouri), RDF.type, RO.ResearchObject) )
         else:
-            # Read manifest graph
-            self.manifestgraph.parse(self.manifesturi)
+            # Read manifest graph through the ROSRS session, so that connections,
+            # cached responses and the access token are used.  The session's graph
+            # is shared, so it is copied here.
+            rohandle = self.httpsession.getROHandle(self.rouri)
+            if refresh: rohandle.invalidate()
+            (status, reason, _, manifesturi, manifest) = self.httpsession.getROManifest(self.rouri)
+            if status != 200:
+                raise self.error("No manifest", "%03d %s (%s)"%(status, reason, str(self.rouri)))
+            for (prefix, uri) in manifest.namespaces():
+                self.manifestgraph.bind(prefix, uri)
+            self.manifestgraph += manifest
+            self.manifesturi = manifesturi
         return self.manifestgraph
     
     def reloadManifest(self):
@@ -192,13 +301,14 @@ class ro_remote_metadata(object):
 
     def _loadAnnotations(self):
         if self.roannotations: return self.roannotations
+        if self.empty:
+            self.roannotations = rdflib.Graph()
+            return self.roannotations
         # Assemble annotation graph
         # NOTE: the manifest itself is included as an annotation by the RO setup
-        self._loadManifest()
-        self.roannotations = rdflib.Graph()
-        for (ann_node, subject) in self.manifestgraph.subject_objects(predicate=RO.annotatesAggregatedResource):
-            ann_uri   = self.manifestgraph.value(subject=ann_node, predicate=AO.body)
-            self._readAnnotationBody(ann_uri, self.roannotations)
+        # Bodies are each read once; the manifest graph already loaded is reused
+        self.roannotations = self.httpsession.getROAnnotationGraph(self.rouri,
+            manifest=self._loadManifest(), manifesturi=self.manifesturi)
         log.debug("roannotations graph:\n"+self.roannotations.serialize())
         return self.roannotations
     
@@ -313,17 +423,22 @@ class ro_remote_metadata(object):
         return (status, reason, headers, resuri)
 
     def updateResourceInt(
-            self, respath, ctype="application/octet-stream", body=None):
+            self, respath, ctype="application/octet-stream", body=None, etag=None):
         """
-        Update an already aggregated internal resource
-        Return (status, reason, None, resuri), where status is 200
+        Update an already aggregated internal resource.  If etag is supplied, the
+        update is conditional on the resource having that ETag.
+        Return (status, reason, headers, respath), where status is 200, or 412 if
+        the resource ETag does not match
 
         NOTE: this method has been adapted from TestApi_ROSRS
         """
         resuri = self.getComponentUriAbs(respath)
+        reqheaders = etag and { "if-match": etag }
         # PUT resource content to indicated URI
         (status, reason, headers, _) = self.httpsession.doRequest(
-            resuri, method="PUT", ctype=ctype, body=body)
+            resuri, method="PUT", ctype=ctype, body=body, reqheaders=reqheaders)
+        if etag and status == 412:
+            return (status, reason, headers, respath)
         if status != 200:
             raise self.error("Error updating aggregated resource content",
                 "%03d %s (%s)"%(status, reason, respath))
@@ -416,10 +531,20 @@ class ro_remote_metadata(object):
         return (self.rouri, ORE.aggregates, resuri) in self.manifestgraph and \
             (resuri, RDF.type, RO.AggregatedAnnotation) in self.manifestgraph
             
+    def _annotationTargets(self, targetpath):
+        """
+        Returns RDF/XML for the targets of an annotation, where targetpath is the
+        path of the annotated resource, or a list of paths.
+        """
+        if not isinstance(targetpath, list):
+            targetpath = [targetpath]
+        return "\n                 ".join(
+            [ '<ao:annotatesResource rdf:resource="%s" />'%(str(t)) for t in targetpath ])
+
     def addAnnotationNode(self, bodypath, targetpath):
         """
         Aggregate an annotation of an existing resource using an existing annotation
-        body.
+        body.  targetpath is the path of the annotated resource, or a list of paths.
         Return (status, reason, annuri), where status is 201
 
         NOTE: this method has been adapted from TestApi_ROSRS
@@ -433,11 +558,11 @@ class ro_remote_metadata(object):
                xml:base="%s"
             >
                <ro:AggregatedAnnotation>
-                 <ao:annotatesResource rdf:resource="%s" />
+                 %s
                  <ao:body rdf:resource="%s" />
                </ro:AggregatedAnnotation>
             </rdf:RDF>
-            """%(str(self.rouri), str(targetpath), str(bodypath))
+            """%(str(self.rouri), self._annotationTargets(targetpath), str(bodypath))
         (status, reason, headers, _) = self.httpsession.doRequest(self.rouri,
             method="POST",
             ctype="application/vnd.wf4ever.annotation",
@@ -453,6 +578,7 @@ class ro_remote_metadata(object):
         """
         Update an aggregated annotation of an existing resource using an 
         existing annotation body.
+        targetpath is the path of the annotated resource, or a list of paths.
         Return (status, reason), where status is 200
 
         NOTE: this method has been adapted from TestApi_ROSRS
@@ -467,11 +593,11 @@ class ro_remote_metadata(object):
                xml:base="%s"
             >
                <ro:AggregatedAnnotation>
-                 <ao:annotatesResource rdf:resource="%s" />
+                 %s
                  <ao:body rdf:resource="%s" />
                </ro:AggregatedAnnotation>
             </rdf:RDF>
-            """%(str(self.rouri), str(targetpath), str(bodypath))
+            """%(str(self.rouri), self._annotationTargets(targetpath), str(bodypath))
         (status, reason, _, _) = self.httpsession.doRequest(annuri,
             method="PUT",
             ctype="application/vnd.wf4ever.annotation",
@@ -8,11 +8,18 @@ __author__      = "piotrhol"
 __copyright__   = "PNSC (@@check)"
 __license__     = "MIT (http://opensource.org/licenses/MIT)"
 
+import os
 import logging
+import hashlib
+import threading
+import collections
 import rdflib
 import mimetypes
+from multiprocessing.pool import ThreadPool
 
 from rocommand import ro_uriutils
+from rocommand import ro_manifest
+from rocommand import ro_settings
 from rocommand.ro_remote_metadata import ROSRS_Error
 
 log = logging.getLogger(__name__)
@@ -27,133 +34,209 @@ ACTION_SKIP = 7
 ACTION_DELETE = 8
 ACTION_DELETE_ANNOTATION = 9
 ACTION_ERROR = 10
+ACTION_SKIP_ANNOTATION = 11
 
-def pushResearchObject(localRo, remoteRo, force = False):
+ANNOTATION_ACTIONS = (
+    [ ACTION_AGGREGATE_ANNOTATION
+    , ACTION_UPDATE_ANNOTATION
+    , ACTION_SKIP_ANNOTATION
+    , ACTION_DELETE_ANNOTATION
+    ])
+
+def pushResearchObject(localRo, remoteRo, force = False, workers = None, dryrun = False,
+        trustetags = False):
     '''
     Scans a given RO version directory for files that have been modified since last synchronization
     and pushes them to ROSRS. Modification is detected by checking modification times and checksums.
+
+    Up to "workers" resources are uploaded concurrently (default ro_settings.PUSH_WORKERS).
+
+    If trustetags is True, the ETags recorded when resources were last pushed are assumed
+    to be current, rather than being checked with a HEAD request (see PushResearchObject.plan).
+
+    If dryrun is True, the (action, uri) pairs that would be generated by pushing the RO are
+    returned without changing anything (see PushResearchObject.plan).
     '''
-    push = PushResearchObject(localRo, remoteRo, force)
+    push = PushResearchObject(localRo, remoteRo, force, workers, trustetags)
+    if dryrun:
+        for (action, uri, _) in push.plan():
+            yield (action, uri)
+        return
     for (action, uri) in push.push():
         yield (action, uri)
     return
 
 class PushResearchObject:
+    '''
+    Pushes a local RO to ROSRS in two phases: a plan is calculated by comparing the
+    local and remote RO manifests and the synchronization data recorded by the previous
+    push, and is then executed.
+
+    The plan is a list of (action, uri, args) triples, in the order in which actions
+    are performed: resources to aggregate, update or skip, resources to deaggregate,
+    annotations to aggregate, update or skip, then annotations to delete.  Each action is
+    one of the ACTION_ values, which is also returned when the action is performed,
+    and args are values used to perform it.
+    '''
     
-    def __init__(self, localRo, remoteRo, force = False):
+    def __init__(self, localRo, remoteRo, force = False, workers = None, trustetags = False):
         self._localRo = localRo
         self._remoteRo = remoteRo
         self._force = force
+        self._workers = workers or ro_settings.PUSH_WORKERS
+        self._trustetags = trustetags
+        self._lock = threading.Lock()     # Guards local RO registries
     
-    def push(self):        
+    def push(self):
+        for (action, uri) in self.execute(self.plan()):
+            yield (action, uri)
+        return
+
+    def plan(self):
+        '''
+        Returns a plan for pushing the local RO, calculated from the remote RO
+        manifest as currently loaded.  The only requests made are HEAD requests
+        for the ETags of resources already aggregated by the remote RO, which are
+        issued concurrently.
+
+        If ETags are trusted, no HEAD request is made for a resource whose ETag was
+        recorded when it was last pushed: if its content is unchanged, it is skipped,
+        otherwise it is updated using a PUT conditional on the recorded ETag.  Any
+        change in ROSRS is then detected when the PUT fails, and the resource is
+        overwritten.  Changes in ROSRS to resources that are not changed locally are
+        not detected.
+        '''
         mimetypes.init()
-        for localResuri in self._localRo.getAggregatedResources():
-            for (action, uri) in self.__uploadLocalResource(localResuri):
-                yield (action, uri)
-        self._remoteRo.reloadManifest()
-        
-        for resuri in self._remoteRo.getAggregatedResources():
-            for (action, uri) in self.__checkRemoteResource(resuri):
-                yield (action, uri)
-        self._remoteRo.reloadManifest()
-                    
-        for (ann_node, ann_body, ann_target) in self._localRo.getAllAnnotationNodes():
-            for (action, uri) in self.__uploadLocalAnnotation(ann_node, ann_body, ann_target):
-                yield (action, uri)
-        self._remoteRo.reloadManifest()
-                
-        for (ann_node, ann_body, ann_target) in self._remoteRo.getAllAnnotationNodes():
-            for (action, uri) in self.__checkRemoteAnnotation(ann_node):
-                yield (action, uri)
-        self._remoteRo.reloadManifest()
-        
+        # Calculate checksums of local resources together, using cached values for
+        # unchanged files.  Files that cannot be read are reported as errors when
+        # their resources are planned.
+        errors = {}
+        checksums = self._localRo.calculateChecksums(self.__getLocalResourceFiles(), errors)
+        registries = self._localRo.getRegistries()
+        steps = [ self.__planLocalResource(localResuri, checksums, errors, registries)
+                  for localResuri in self._localRo.getAggregatedResources() ]
+        # Get remote ETags for resources to be updated, unless trusting recorded ETags
+        updates = [ s for s in steps if s and s[0] == ACTION_UPDATE ]
+        probes  = [ s for s in updates
+                    if not (self._trustetags and registries.get("%s,etag"%s[2][1], None)) ]
+        etags   = dict(zip(map(id, probes), self.__getRemoteETags([ s[1] for s in probes ])))
+        for step in updates:
+            (localResuri, filename, ismetadata, checksum) = step[2]
+            previousETag = registries.get("%s,etag"%filename, None)
+            previousChecksum = registries.get("%s,checksum"%filename, None)
+            etag = etags.get(id(step), previousETag)
+            if isinstance(etag, Exception):
+                step[:] = [ACTION_ERROR, etag, ()]
+                continue
+            if not previousETag or previousETag != etag:
+                log.debug("ResourceSync.pushResearchObject: %s has been modified in ROSRS (ETag was %s is %s)"%(step[1], previousETag, etag))
+                step[0] = ACTION_UPDATE_OVERWRITE
+            elif not previousChecksum or previousChecksum != checksum:
+                log.debug("ResourceSync.pushResearchObject: %s has been modified locally (checksum was %s is %s)"%(step[1], previousChecksum, checksum))
+            else:
+                log.debug("ResourceSync.pushResearchObject: %s has NOT been modified"%(step[1]))
+                step[:] = [ACTION_SKIP, step[1], ()]
+                continue
+            # Update is conditional on the remote resource not having changed
+            step[2] = step[2] + (etag,)
+        plan = [ tuple(s) for s in steps if s ]
+        for resuri in list(self._remoteRo.getAggregatedResources()):
+            plan.extend(self.__planRemoteResource(resuri))
+        for (ann_node, ann_body, ann_targets) in self.__getAnnotationNodes(self._localRo):
+            plan.extend(self.__planLocalAnnotation(ann_node, ann_body, ann_targets,
+                checksums, registries))
+        for (ann_node, ann_body, ann_targets) in self.__getAnnotationNodes(self._remoteRo):
+            plan.extend(self.__planRemoteAnnotation(ann_node))
+        return plan
+
+    def execute(self, plan):
+        '''
+        Performs the actions in a push plan, generating (action, uri) pairs as they
+        are performed, in plan order.  Resource content is uploaded by a pool of
+        worker threads.  The remote RO manifest is reloaded once, at the end, if
+        anything has been changed.
+        '''
+        uploads = ( self.__executeStep(step) for step in plan
+                    if step[0] not in ANNOTATION_ACTIONS )
+        for (action, uri) in self.__runUploads(uploads):
+            yield (action, uri)
+        for step in plan:
+            if step[0] in ANNOTATION_ACTIONS:
+                for (action, uri) in self.__executeStep(step):
+                    yield (action, uri)
+        if [ s for s in plan if s[0] not in [ACTION_SKIP, ACTION_SKIP_ANNOTATION, ACTION_ERROR] ]:
+            self._remoteRo.reloadManifest()
         self._localRo.saveRegistries()
         return
     
-    def __uploadLocalResource(self, localResuri):
+    def __getLocalResourceFiles(self):
+        filenames = []
+        for localResuri in self._localRo.getAggregatedResources():
+            if self._localRo.isInternalResource(localResuri):
+                filename = self.__getLocalFilename(localResuri)
+                if os.path.isfile(filename):
+                    filenames.append(filename)
+        return filenames
+
+    def __planLocalResource(self, localResuri, checksums, errors, registries):
+        '''
+        Returns a plan step (as a list, which may be updated) for a local resource,
+        or None if nothing is done for the resource.  Internal resources already
+        aggregated by the remote RO are initially planned as updates.
+        '''
         try:
             respath = self._localRo.getComponentUriRel(localResuri)
-            if not self._remoteRo.isAggregatedResource(respath):
-                for (action, uri) in self.__createResource(localResuri, respath):
-                    yield (action, uri)
+            if self._localRo.isInternalResource(localResuri):
+                log.debug("ResourceSync.pushResearchObject: %s is internal"%(localResuri))
+                if self._localRo.isAnnotationNode(respath):
+                    # annotations are handled separately
+                    return None
+                filename = self.__getLocalFilename(localResuri)
+                if filename in errors:
+                    raise errors[filename]
+                checksum = checksums.get(filename) or self._localRo.calculateChecksum(filename)
+                args = (localResuri, filename, self._localRo.isRoMetadataRef(localResuri), checksum)
+                if not self._remoteRo.isAggregatedResource(respath):
+                    log.debug("ResourceSync.pushResearchObject: %s does was not aggregated in the remote RO"%(respath))
+                    return [ACTION_AGGREGATE_INTERNAL, respath, args]
+                log.debug("ResourceSync.pushResearchObject: %s does was already aggregated in the remote RO"%(respath))
+                return [ACTION_UPDATE, respath, args]
+            elif self._localRo.isExternalResource(localResuri):
+                log.debug("ResourceSync.pushResearchObject: %s is external"%(localResuri))
+                if not self._remoteRo.isAggregatedResource(respath):
+                    return [ACTION_AGGREGATE_EXTERNAL, respath, ()]
+                return [ACTION_SKIP, localResuri, ()]
             else:
-                for (action, uri) in self.__updateResource(localResuri, respath):
-                    yield (action, uri)
+                log.error("ResourceSync.pushResearchObject: %s is neither internal nor external"%(localResuri))
+                return None
         except Exception as e:
             log.error("Error when processing resource %s: %s"%(localResuri, e))
-            yield (ACTION_ERROR, e)
+            return [ACTION_ERROR, e, ()]
 
-    
-    def __createResource(self, localResuri, respath):
-        log.debug("ResourceSync.pushResearchObject: %s does was not aggregated in the remote RO"%(respath))
-        if self._localRo.isInternalResource(localResuri):
-            log.debug("ResourceSync.pushResearchObject: %s is internal"%(localResuri))
-            if self._localRo.isAnnotationNode(respath):
-                # annotations are handled separately
-                pass
-            else:
-                yield (ACTION_AGGREGATE_INTERNAL, respath)
-                filename = ro_uriutils.getFilenameFromUri(localResuri)
-                currentChecksum = self._localRo.calculateChecksum(filename)
-                rf = open(filename, 'r')
-                (status, reason, headers, resuri) = self._remoteRo.aggregateResourceInt(
-                                          respath, 
-                                          mimetypes.guess_type(respath)[0], 
-                                          rf)
-                self._localRo.getRegistries()["%s,etag"%filename] = headers.get("etag", None)
-                self._localRo.getRegistries()["%s,checksum"%filename] = currentChecksum
-        elif self._localRo.isExternalResource(localResuri):
-            log.debug("ResourceSync.pushResearchObject: %s is external"%(localResuri))
-            yield (ACTION_AGGREGATE_EXTERNAL, respath)
-            self._localRo.aggregateResourceExt(respath)
-        else:
-            log.error("ResourceSync.pushResearchObject: %s is neither internal nor external"%(localResuri))
-            
-    def __updateResource(self, localResuri, respath):
-        log.debug("ResourceSync.pushResearchObject: %s does was already aggregated in the remote RO"%(respath))
-        if self._localRo.isInternalResource(localResuri):
-            log.debug("ResourceSync.pushResearchObject: %s is internal"%(localResuri))
-            if self._localRo.isAnnotationNode(respath):
-                # annotations are handled separately
-                pass
-            else:
-                log.debug("ResourceSync.pushResearchObject: %s is a resource"%(localResuri))
-                # Get remote ETag
+    def __getRemoteETags(self, respaths):
+        '''
+        Returns a list of the current ETags of the indicated remote resources, using a
+        pool of worker threads.  An exception is returned in place of an ETag that
+        cannot be retrieved.
+        '''
+        def getETag(respath):
+            try:
                 (status, reason, headers) = self._remoteRo.getHead(respath)
                 if status != 200:
                     raise Exception("Error retrieving RO resource", "%03d %s (%s)"%(status, reason, respath))
-                filename = ro_uriutils.getFilenameFromUri(localResuri)
-                currentETag = headers.get("etag", None)
-                currentChecksum = self._localRo.calculateChecksum(filename)
-                # Check locally stored ETag
-                previousETag = self._localRo.getRegistries().get("%s,etag"%filename, None)
-                previousChecksum = self._localRo.getRegistries().get("%s,checksum"%filename, None)
-                if not previousETag or previousETag != currentETag or not previousChecksum or previousChecksum != currentChecksum:
-                    rf = open(ro_uriutils.getFilenameFromUri(localResuri), 'r')
-                    try:
-                        (status, reason, headers, resuri) = self._remoteRo.updateResourceInt(respath, 
-                                                   mimetypes.guess_type(localResuri)[0],
-                                                   rf)
-                        self._localRo.getRegistries()["%s,etag"%filename] = headers.get("etag", None)
-                        self._localRo.getRegistries()["%s,checksum"%filename] = currentChecksum
-                        if not previousETag or previousETag != currentETag:
-                            log.debug("ResourceSync.pushResearchObject: %s has been modified in ROSRS (ETag was %s is %s)"%(respath, previousETag, currentETag))
-                            yield (ACTION_UPDATE_OVERWRITE, respath)
-                        elif not previousChecksum or previousChecksum != currentChecksum:
-                            log.debug("ResourceSync.pushResearchObject: %s has been modified locally (checksum was %s is %s)"%(respath, previousChecksum, currentChecksum))
-                            yield (ACTION_UPDATE, respath)
-                    except ROSRS_Error as e:
-                        yield (ACTION_ERROR, e)
-                else:
-                    log.debug("ResourceSync.pushResearchObject: %s has NOT been modified"%(respath))
-                    yield (ACTION_SKIP, respath)
-        elif self._localRo.isExternalResource(localResuri):
-            log.debug("ResourceSync.pushResearchObject: %s is external"%(localResuri))
-            yield (ACTION_SKIP, localResuri)
-        else:
-            log.error("ResourceSync.pushResearchObject: %s is neither internal nor external"%(localResuri))
+                return headers.get("etag", None)
+            except Exception as e:
+                log.error("Error when processing resource %s: %s"%(respath, e))
+                return e
+        if self._workers <= 1 or len(respaths) <= 1:
+            return map(getETag, respaths)
+        pool = ThreadPool(min(self._workers, len(respaths)))
+        try:
+            return pool.map(getETag, respaths)
+        finally:
+            pool.close()
 
-    def __checkRemoteResource(self, resuri):
+    def __planRemoteResource(self, resuri):
         respath = self._remoteRo.getComponentUriRel(resuri)
         if not self._localRo.isAggregatedResource(respath):
             if self._remoteRo.isAnnotationNode(respath):
@@ -161,41 +244,234 @@ class PushResearchObject:
                 pass
             else:
                 log.debug("ResourceSync.pushResearchObject: %s will be deaggregated"%(resuri))
-                try:
-                    self._remoteRo.deaggregateResource(resuri)
-                    yield (ACTION_DELETE, resuri)
-                except ROSRS_Error as e:
-                    yield (ACTION_ERROR, e)
-                        
-                
-    def __uploadLocalAnnotation(self, ann_node, ann_body, ann_target):
+                yield (ACTION_DELETE, resuri, ())
+
+    def __getAnnotationNodes(self, ro):
+        '''
+        Returns a list of (annotation node, body, targets) for the annotations aggregated
+        by an RO, with one entry for each annotation node, where targets is a list of all
+        the resources annotated by that node.
+        '''
+        nodes = {}
+        order = []
+        for (ann_node, ann_body, ann_target) in list(ro.getAllAnnotationNodes()):
+            if ann_node not in nodes:
+                nodes[ann_node] = (ann_body, [])
+                order.append(ann_node)
+            nodes[ann_node][1].append(ann_target)
+        return [ (n, nodes[n][0], nodes[n][1]) for n in order ]
+
+    def __planLocalAnnotation(self, ann_node, ann_body, ann_targets, checksums, registries):
         annpath = self._localRo.getComponentUriRel(ann_node)
         bodypath = self._localRo.getComponentUriRel(ann_body)
-        targetpath = self._localRo.getComponentUriRel(ann_target)
+        targetpaths = sorted( self._localRo.getComponentUriRel(t) for t in ann_targets )
+        if len(targetpaths) == 1:
+            targetpaths = targetpaths[0]
+        digest = self.__getAnnotationDigest(ann_body, bodypath, targetpaths, checksums)
         if isinstance(ann_node, rdflib.BNode) or not self._remoteRo.isAnnotationNode(annpath):
             log.debug("ResourceSync.pushResearchObject: %s is a new annotation"%(annpath))
-            try:
-                (_, _, remote_ann_node_uri) = self._remoteRo.addAnnotationNode(bodypath, targetpath)
-                remote_ann_node_path = self._remoteRo.getComponentUriRel(remote_ann_node_uri)
-                self._localRo.replaceUri(ann_node, self._localRo.getComponentUriAbs(remote_ann_node_path))
-                yield (ACTION_AGGREGATE_ANNOTATION, remote_ann_node_path)
-            except ROSRS_Error as e:
-                yield (ACTION_ERROR, e)
+            yield (ACTION_AGGREGATE_ANNOTATION, annpath, (ann_node, bodypath, targetpaths, digest))
+        elif registries.get("%s,annotation"%annpath, None) == digest:
+            log.debug("ResourceSync.pushResearchObject: %s has NOT been modified"%(annpath))
+            yield (ACTION_SKIP_ANNOTATION, ann_node, ())
         else:
             log.debug("ResourceSync.pushResearchObject: %s is an existing annotation"%(annpath))
-            self._remoteRo.updateAnnotationNode(annpath, bodypath, targetpath)
-            yield (ACTION_UPDATE_ANNOTATION, ann_node)
-            
-    def __checkRemoteAnnotation(self, ann_node):
+            yield (ACTION_UPDATE_ANNOTATION, ann_node, (annpath, bodypath, targetpaths, digest))
+
+    def __getAnnotationDigest(self, ann_body, bodypath, targetpaths, checksums):
+        '''
+        Returns a digest of an annotation's targets, body and body content, which is
+        recorded when the annotation is pushed, so that unchanged annotations are
+        not pushed again.  The body content is represented by the body file checksum.
+        targetpaths is a single target path, or a sorted list of target paths.
+        '''
+        bodychecksum = ""
+        if self._localRo.isInternalResource(ann_body):
+            filename = self.__getLocalFilename(ann_body)
+            if filename in checksums:
+                bodychecksum = checksums[filename]
+            elif os.path.isfile(filename):
+                try:
+                    bodychecksum = self._localRo.calculateChecksum(filename)
+                except (IOError, OSError) as e:
+                    log.debug("ResourceSync.pushResearchObject: %s"%(e))
+        if isinstance(targetpaths, list):
+            targets = " ".join( str(t) for t in targetpaths )
+        else:
+            targets = str(targetpaths)
+        return hashlib.sha1("\n".join([targets, str(bodypath), bodychecksum])).hexdigest()
+
+    def __planRemoteAnnotation(self, ann_node):
         annpath = self._remoteRo.getComponentUriRel(ann_node)
         if not self._localRo.isAnnotationNode(annpath):
             log.debug("ResourceSync.pushResearchObject: annotation %s will be deleted"%(ann_node))
-            try:
-                self._remoteRo.deleteAnnotationNode(ann_node)
-                yield (ACTION_DELETE_ANNOTATION, ann_node)
-            except ROSRS_Error as e:
-                yield (ACTION_ERROR, e)
-        pass
+            yield (ACTION_DELETE_ANNOTATION, ann_node, ())
+
+    def __executeStep(self, step):
+        '''
+        Performs a plan step, returning a list of (action, uri) results, or a function
+        that performs the step and returns its results; the latter is used for steps
+        that upload resource content, which are called by upload worker threads.
+        '''
+        (action, uri, args) = step
+        if action == ACTION_AGGREGATE_INTERNAL:
+            return lambda: self.__collectResults(uri, self.__createResource(uri, *args))
+        elif action in [ACTION_UPDATE, ACTION_UPDATE_OVERWRITE]:
+            return lambda: self.__collectResults(uri, self.__updateResource(action, uri, *args))
+        elif action == ACTION_AGGREGATE_EXTERNAL:
+            return self.__collectResults(uri, self.__createExternalResource(uri))
+        elif action == ACTION_DELETE:
+            return self.__collectResults(uri, self.__deleteResource(uri))
+        elif action == ACTION_AGGREGATE_ANNOTATION:
+            return self.__collectResults(uri, self.__createAnnotation(*args))
+        elif action == ACTION_UPDATE_ANNOTATION:
+            return self.__collectResults(uri, self.__updateAnnotation(uri, *args))
+        elif action == ACTION_DELETE_ANNOTATION:
+            return self.__collectResults(uri, self.__deleteAnnotation(uri))
+        return [(action, uri)]
+
+    def __collectResults(self, resuri, results):
+        '''
+        Returns a list of the (action, uri) results generated by pushing a resource,
+        ending with an error result if an exception is raised.
+        '''
+        collected = []
+        try:
+            for (action, uri) in results:
+                collected.append((action, uri))
+        except Exception as e:
+            log.error("Error when processing resource %s: %s"%(resuri, e))
+            collected.append((ACTION_ERROR, e))
+        return collected
+
+    def __runUploads(self, uploads):
+        '''
+        Generates the (action, uri) results for a sequence of plan steps, as returned
+        by __executeStep, in the order of the sequence.  Uploads are run by a pool
+        of worker threads, with a bounded number outstanding at any time.
+        '''
+        pool = ThreadPool(self._workers) if self._workers > 1 else None
+        pending = collections.deque()
+        try:
+            for upload in uploads:
+                if callable(upload):
+                    upload = pool.apply_async(upload) if pool else upload()
+                pending.append(upload)
+                while len(pending) > 2*self._workers:
+                    for result in self.__uploadResults(pending.popleft()):
+                        yield result
+            while pending:
+                for result in self.__uploadResults(pending.popleft()):
+                    yield result
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        return
+
+    def __uploadResults(self, upload):
+        if hasattr(upload, "get"):
+            return upload.get()
+        return upload
+
+    def __setRegistries(self, filename, etag, checksum):
+        with self._lock:
+            self._localRo.getRegistries()["%s,etag"%filename] = etag
+            self._localRo.getRegistries()["%s,checksum"%filename] = checksum
+        return
+
+    def __setAnnotationDigest(self, annpath, digest):
+        with self._lock:
+            if digest:
+                self._localRo.getRegistries()["%s,annotation"%annpath] = digest
+            else:
+                self._localRo.getRegistries().pop("%s,annotation"%annpath, None)
+        return
+
+    def __createResource(self, respath, localResuri, filename, ismetadata, checksum):
+        yield (ACTION_AGGREGATE_INTERNAL, respath)
+        (ctype, rf) = self.__openLocalResource(localResuri, respath, ismetadata)
+        (status, reason, headers, resuri) = self._remoteRo.aggregateResourceInt(
+                                  respath, 
+                                  ctype, 
+                                  rf)
+        self.__setRegistries(filename, headers.get("etag", None), checksum)
+
+    def __createExternalResource(self, respath):
+        yield (ACTION_AGGREGATE_EXTERNAL, respath)
+        self._localRo.aggregateResourceExt(respath)
+            
+    def __updateResource(self, action, respath, localResuri, filename, ismetadata, checksum, etag):
+        (ctype, rf) = self.__openLocalResource(localResuri, respath, ismetadata)
+        try:
+            (status, reason, headers, resuri) = self._remoteRo.updateResourceInt(respath, 
+                                       ctype,
+                                       rf, etag=etag)
+            if status == 412:
+                log.debug("ResourceSync.pushResearchObject: %s has been modified in ROSRS (ETag was %s)"%(respath, etag))
+                action = ACTION_UPDATE_OVERWRITE
+                (ctype, rf) = self.__openLocalResource(localResuri, respath, ismetadata)
+                (status, reason, headers, resuri) = self._remoteRo.updateResourceInt(respath, 
+                                           ctype,
+                                           rf)
+            self.__setRegistries(filename, headers.get("etag", None), checksum)
+            yield (action, respath)
+        except ROSRS_Error as e:
+            yield (ACTION_ERROR, e)
+
+    def __getLocalFilename(self, localResuri):
+        '''
+        Returns name of the file that stores a local resource: RO metadata may be
+        stored compressed.
+        '''
+        filename = ro_uriutils.getFilenameFromUri(localResuri)
+        if self._localRo.isRoMetadataRef(localResuri):
+            filename = ro_manifest.getMetadataStoredFilename(filename)
+        return filename
+
+    def __openLocalResource(self, localResuri, respath, ismetadata):
+        '''
+        Returns content type and content for uploading a local resource.
+        RO metadata stored using other RDF syntaxes is uploaded as RDF/XML, and
+        compressed RO metadata is uploaded uncompressed.
+        '''
+        filename = ro_uriutils.getFilenameFromUri(localResuri)
+        if (ismetadata and
+                (ro_manifest.guessMetadataFormat(filename) != "RDFXML" or
+                 ro_manifest.getMetadataStoredCompression(filename) != "none")):
+            data = ro_manifest.readMetadataAsRdfXml(filename, self._localRo.getRoUri())
+            return (ro_settings.MANIFEST_FORMAT, data)
+        return (mimetypes.guess_type(respath)[0], open(filename, 'r'))
+
+    def __deleteResource(self, resuri):
+        try:
+            self._remoteRo.deaggregateResource(resuri)
+            yield (ACTION_DELETE, resuri)
+        except ROSRS_Error as e:
+            yield (ACTION_ERROR, e)
+
+    def __createAnnotation(self, ann_node, bodypath, targetpaths, digest):
+        try:
+            (_, _, remote_ann_node_uri) = self._remoteRo.addAnnotationNode(bodypath, targetpaths)
+            remote_ann_node_path = self._remoteRo.getComponentUriRel(remote_ann_node_uri)
+            self._localRo.replaceUri(ann_node, self._localRo.getComponentUriAbs(remote_ann_node_path))
+            self.__setAnnotationDigest(remote_ann_node_path, digest)
+            yield (ACTION_AGGREGATE_ANNOTATION, remote_ann_node_path)
+        except ROSRS_Error as e:
+            yield (ACTION_ERROR, e)
+
+    def __updateAnnotation(self, ann_node, annpath, bodypath, targetpaths, digest):
+        self._remoteRo.updateAnnotationNode(annpath, bodypath, targetpaths)
+        self.__setAnnotationDigest(annpath, digest)
+        yield (ACTION_UPDATE_ANNOTATION, ann_node)
+            
+    def __deleteAnnotation(self, ann_node):
+        try:
+            self._remoteRo.deleteAnnotationNode(ann_node)
+            self.__setAnnotationDigest(self._remoteRo.getComponentUriRel(ann_node), None)
+            yield (ACTION_DELETE_ANNOTATION, ann_node)
+        except ROSRS_Error as e:
+            yield (ACTION_ERROR, e)
 
 def pushZipRO(localRo, remoteRo, force = False):
     return
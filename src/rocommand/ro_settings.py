@@ -16,7 +16,25 @@ VERSION         = RO_VERSION+" (RODL)"
 MANIFEST_DIR    = ".ro"
 MANIFEST_FILE   = "manifest.rdf"
 MANIFEST_FORMAT = "application/rdf+xml"
+METADATA_FORMAT = "RDFXML"              # Default RDF syntax for RO metadata files
+METADATA_COMPRESSION = "none"           # Default compression for RO metadata files: none, gzip or zstd
+PROGRESS_INTERVAL = 10000               # Number of items between progress reports
+CHECKSUM_ALGORITHM = "md5"              # Default algorithm for resource checksums
+CHECKSUM_WORKERS  = 4                   # Default number of threads calculating checksums
+FETCH_WORKERS     = 8                   # Default number of concurrent remote annotation body reads
+EXTRACT_WORKERS   = 4                   # Default number of threads extracting checked out RO files
+PUSH_WORKERS      = 4                   # Default number of resources uploaded concurrently by push
+PUSH_RATE_LIMIT   = 0                   # Default limit on push requests per second to a host (0 for none)
+PUSH_TRUST_ETAGS  = False               # Default for assuming ETags recorded by push are current
+HTTP_CACHE_DIR    = ".ro_cache"         # Directory in config base for cached HTTP responses ("" for none)
+URI_CACHE_SIZE    = 20000               # Maximum number of URI conversions memoized per RO
+MANIFEST_CACHE_SIZE   = 20              # Maximum number of RO manifest graphs kept by a process
+ANNOTATION_CACHE_SIZE = 1000            # Maximum number of annotation body graphs kept by a process
 MANIFEST_REF    = MANIFEST_DIR + "/" + MANIFEST_FILE
 REGISTRIES_FILE = ".registries.json"
+MANIFEST_JOURNAL        = "manifest.journal"
+MANIFEST_JOURNAL_LIMIT  = 1024*1024     # Journal size (bytes) at which it is folded into manifest
+ANNOTATION_COUNTER      = "annotation.counter"  # Last annotation body name index allocated
+DIRECTORY_STATE         = "directory.state"     # Files and directories last found in RO
 
 # End.
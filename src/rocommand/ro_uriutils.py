@@ -15,8 +15,11 @@ import os.path
 import re
 import urllib
 import urlparse
-import httplib
 import logging
+import threading
+from collections import OrderedDict
+
+from MiscUtils.HttpSession import getConnectionPool
 
 import ROSRS_Session
 
@@ -27,15 +30,95 @@ fileuribase = "file://"
 def isFileUri(uri):
     return uri.startswith(fileuribase)
 
-def resolveUri(uriref, base, path=""):
+def isZipFileUri(uri):
+    """
+    Test if URI refers to a local zip file (e.g. a packaged research object)
+    """
+    uri = uri.rstrip("/")
+    return ( isFileUri(uri) and uri.lower().endswith(".zip") and
+             os.path.isfile(getFilenameFromUri(uri)) )
+
+def resolveUri(uriref, base, path="", isdir=None):
     """
     Resolve a URI reference against a supplied base URI and path (supplied as strings).
     (The path is a local file system path, and may need converting to use URI conventions)
+
+    isdir   if not None, indicates whether the path refers to a directory, in which
+            case the file system is not consulted.  A path ending with "/" is always
+            treated as a directory.
     """
     upath = urllib.pathname2url(path)
-    if os.path.isdir(path) and not upath.endswith('/'):
-        upath = upath + '/'
-    return urlparse.urljoin(urlparse.urljoin(base, upath), uriref)
+    if not upath.endswith('/'):
+        if isdir is None:
+            isdir = os.path.isdir(path)
+        if isdir:
+            upath = upath + '/'
+    uri = urlparse.urljoin(base, upath)
+    if uriref:
+        uri = urlparse.urljoin(uri, uriref)
+    return uri
+
+class UriCache(object):
+    """
+    Least-recently-used cache of computed URI values, used to avoid repeated URI
+    parsing and file system access when the same references are resolved many times.
+
+    A cache may be shared by several threads: access to the cached values is
+    serialized, but values are computed without holding the lock, so a value
+    may occasionally be computed more than once.
+    """
+
+    def __init__(self, size=1000):
+        self.size  = size
+        self.cache = OrderedDict()
+        self.lock  = threading.Lock()
+        return
+
+    def get(self, key, compute):
+        """
+        Return cached value for key, or call compute() to obtain and cache a new value.
+        """
+        with self.lock:
+            try:
+                val = self.cache.pop(key)
+                self.cache[key] = val
+                return val
+            except KeyError:
+                pass
+        val = compute()
+        self.put(key, val)
+        return val
+
+    def lookup(self, key):
+        """
+        Return cached value for key, or None if there is no cached value.
+        """
+        with self.lock:
+            val = self.cache.pop(key, None)
+            if val is not None:
+                self.cache[key] = val
+            return val
+
+    def put(self, key, val):
+        """
+        Save value for key, discarding the least recently used value if necessary.
+        """
+        with self.lock:
+            self.cache.pop(key, None)
+            if len(self.cache) >= self.size:
+                self.cache.popitem(last=False)
+            self.cache[key] = val
+        return
+
+    def discard(self, key):
+        with self.lock:
+            self.cache.pop(key, None)
+        return
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+        return
 
 def resolveFileAsUri(path):
     """
@@ -76,13 +159,11 @@ def isLiveUri(uriref):
         host      = parseduri.netloc
         path      = parseduri.path
         if parseduri.query: path += "?"+parseduri.query
-        httpcon   = httplib.HTTPConnection(host, timeout=5)
         # Extra request headers
         # ... none for now
-        # Execute request
+        # Execute request, using a pooled connection
         try:
-            httpcon.request("HEAD", path)
-            response = httpcon.getresponse()
+            (response, _) = getConnectionPool().request(scheme, host, "HEAD", path, timeout=5)
             status   = response.status
         except:
             status   = 900
@@ -37,6 +37,7 @@ import TestEvalQueryMatch
 import TestRdfReport
 import TestGridMatch
 import TestMkMinim
+import TestHttpSession
 
 # Code to run unit tests from all library test modules
 def getTestSuite(select="unit"):
@@ -55,6 +56,7 @@ def getTestSuite(select="unit"):
     suite.addTest(TestRdfReport.getTestSuite(select=select))
     suite.addTest(TestGridMatch.getTestSuite(select=select))
     suite.addTest(TestMkMinim.getTestSuite(select=select))
+    suite.addTest(TestHttpSession.getTestSuite(select=select))
     if select != "unit":
         suite.addTest(TestROSRS_Session.getTestSuite(select=select))
         suite.addTest(TestRemoteROMetadata.getTestSuite(select=select))
@@ -485,6 +485,106 @@ class TestAnnotations(TestROSupport.TestROSupport):
 
     # Sentinel/placeholder tests
 
+    def testAnnotateWildcardOneBody(self):
+        """
+        Test wildcard annotation saved in a single annotation body
+        """
+        rodir  = self.createTestRo(testbase, "data/ro-test-1", "RO test annotation", "ro-testRoAnnotate")
+        self.populateTestRo(testbase, rodir)
+        args = ["ro", "annotate"
+               ,"-d", rodir+"/"
+               , "-w", "subdir./.*\\.txt$"
+               , "dcterms:description", "pattern annotation"
+               , "--one-body" ]
+        with SwitchStdout(self.outstr):
+            status = ro.runCommand(ro_test_config.CONFIGDIR, ro_test_config.ROBASEDIR, args)
+        outtxt = self.outstr.getvalue()
+        assert status == 0, outtxt
+        annotations = list(ro_annotation.getAllAnnotations(rodir))
+        resource1uri = ro_manifest.getComponentUriAbs(rodir, "subdir1/subdir1-file.txt")
+        resource2uri = ro_manifest.getComponentUriAbs(rodir, "subdir2/subdir2-file.txt")
+        self.assertIn((resource1uri, DCTERMS.description, rdflib.Literal('pattern annotation')), annotations)
+        self.assertIn((resource2uri, DCTERMS.description, rdflib.Literal('pattern annotation')), annotations)
+        ro_graph = ro_manifest.readManifestGraph(rodir)
+        body1 = ro_graph.value(ro_graph.value(predicate=RO.annotatesAggregatedResource, object=resource1uri), AO.body)
+        body2 = ro_graph.value(ro_graph.value(predicate=RO.annotatesAggregatedResource, object=resource2uri), AO.body)
+        self.assertEqual(body1, body2)
+        self.deleteTestRo(rodir)
+        return
+
+    def testAnnotateFromFile(self):
+        """
+        Test annotations read from CSV and JSON-lines files
+        """
+        rodir  = self.createTestRo(testbase, "data/ro-test-1", "RO test annotation", "ro-testRoAnnotate")
+        rouri  = ro_manifest.getRoUri(rodir)
+        resource1uri = ro_manifest.getComponentUriAbs(rodir, "subdir1/subdir1-file.txt")
+        resource2uri = ro_manifest.getComponentUriAbs(rodir, "subdir2/subdir2-file.txt")
+        csvfile = os.path.join(rodir, "annotations.csv")
+        with open(csvfile, "w") as f:
+            f.write("subdir1/subdir1-file.txt,type,Subdir file\n")
+            f.write("subdir1/subdir1-file.txt,description,\"Subdir file, with comma\"\n")
+            f.write("subdir2/subdir2-file.txt,rdfs:comment,Another file\n")
+        args = ["ro", "annotate", "-v", "-d", rodir, "--from-file", csvfile]
+        with SwitchStdout(self.outstr):
+            status = ro.runCommand(ro_test_config.CONFIGDIR, ro_test_config.ROBASEDIR, args)
+        outtxt = self.outstr.getvalue()
+        assert status == 0, outtxt
+        self.assertIn("3 annotations added in 2 annotation bodies", outtxt)
+        annotations = list(ro_annotation.getAllAnnotations(rodir))
+        self.assertIn((resource1uri, DCTERMS.type,        rdflib.Literal("Subdir file")), annotations)
+        self.assertIn((resource1uri, DCTERMS.description, rdflib.Literal("Subdir file, with comma")), annotations)
+        self.assertIn((resource2uri, RDFS.comment,        rdflib.Literal("Another file")), annotations)
+        # JSON lines, saved in a single annotation body
+        jsonfile = os.path.join(rodir, "annotations.jsonl")
+        with open(jsonfile, "w") as f:
+            f.write('["subdir1/subdir1-file.txt", "rdfs:seeAlso", "http://example.org/doc"]\n')
+            f.write('{"resource": "subdir2/subdir2-file.txt", "attribute": "rdfs:seeAlso", "value": "http://example.org/doc"}\n')
+        args = ["ro", "link", "-v", "-d", rodir, "--from-file", jsonfile, "--one-body"]
+        with SwitchStdout(self.outstr):
+            status = ro.runCommand(ro_test_config.CONFIGDIR, ro_test_config.ROBASEDIR, args)
+        outtxt = self.outstr.getvalue()
+        assert status == 0, outtxt
+        self.assertIn("2 annotations added in 1 annotation bodies", outtxt)
+        docuri = rdflib.URIRef("http://example.org/doc")
+        annotations = list(ro_annotation.getAllAnnotations(rodir))
+        self.assertIn((resource1uri, RDFS.seeAlso, docuri), annotations)
+        self.assertIn((resource2uri, RDFS.seeAlso, docuri), annotations)
+        # One annotation for each resource, sharing the annotation body
+        ro_graph = ro_manifest.readManifestGraph(rodir)
+        bodies   = set()
+        for resuri in (resource1uri, resource2uri):
+            for ann in ro_graph.subjects(RO.annotatesAggregatedResource, resuri):
+                self.assertEqual(len(list(ro_graph.objects(ann, RO.annotatesAggregatedResource))), 1)
+                bodies.update(ro_graph.objects(ann, AO.body))
+        self.assertEqual(len(bodies), 3)    # One for each resource from CSV, one shared
+        # Malformed row: nothing is added
+        with open(csvfile, "w") as f:
+            f.write("README-ro-test-1,type,Readme\n")
+            f.write("README-ro-test-1,type\n")
+        args = ["ro", "annotate", "-d", rodir, "--from-file", csvfile]
+        with SwitchStdout(self.outstr):
+            status = ro.runCommand(ro_test_config.CONFIGDIR, ro_test_config.ROBASEDIR, args)
+        self.assertEqual(status, 1)
+        self.assertIn("line 2", self.outstr.getvalue())
+        readmeuri = ro_manifest.getComponentUriAbs(rodir, "README-ro-test-1")
+        self.assertNotIn((readmeuri, DCTERMS.type, rdflib.Literal("Readme")),
+            list(ro_annotation.getAllAnnotations(rodir)))
+        # JSON row with a value that is not a string is reported
+        with open(jsonfile, "w") as f:
+            f.write('["README-ro-test-1", "type", "Readme"]\n')
+            f.write('[1, "description", "x"]\n')
+        args = ["ro", "annotate", "-d", rodir, "--from-file", jsonfile]
+        self.outstr = StringIO.StringIO()
+        with SwitchStdout(self.outstr):
+            status = ro.runCommand(ro_test_config.CONFIGDIR, ro_test_config.ROBASEDIR, args)
+        self.assertEqual(status, 1)
+        self.assertIn("line 2: expected resource, attribute and value", self.outstr.getvalue())
+        self.assertNotIn((readmeuri, DCTERMS.type, rdflib.Literal("Readme")),
+            list(ro_annotation.getAllAnnotations(rodir)))
+        self.deleteTestRo(rodir)
+        return
+
     def testUnits(self):
         assert (True)
 
@@ -530,6 +630,8 @@ def getTestSuite(select="unit"):
             , "testAnnotateWithNotExistentGraph"
             , "testAnnotateWildcardPattern1"
             , "testAnnotateWildcardPattern2"
+            , "testAnnotateWildcardOneBody"
+            , "testAnnotateFromFile"
             ],
         "component":
             [ "testComponents"
@@ -18,6 +18,7 @@ import unittest
 import logging
 import datetime
 import StringIO
+import zipfile
 from urlparse import urljoin
 
 try:
@@ -311,6 +312,26 @@ class TestBasicCommands(TestROSupport.TestROSupport):
         self.deleteTestRo(rodir)
         return
 
+    def testListZipError(self):
+        """
+        Error accessing RO in zip file is reported
+
+        ro ls rozip
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test list", "ro-testRoList")
+        zipname = rodir.rstrip("/")+".zip"
+        with zipfile.ZipFile(zipname, "w") as z:
+            z.write(os.path.join(rodir, "README-ro-test-1"), "README-ro-test-1")
+        args = [ "ro", "ls", zipname ]
+        with SwitchStdout(self.outstr):
+            status = ro.runCommand(ro_test_config.CONFIGDIR, ro_test_config.ROBASEDIR, args)
+        outtxt = self.outstr.getvalue()
+        self.assertEqual(status, 2, outtxt)
+        self.assertRegexpMatches(outtxt, "No RO manifest in zip file")
+        os.remove(zipname)
+        self.deleteTestRo(rodir)
+        return
+
     def testListDefault(self):
         """
         Display contents of created RO containing current directory
@@ -539,6 +560,7 @@ def getTestSuite(select="unit"):
             , "testStatusDefault"
             , "testList"
             , "testListDefault"
+            , "testListZipError"
             , "testAddDirectory"
             , "testAddExternalResource"
             , "testRemove"
@@ -18,6 +18,7 @@ import unittest
 import logging
 import datetime
 import StringIO
+import zipfile
 try:
     # Running Python 2.5 with simplejson?
     import simplejson as json
@@ -34,6 +35,7 @@ if __name__ == "__main__":
 import rdflib
 
 from MiscUtils import TestUtils
+from MiscUtils import ZipStream
 
 from rocommand import ro
 from rocommand import ro_utils
@@ -142,8 +144,214 @@ class TestManifest(TestROSupport.TestROSupport):
         self.deleteTestRo(rodir)
         return
 
+    def testManifestGraphCache(self):
+        """
+        Test manifest graph shared by helper functions until the manifest changes
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test manifest cache", "ro-testRoManifestCache")
+        ro_graph = ro_manifest.getManifestGraph(rodir)
+        self.assertIs(ro_manifest.getManifestGraph(rodir), ro_graph)
+        # Graph written back by helper remains cached
+        ro_manifest.addAggregatedResources(rodir, rodir, recurse=True)
+        self.assertIs(ro_manifest.getManifestGraph(rodir), ro_graph)
+        s = ro_manifest.getComponentUri(rodir, "")
+        readme = ro_manifest.getComponentUri(rodir, "README-ro-test-1")
+        self.assertIn(readme, list(ro_manifest.getAggregatedResources(rodir)))
+        # Manifest written from another graph is read again
+        new_graph = ro_manifest.readManifestGraph(rodir)
+        new_graph.remove((s, ORE.aggregates, readme))
+        ro_manifest.writeManifestGraph(rodir, new_graph)
+        self.assertIsNot(ro_manifest.getManifestGraph(rodir), ro_graph)
+        self.assertNotIn(readme, list(ro_manifest.getAggregatedResources(rodir)))
+        # Journal changes are noticed
+        ro_manifest.startManifestJournal(rodir)
+        ro_graph = ro_manifest.getManifestGraph(rodir)
+        ro_manifest.appendManifestJournal(rodir, [("+", (s, ORE.aggregates, readme))])
+        self.assertIsNot(ro_manifest.getManifestGraph(rodir), ro_graph)
+        self.assertIn(readme, list(ro_manifest.getAggregatedResources(rodir)))
+        # Graph is not used again if writing it fails
+        ro_graph = ro_manifest.getManifestGraph(rodir)
+        ro_graph.remove((s, ORE.aggregates, readme))
+        serialize = ro_manifest._serializeManifestGraph
+        def failSerialize(*args):
+            raise IOError("Write failed")
+        ro_manifest._serializeManifestGraph = failSerialize
+        try:
+            self.assertRaises(IOError, ro_manifest.writeManifestGraph, rodir, ro_graph)
+        finally:
+            ro_manifest._serializeManifestGraph = serialize
+        self.assertIsNot(ro_manifest.getManifestGraph(rodir), ro_graph)
+        self.assertIn(readme, list(ro_manifest.getAggregatedResources(rodir)))
+        # Least recently used graphs are discarded
+        rodir2 = self.createTestRo(testbase, "data/ro-test-1", "RO test manifest cache 2", "ro-testRoManifestCache2")
+        manifestcache = ro_manifest._manifestcache
+        ro_manifest._manifestcache = ro_manifest.UriCache(1)
+        try:
+            ro_graph = ro_manifest.getManifestGraph(rodir)
+            self.assertIs(ro_manifest.getManifestGraph(rodir), ro_graph)
+            ro_manifest.getManifestGraph(rodir2)
+            self.assertIsNot(ro_manifest.getManifestGraph(rodir), ro_graph)
+        finally:
+            ro_manifest._manifestcache = manifestcache
+        self.deleteTestRo(rodir2)
+        self.deleteTestRo(rodir)
+        return
+
+    def testReadManifestHeader(self):
+        """
+        Test RO-level properties read from manifest without building a graph
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test header", "ro-testRoHeader")
+        ro_manifest.addAggregatedResources(rodir, rodir, recurse=True)
+        ro_graph = ro_manifest.readManifestGraph(rodir)
+        manifestfile = ro_manifest.makeManifestFilename(rodir)
+        for format in ["RDFXML", "NT", "TURTLE"]:
+            ro_manifest.writeManifestGraph(rodir, ro_graph, format=format)
+            header = ro_manifest.readManifestHeader(rodir)
+            self.assertEqual(header, ro_manifest.readManifest(rodir))
+            self.assertEqual(str(header["roident"]), "ro-testRoHeader")
+            self.assertEqual(str(header["rotitle"]), "RO test header")
+            self.assertEqual(header['rouri'], str(ro_manifest.getRoUri(rodir)))
+        # Typed node element, property attributes and xml:base
+        with open(manifestfile, "w") as f:
+            f.write(
+                """<?xml version="1.0"?>\n"""+
+                """<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"\n"""+
+                """         xmlns:ro="http://purl.org/wf4ever/ro#"\n"""+
+                """         xmlns:ore="http://www.openarchives.org/ore/terms/"\n"""+
+                """         xmlns:dcterms="http://purl.org/dc/terms/">\n"""+
+                """  <rdf:Description rdf:about="http://example.org/other/">\n"""+
+                """    <dcterms:title>Not this one</dcterms:title>\n"""+
+                """  </rdf:Description>\n"""+
+                """  <ro:ResearchObject xml:base=".." rdf:about="" dcterms:identifier="ro-attr">\n"""+
+                """    <ore:aggregates><rdf:Description rdf:about="file1"><dcterms:title>File</dcterms:title></rdf:Description></ore:aggregates>\n"""+
+                """    <dcterms:title xml:lang="en">Typed node</dcterms:title>\n"""+
+                """    <dcterms:creator rdf:resource="http://example.org/people/me"/>\n"""+
+                """  </ro:ResearchObject>\n"""+
+                """</rdf:RDF>\n"""
+                )
+        header = ro_manifest.readManifestHeader(rodir)
+        self.assertEqual(header, ro_manifest.readManifest(rodir))
+        self.assertEqual(str(header["roident"]), "ro-attr")
+        self.assertEqual(header['rotitle'], rdflib.Literal("Typed node", lang="en"))
+        self.assertEqual(header['rocreator'], rdflib.URIRef("http://example.org/people/me"))
+        self.assertEqual(header['rodescription'], None)
+        # Properties of the RO given in a later element
+        with open(manifestfile, "w") as f:
+            f.write(
+                """<?xml version="1.0"?>\n"""+
+                """<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"\n"""+
+                """         xmlns:ro="http://purl.org/wf4ever/ro#"\n"""+
+                """         xmlns:dcterms="http://purl.org/dc/terms/"\n"""+
+                """         xml:base="../">\n"""+
+                """  <ro:ResearchObject rdf:about="">\n"""+
+                """    <dcterms:title>Split title</dcterms:title>\n"""+
+                """  </ro:ResearchObject>\n"""+
+                """  <rdf:Description rdf:about="">\n"""+
+                """    <dcterms:description>Split description</dcterms:description>\n"""+
+                """  </rdf:Description>\n"""+
+                """</rdf:RDF>\n"""
+                )
+        header = ro_manifest.readManifestHeader(rodir)
+        self.assertEqual(header, ro_manifest.readManifest(rodir))
+        self.assertEqual(str(header["rotitle"]), "Split title")
+        self.assertEqual(str(header["rodescription"]), "Split description")
+        self.deleteTestRo(rodir)
+        return
+
+    def testIterROZipMembers(self):
+        """
+        Test zip archive of RO created from its directory
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test zip", "ro-testRoZip")
+        ro_manifest.addAggregatedResources(rodir, rodir, recurse=True)
+        rouri    = ro_manifest.getRoUri(rodir)
+        ro_graph = ro_manifest.readManifestGraph(rodir)
+        ro_manifest.writeManifestGraph(rodir, ro_graph, compression="gzip")
+        ro_manifest.startManifestJournal(rodir)
+        stmt = (rouri, DCTERMS.description, rdflib.Literal("Journalled description"))
+        ro_manifest.appendManifestJournal(rodir, [("+", stmt)], rouri=rouri)
+        zipdata = "".join(ZipStream.iterZipData(ro_manifest.iterROZipMembers(rodir)))
+        zf = zipfile.ZipFile(StringIO.StringIO(zipdata))
+        self.assertEqual(zf.testzip(), None)
+        names = zf.namelist()
+        self.assertIn(".ro/manifest.rdf", names)
+        self.assertIn("subdir1/subdir1-file.txt", names)
+        self.assertIn("filename with spaces.txt", names)
+        self.assertNotIn(".ro/manifest.journal", names)
+        self.assertEqual(zf.read("subdir1/subdir1-file.txt"),
+            open(os.path.join(rodir, "subdir1/subdir1-file.txt"), "rb").read())
+        # Manifest is uncompressed RDF/XML, including journalled changes, with
+        # URIs relative to the RO
+        manifestdata = zf.read(".ro/manifest.rdf")
+        self.assertTrue(manifestdata.startswith("<?xml"))
+        zipuri = rdflib.URIRef("http://example.org/zip/ro/")
+        zipgraph = rdflib.Graph()
+        zipgraph.parse(data=manifestdata, publicID=zipuri+".ro/manifest.rdf", format="xml")
+        self.assertIn((zipuri, DCTERMS.description, rdflib.Literal("Journalled description")), zipgraph)
+        self.assertIn((zipuri, ORE.aggregates, zipuri+"subdir1/subdir1-file.txt"), zipgraph)
+        self.deleteTestRo(rodir)
+        return
+
     # URI tests
 
+    def testManifestFormats(self):
+        """
+        Test manifest written and read back using each supported RDF syntax
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test formats", "ro-testRoFormats")
+        ro_manifest.addAggregatedResources(rodir, rodir, recurse=True)
+        ro_graph = ro_manifest.readManifestGraph(rodir)
+        manifestfile = ro_manifest.makeManifestFilename(rodir)
+        for format in ["TURTLE", "NT", "RDFXML"]:
+            ro_manifest.writeManifestGraph(rodir, ro_graph, format=format)
+            self.assertEqual(ro_manifest.guessMetadataFormat(manifestfile), format)
+            ro_graph = ro_manifest.readManifestGraph(rodir)
+            self.checkManifestGraph(rodir, ro_graph)
+            s = ro_manifest.getComponentUri(rodir, "")
+            self.assertIn((s, ORE.aggregates, ro_manifest.getComponentUri(rodir, "README-ro-test-1")), ro_graph)
+            # Updates preserve the manifest syntax
+            ro_manifest.writeManifestGraph(rodir, ro_graph)
+            self.assertEqual(ro_manifest.guessMetadataFormat(manifestfile), format)
+        # Compressed manifest is read and decompressed once when parsed
+        ro_manifest.writeManifestGraph(rodir, ro_graph, compression="gzip")
+        decompressed = []
+        decompressMetadataData = ro_manifest.decompressMetadataData
+        def countDecompress(data, compression, name=""):
+            decompressed.append(name)
+            return decompressMetadataData(data, compression, name)
+        ro_manifest.decompressMetadataData = countDecompress
+        try:
+            ro_graph = ro_manifest.readManifestGraph(rodir)
+        finally:
+            ro_manifest.decompressMetadataData = decompressMetadataData
+        self.assertEqual(decompressed, [manifestfile+".gz"])
+        self.checkManifestGraph(rodir, ro_graph)
+        self.deleteTestRo(rodir)
+        return
+
+    def testGuessMetadataFormat(self):
+        """
+        Test RDF syntax of metadata files determined from content and file name
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test formats", "ro-testRoFormats")
+        def testFormat(filename, data, format):
+            filepath = os.path.join(rodir, filename)
+            with open(filepath, "w") as f:
+                f.write(data)
+            self.assertEqual(ro_manifest.guessMetadataFormat(filepath), format)
+            return
+        testFormat("test.rdf", '<?xml version="1.0"?>\n<rdf:RDF />', "RDFXML")
+        testFormat("test.rdf", '<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" />', "RDFXML")
+        testFormat("test.rdf", '<http://ex.org/s> <http://ex.org/p> "o"@en .\n', "NT")
+        testFormat("test.nt",  '# comment\n_:b1 <http://ex.org/p> <http://ex.org/o> .\n', "NT")
+        testFormat("test.ttl", '<http://ex.org/s> <http://ex.org/p> <http://ex.org/o> .\n', "TURTLE")
+        testFormat("test.rdf", '@prefix ex: <http://ex.org/> .\nex:s ex:p ex:o .\n', "TURTLE")
+        testFormat("test.rdf", '<s> <p> <o> ;\n    <q> <r> .\n', "TURTLE")
+        self.assertEqual(ro_manifest.guessMetadataFormat(os.path.join(rodir, "nofile")), "RDFXML")
+        self.deleteTestRo(rodir)
+        return
+
     def testGetRoUri(self):
         def testUri(rodir, uristring):
             self.assertEquals(ro_manifest.getRoUri(rodir), rdflib.URIRef(uristring))
@@ -286,6 +494,11 @@ def getTestSuite(select="unit"):
             , "testManifestContent"
             , "testAddAggregatedResources"
             , "testAddAggregatedResourcesCommand"
+            , "testManifestGraphCache"
+            , "testReadManifestHeader"
+            , "testIterROZipMembers"
+            , "testManifestFormats"
+            , "testGuessMetadataFormat"
             , "testGetRoUri"
             , "testGetComponentUri"
             , "testGetComponentUriRel"
@@ -15,7 +15,11 @@ import shutil
 import unittest
 import logging
 import datetime
+import time
 import StringIO
+import hashlib
+import zipfile
+import threading
 try:
     # Running Python 2.5 with simplejson?
     import simplejson as json
@@ -32,10 +36,14 @@ if __name__ == "__main__":
 import rdflib
 
 from MiscUtils import TestUtils
+from MiscUtils import ScanDirectories
 
 from rocommand import ro_settings
 from rocommand import ro_metadata
+from rocommand import ro_manifest
 from rocommand import ro_annotation
+from rocommand import ro_uriutils
+from rocommand import ro_dirstate
 from rocommand.ro_namespaces import RDF, RO, AO, ORE, DCTERMS, ROTERMS
 from rocommand.ro_prefixes   import make_sparql_prefixes
 
@@ -506,6 +514,86 @@ class TestROMetadata(TestROSupport.TestROSupport):
         self.deleteTestRo(rodir)
         return
 
+    def testAddAggregatedResourcesBulk(self):
+        """
+        Test bulk addition of directory contents, skipping hidden files and resources
+        already aggregated, with progress reports
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test aggregation", "ro-testRoAggregation")
+        os.mkdir(os.path.join(rodir, "subdir1", ".hidden"))
+        open(os.path.join(rodir, "subdir1", ".hidden", "hidden-file.txt"), "w").close()
+        open(os.path.join(rodir, "subdir2", ".hidden-file.txt"), "w").close()
+        romd  = ro_metadata.ro_metadata(ro_config, rodir)
+        romd.addAggregatedResources(os.path.join(rodir, "README-ro-test-1"))
+        progress = []
+        added = romd.addAggregatedResources(rodir, recurse=True, progress=progress.append)
+        self.assertEqual(added, 5)
+        self.assertEqual(progress, [6])
+        def URIRef(path):
+            return romd.getComponentUri(path)
+        s = romd.getRoUri()
+        g = rdflib.Graph()
+        g.add( (s, ORE.aggregates,      URIRef("README-ro-test-1")             ) )
+        g.add( (s, ORE.aggregates,      URIRef("subdir1/subdir1-file.txt")     ) )
+        g.add( (s, ORE.aggregates,      URIRef("subdir2/subdir2-file.txt")     ) )
+        g.add( (s, ORE.aggregates,      romd.getComponentUriAbs("filename%20with%20spaces.txt") ) )
+        self.checkManifestGraph(rodir, g)
+        n = rdflib.Graph()
+        n.add( (s, ORE.aggregates,      URIRef("subdir1/.hidden/hidden-file.txt") ) )
+        n.add( (s, ORE.aggregates,      URIRef("subdir2/.hidden-file.txt")        ) )
+        self.checkManifestGraphOmits(rodir, n)
+        # Adding again finds nothing new
+        self.assertEqual(romd.addAggregatedResources(rodir, recurse=True), 0)
+        self.deleteTestRo(rodir)
+        return
+
+    def testAddAggregatedResourcesIncremental(self):
+        """
+        Test repeated addition of directory contents, listing only directories
+        modified since the previous scan, and removal of resources no longer present
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test aggregation", "ro-testRoAggregation")
+        romd  = ro_metadata.ro_metadata(ro_config, rodir)
+        self.assertEqual(romd.addAggregatedResources(rodir, recurse=True), 6)
+        self.assertTrue(os.path.exists(ro_dirstate.makeDirStateFilename(rodir)))
+        # Listings of recently modified directories are not trusted, so backdate them
+        past = time.time()-3600
+        for d in ["", "subdir1", "subdir2"]:
+            os.utime(os.path.join(rodir, d), (past, past))
+        self.assertEqual(romd.addAggregatedResources(rodir, recurse=True), 0)
+        listed = []
+        listDirectory = ScanDirectories._ListDirectory
+        def countListDirectory(srcdir):
+            listed.append(srcdir)
+            return listDirectory(srcdir)
+        ScanDirectories._ListDirectory = countListDirectory
+        try:
+            self.assertEqual(romd.addAggregatedResources(rodir, recurse=True), 0)
+            self.assertEqual(listed, [])
+            open(os.path.join(rodir, "subdir1", "subdir1-new.txt"), "w").close()
+            self.assertEqual(romd.addAggregatedResources(rodir, recurse=True), 1)
+            self.assertEqual(listed, [os.path.join(os.path.abspath(rodir), "subdir1", "")])
+        finally:
+            ScanDirectories._ListDirectory = listDirectory
+        s = romd.getRoUri()
+        newres = (s, ORE.aggregates, romd.getComponentUri("subdir1/subdir1-new.txt"))
+        oldres = (s, ORE.aggregates, romd.getComponentUri("subdir2/subdir2-file.txt"))
+        self.assertIn(newres, romd.getManifestGraph())
+        # Resources no longer present are removed from the aggregation
+        os.remove(os.path.join(rodir, "subdir2", "subdir2-file.txt"))
+        self.assertEqual(romd.pruneAggregatedResources(rodir), 1)
+        self.assertNotIn(oldres, romd.getManifestGraph())
+        self.assertIn(newres, romd.getManifestGraph())
+        self.assertNotIn(oldres, ro_metadata.ro_metadata(ro_config, rodir).getManifestGraph())
+        self.assertEqual(romd.pruneAggregatedResources(rodir), 0)
+        # Symbolic link to a missing file is listed
+        os.symlink(os.path.join(rodir, "nofile.txt"), os.path.join(rodir, "subdir1", "dangling.txt"))
+        self.assertEqual(romd.addAggregatedResources(rodir, recurse=True), 1)
+        self.assertIn((s, ORE.aggregates, romd.getComponentUri("subdir1/dangling.txt")),
+            romd.getManifestGraph())
+        self.deleteTestRo(rodir)
+        return
+
     def testGetAggregatedResources(self):
         """
         Test function that enumerates aggregated resources to a research object manifest
@@ -532,6 +620,452 @@ class TestROMetadata(TestROSupport.TestROSupport):
         self.deleteTestRo(rodir)
         return
 
+    def testManifestJournal(self):
+        """
+        Test manifest updates recorded in manifest journal, and compaction of journal
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test journal", "ro-testRoJournal")
+        journal_config = dict(ro_config, manifestJournal=True)
+        romd  = ro_metadata.ro_metadata(journal_config, rodir)
+        romd.addSimpleAnnotation(".", "type", "Research Object")
+        manifestfile = romd.getManifestFilename()
+        journalfile  = os.path.join(rodir, ro_settings.MANIFEST_DIR, ro_settings.MANIFEST_JOURNAL)
+        self.assertTrue(os.path.exists(journalfile))
+        self.assertEqual(os.path.getsize(journalfile), 0)
+        manifestdata = open(manifestfile).read()
+        # Subsequent updates are appended to the journal
+        romd.addSimpleAnnotation(".", "note", "Research object for journal testing")
+        romd.replaceSimpleAnnotation(".", "title", "Replacement title")
+        romd.removeSimpleAnnotation(".", "type", "Research Object")
+        self.assertEqual(open(manifestfile).read(), manifestdata)
+        self.assertNotEqual(os.path.getsize(journalfile), 0)
+        def checkAnnotations(romd):
+            rouri = romd.getRoUri()
+            annotations = list(romd.getRoAnnotations())
+            self.assertIn((rouri, ROTERMS.note,  rdflib.Literal('Research object for journal testing')), annotations)
+            self.assertIn((rouri, DCTERMS.title, rdflib.Literal('Replacement title')), annotations)
+            self.assertNotIn((rouri, DCTERMS.title, rdflib.Literal('RO test journal')), annotations)
+            self.assertNotIn((rouri, DCTERMS.type, rdflib.Literal('Research Object')), annotations)
+            return
+        # New instance replays journal over manifest
+        romd2 = ro_metadata.ro_metadata(ro_config, rodir)
+        self.assertEqual(len(romd2.getManifestGraph()), len(romd.getManifestGraph()))
+        checkAnnotations(romd2)
+        # Compaction folds journal into manifest
+        journalrecords = len(open(journalfile).readlines())
+        self.assertEqual(romd2.compactManifest(), journalrecords)
+        self.assertEqual(os.path.getsize(journalfile), 0)
+        self.assertNotEqual(open(manifestfile).read(), manifestdata)
+        romd3 = ro_metadata.ro_metadata(ro_config, rodir)
+        self.assertEqual(len(romd3.getManifestGraph()), len(romd.getManifestGraph()))
+        checkAnnotations(romd3)
+        self.deleteTestRo(rodir)
+        return
+
+    def testManifestJournalLimit(self):
+        """
+        Test manifest journal folded into manifest when size limit is exceeded
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test journal", "ro-testRoJournal")
+        journal_config = dict(ro_config, manifestJournal=True, manifestJournalLimit=100)
+        romd  = ro_metadata.ro_metadata(journal_config, rodir)
+        romd.addAggregatedResources(rodir, recurse=True)
+        journalfile  = os.path.join(rodir, ro_settings.MANIFEST_DIR, ro_settings.MANIFEST_JOURNAL)
+        self.assertEqual(os.path.getsize(journalfile), 0)
+        romd.addSimpleAnnotation(".", "note", "Research object for journal testing")
+        self.assertEqual(os.path.getsize(journalfile), 0)
+        romd2 = ro_metadata.ro_metadata(ro_config, rodir)
+        self.assertEqual(len(romd2.getManifestGraph()), len(romd.getManifestGraph()))
+        rouri = romd2.getRoUri()
+        self.assertIn((rouri, ROTERMS.note, rdflib.Literal('Research object for journal testing')),
+            list(romd2.getRoAnnotations()))
+        self.assertEqual(romd2.compactManifest(), 0)
+        self.deleteTestRo(rodir)
+        return
+
+    def testMigrateMetadataFormat(self):
+        """
+        Test conversion of RO metadata to different RDF syntaxes
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test formats", "ro-testRoFormats")
+        romd  = ro_metadata.ro_metadata(ro_config, rodir)
+        annfile1 = romd.addSimpleAnnotation("README-ro-test-1", "type", "Readme")
+        self.assertTrue(annfile1.endswith(".rdf"))
+        manifestfile = romd.getManifestFilename()
+        rouri   = romd.getRoUri()
+        resuri  = romd.getComponentUri("README-ro-test-1")
+        for (format, ext) in [("TURTLE", ".ttl"), ("NT", ".nt"), ("RDFXML", ".rdf")]:
+            converted = romd.migrateMetadataFormat(format)
+            self.assertIn(manifestfile, converted)
+            self.assertEqual(ro_manifest.guessMetadataFormat(manifestfile), format)
+            self.assertEqual(
+                ro_manifest.guessMetadataFormat(os.path.join(rodir, annfile1)), format)
+            romd2 = ro_metadata.ro_metadata(ro_config, rodir)
+            self.assertEqual(romd2.getRoUri(), rouri)
+            self.assertEqual(len(romd2.getManifestGraph()), len(romd.getManifestGraph()))
+            annfile2 = romd2.addSimpleAnnotation("README-ro-test-1", "note", "Note "+format)
+            self.assertTrue(annfile2.endswith(ext))
+            romd3 = ro_metadata.ro_metadata(ro_config, rodir)
+            annotations = list(romd3.getFileAnnotations("README-ro-test-1"))
+            self.assertIn((resuri, DCTERMS.type,  rdflib.Literal("Readme")), annotations)
+            self.assertIn((resuri, ROTERMS.note,  rdflib.Literal("Note "+format)), annotations)
+            self.assertIn((rouri,  DCTERMS.title, rdflib.Literal("RO test formats")),
+                list(romd3.getRoAnnotations()))
+            romd = romd3
+        self.deleteTestRo(rodir)
+        return
+
+    def testCompressedMetadata(self):
+        """
+        Test RO metadata stored compressed, read and updated transparently
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test compressed", "ro-testRoCompressed")
+        romd  = ro_metadata.ro_metadata(ro_config, rodir)
+        annfile1 = romd.addSimpleAnnotation("README-ro-test-1", "type", "Readme")
+        manifestfile = romd.getManifestFilename()
+        annfilename1 = os.path.join(rodir, annfile1)
+        rouri   = romd.getRoUri()
+        resuri  = romd.getComponentUri("README-ro-test-1")
+        converted = romd.migrateMetadataFormat(compression="gzip")
+        self.assertEqual(set(converted), set([manifestfile, annfilename1]))
+        self.assertTrue(os.path.exists(manifestfile+".gz"))
+        self.assertFalse(os.path.exists(manifestfile))
+        self.assertTrue(os.path.exists(annfilename1+".gz"))
+        self.assertFalse(os.path.exists(annfilename1))
+        self.assertEqual(ro_manifest.guessMetadataFormat(annfilename1), "RDFXML")
+        # Compressed metadata is read, and new annotation bodies are compressed
+        romd2 = ro_metadata.ro_metadata(ro_config, rodir)
+        self.assertEqual(romd2.getRoUri(), rouri)
+        self.assertEqual(len(romd2.getManifestGraph()), len(romd.getManifestGraph()))
+        self.assertTrue(romd2.isLiveResource(romd2.getComponentUri(annfile1)))
+        annfile2 = romd2.addSimpleAnnotation("README-ro-test-1", "note", "Compressed note")
+        self.assertTrue(annfile2.endswith(".rdf"))
+        self.assertTrue(os.path.exists(os.path.join(rodir, annfile2)+".gz"))
+        romd3 = ro_metadata.ro_metadata(ro_config, rodir)
+        annotations = list(romd3.getFileAnnotations("README-ro-test-1"))
+        self.assertIn((resuri, DCTERMS.type,  rdflib.Literal("Readme")), annotations)
+        self.assertIn((resuri, ROTERMS.note,  rdflib.Literal("Compressed note")), annotations)
+        self.assertEqual(str(ro_manifest.readManifestHeader(rodir)['rotitle']), "RO test compressed")
+        # Uncompressed RDF/XML is provided for upload
+        data = ro_manifest.readMetadataAsRdfXml(annfilename1, rouri)
+        self.assertEqual(ro_manifest.guessMetadataFormat(annfilename1, data), "RDFXML")
+        self.assertIn("Readme", data)
+        # Migrate back to uncompressed files
+        romd3.migrateMetadataFormat(compression="none")
+        self.assertTrue(os.path.exists(manifestfile))
+        self.assertFalse(os.path.exists(manifestfile+".gz"))
+        self.assertTrue(os.path.exists(os.path.join(rodir, annfile2)))
+        romd4 = ro_metadata.ro_metadata(ro_config, rodir)
+        self.assertEqual(len(list(romd4.getFileAnnotations("README-ro-test-1"))), len(annotations))
+        self.deleteTestRo(rodir)
+        return
+
+    def testAnnotationGraphUpdates(self):
+        """
+        Test annotation dataset updated in place, one named graph per annotation body
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test dataset", "ro-testRoDataset")
+        romd  = ro_metadata.ro_metadata(ro_config, rodir)
+        annfile1 = romd.addSimpleAnnotation("README-ro-test-1", "type", "Readme")
+        anngr = romd.getAnnotationGraph()
+        resuri  = romd.getComponentUri("README-ro-test-1")
+        bodyuri = romd.getComponentUri(annfile1)
+        self.assertIn((resuri, DCTERMS.type, rdflib.Literal("Readme")), anngr)
+        self.assertIn((resuri, DCTERMS.type, rdflib.Literal("Readme")), anngr.get_context(bodyuri))
+        self.assertIn((romd.getRoUri(), DCTERMS.title, rdflib.Literal("RO test dataset")),
+            anngr.get_context(romd.manifesturi))
+        # Add annotation: cached dataset is updated
+        romd.addSimpleAnnotation("README-ro-test-1", "note", "Readme note")
+        romd.replaceSimpleAnnotation(".", "title", "Replacement title")
+        self.assertIs(romd.getAnnotationGraph(), anngr)
+        self.assertIn((resuri, ROTERMS.note, rdflib.Literal("Readme note")), anngr)
+        self.assertIn((romd.getRoUri(), DCTERMS.title, rdflib.Literal("Replacement title")), anngr)
+        self.assertNotIn((romd.getRoUri(), DCTERMS.title, rdflib.Literal("RO test dataset")), anngr)
+        # Remove annotation: body graph is dropped from cached dataset
+        romd.removeSimpleAnnotation("README-ro-test-1", "type", "Readme")
+        self.assertIs(romd.getAnnotationGraph(), anngr)
+        self.assertNotIn((resuri, DCTERMS.type, rdflib.Literal("Readme")), anngr)
+        self.assertEqual(len(anngr.get_context(bodyuri)), 0)
+        self.assertIn((resuri, ROTERMS.note, rdflib.Literal("Readme note")), anngr)
+        # Compare with freshly loaded annotations
+        romd2 = ro_metadata.ro_metadata(ro_config, rodir)
+        def noBNodes(graph):
+            return set([ st for st in graph if not [ n for n in st if isinstance(n, rdflib.BNode) ] ])
+        self.assertEqual(noBNodes(romd2.getAnnotationGraph()), noBNodes(anngr))
+        self.deleteTestRo(rodir)
+        return
+
+    def testSharedSimpleAnnotation(self):
+        """
+        Test annotation of several resources using a single shared annotation body
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test shared annotation", "ro-testRoSharedAnn")
+        romd  = ro_metadata.ro_metadata(ro_config, rodir)
+        rofiles = ["README-ro-test-1", "subdir1/subdir1-file.txt", "subdir2/subdir2-file.txt"]
+        annfile = romd.addSharedSimpleAnnotation(rofiles, "type", "Shared type")
+        bodyuri = romd.getComponentUri(annfile)
+        manifest = romd.getManifestGraph()
+        self.assertEqual(len(list(manifest.subjects(AO.body, bodyuri))), 3)
+        self.assertIn((romd.getRoUri(), ORE.aggregates, bodyuri), manifest)
+        anngr = romd.getAnnotationGraph()
+        for rofile in rofiles:
+            resuri = romd.getComponentUri(rofile)
+            self.assertIn((resuri, DCTERMS.type, rdflib.Literal("Shared type")), anngr)
+        # Removing annotation for one resource leaves the others
+        romd.removeSimpleAnnotation("README-ro-test-1", "type", "Shared type")
+        readmeuri = romd.getComponentUri("README-ro-test-1")
+        for romd2 in [romd, ro_metadata.ro_metadata(ro_config, rodir)]:
+            anngr    = romd2.getAnnotationGraph()
+            manifest = romd2.getManifestGraph()
+            self.assertNotIn((readmeuri, DCTERMS.type, rdflib.Literal("Shared type")), anngr)
+            self.assertNotIn((None, RO.annotatesAggregatedResource, readmeuri), manifest)
+            for rofile in rofiles[1:]:
+                resuri = romd2.getComponentUri(rofile)
+                self.assertIn((resuri, DCTERMS.type, rdflib.Literal("Shared type")), anngr)
+            self.assertNotIn((None, AO.body, bodyuri), manifest)
+            self.assertNotIn((romd2.getRoUri(), ORE.aggregates, bodyuri), manifest)
+            self.assertEqual(len(list(manifest.subjects(RO.annotatesAggregatedResource, None))), 3)
+        # Removing the remaining statements removes the annotations
+        romd.removeSimpleAnnotation("subdir1/subdir1-file.txt", "type", "Shared type")
+        romd.removeSimpleAnnotation("subdir2/subdir2-file.txt", "type", "Shared type")
+        romd2 = ro_metadata.ro_metadata(ro_config, rodir)
+        self.assertNotIn((None, DCTERMS.type, rdflib.Literal("Shared type")), romd2.getAnnotationGraph())
+        self.assertEqual(len(list(romd2.getManifestGraph().subjects(RO.annotatesAggregatedResource, None))), 1)
+        self.deleteTestRo(rodir)
+        return
+
+    def testZipRo(self):
+        """
+        Test read-only access to RO in a zip file, without extracting the zip file contents
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test zip", "ro-testRoZip")
+        romd  = ro_metadata.ro_metadata(ro_config, rodir)
+        romd.addAggregatedResources(rodir, recurse=True)
+        romd.addSimpleAnnotation("subdir1/subdir1-file.txt", "type", "Subdir file")
+        zipname = rodir.rstrip("/")+".zip"
+        with zipfile.ZipFile(zipname, "w") as z:
+            for (dirpath, dirnames, filenames) in os.walk(rodir):
+                for f in filenames:
+                    path = os.path.join(dirpath, f)
+                    z.write(path, "packaged/"+os.path.relpath(path, rodir))
+        self.deleteTestRo(rodir)
+        romz  = ro_metadata.ro_metadata(ro_config, zipname)
+        self.assertEqual(str(romz.getRoUri()),
+            ro_uriutils.resolveFileAsUri(zipname)+"/packaged/")
+        self.assertEqual(
+            set([ str(romz.getComponentUriRel(r)) for r in romz.getAggregatedResources() ]),
+            set([ str(romd.getComponentUriRel(r)) for r in romd.getAggregatedResources() ]))
+        resuri = romz.getComponentUri("subdir1/subdir1-file.txt")
+        self.assertIn((resuri, DCTERMS.type, rdflib.Literal("Subdir file")),
+            list(romz.getFileAnnotations("subdir1/subdir1-file.txt")))
+        self.assertIn((romz.getRoUri(), DCTERMS.title, rdflib.Literal("RO test zip")),
+            list(romz.getRoAnnotations()))
+        self.assertTrue(romz.isLiveResource(resuri))
+        self.assertTrue(romz.isLiveResource(romz.getComponentUri("subdir1/")))
+        self.assertFalse(romz.isLiveResource(romz.getComponentUri("subdir1/nofile.txt")))
+        self.assertTrue(romz.readZipResource(resuri).startswith("Lorem ipsum"))
+        self.assertFalse(os.path.exists(rodir))
+        self.assertRaises(IOError, romz.addSimpleAnnotation, "subdir1", "type", "Dir")
+        os.remove(zipname)
+        return
+
+    def testZipRoCompressed(self):
+        """
+        Test read-only access to RO in a zip file, with RO metadata stored compressed
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test zip", "ro-testRoZip")
+        romd  = ro_metadata.ro_metadata(ro_config, rodir)
+        romd.addAggregatedResources(rodir, recurse=True)
+        annfile = romd.addSimpleAnnotation("subdir1/subdir1-file.txt", "type", "Subdir file")
+        romd.migrateMetadataFormat(compression="gzip")
+        self.assertTrue(os.path.exists(os.path.join(rodir, annfile)+".gz"))
+        zipname = rodir.rstrip("/")+".zip"
+        with zipfile.ZipFile(zipname, "w") as z:
+            for (dirpath, dirnames, filenames) in os.walk(rodir):
+                for f in filenames:
+                    path = os.path.join(dirpath, f)
+                    z.write(path, "packaged/"+os.path.relpath(path, rodir))
+        self.deleteTestRo(rodir)
+        romz  = ro_metadata.ro_metadata(ro_config, zipname)
+        self.assertEqual(str(romz.getRoUri()),
+            ro_uriutils.resolveFileAsUri(zipname)+"/packaged/")
+        self.assertEqual(
+            set([ str(romz.getComponentUriRel(r)) for r in romz.getAggregatedResources() ]),
+            set([ str(romd.getComponentUriRel(r)) for r in romd.getAggregatedResources() ]))
+        resuri = romz.getComponentUri("subdir1/subdir1-file.txt")
+        self.assertIn((resuri, DCTERMS.type, rdflib.Literal("Subdir file")),
+            list(romz.getFileAnnotations("subdir1/subdir1-file.txt")))
+        annuri = romz.getComponentUri(annfile)
+        self.assertTrue(romz.isLiveResource(annuri))
+        self.assertIn("Subdir file", romz.readZipResource(annuri))
+        os.remove(zipname)
+        return
+
+    def testCompactAnnotations(self):
+        """
+        Test annotation bodies merged into one body for each annotated resource
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test compact annotations", "ro-testRoCompactAnn")
+        romd  = ro_metadata.ro_metadata(ro_config, rodir)
+        annfiles = (
+            [ romd.addSimpleAnnotation("README-ro-test-1", "type",        "Readme")
+            , romd.addSimpleAnnotation("README-ro-test-1", "description", "Readme file")
+            , romd.addSimpleAnnotation("README-ro-test-1", "note",        "Readme note")
+            , romd.addSimpleAnnotation("subdir1/subdir1-file.txt", "type", "Subdir file")
+            , romd.addSimpleAnnotation("subdir1/subdir1-file.txt", "note", "Subdir note")
+            , romd.addSimpleAnnotation("subdir2/subdir2-file.txt", "type", "Other file")
+            ])
+        # Names are allocated from a persisted counter
+        self.assertEqual(len(set(annfiles)), 6)
+        self.assertTrue(os.path.exists(os.path.join(rodir, ro_settings.MANIFEST_DIR, ro_settings.ANNOTATION_COUNTER)))
+        (merged, created) = romd.compactAnnotations()
+        self.assertEqual((merged, created), (5, 2))
+        for annfile in annfiles[:5]:
+            self.assertFalse(os.path.exists(os.path.join(rodir, annfile)))
+        self.assertTrue(os.path.exists(os.path.join(rodir, annfiles[5])))
+        # Annotations are preserved, with one annotation for each consolidated body
+        romd2 = ro_metadata.ro_metadata(ro_config, rodir)
+        resuri = romd2.getComponentUri("README-ro-test-1")
+        self.assertEqual(
+            set(romd2.getFileAnnotations("README-ro-test-1")),
+            set([ (resuri, DCTERMS.type,        rdflib.Literal("Readme"))
+                , (resuri, DCTERMS.description, rdflib.Literal("Readme file"))
+                , (resuri, ROTERMS.note,        rdflib.Literal("Readme note"))
+                ]))
+        manifest = romd2.getManifestGraph()
+        self.assertEqual(len(list(manifest.subjects(RO.annotatesAggregatedResource, resuri))), 1)
+        self.assertEqual(len(list(romd2.getFileAnnotations("subdir1/subdir1-file.txt"))), 2)
+        self.assertEqual(len(list(romd2.getFileAnnotations("subdir2/subdir2-file.txt"))), 1)
+        for bodyuri in set(manifest.objects(predicate=AO.body)) - set([romd2.manifesturi]):
+            self.assertIn((romd2.getRoUri(), ORE.aggregates, bodyuri), manifest)
+        # Shared bodies are not merged into bodies for each resource
+        shared = romd2.addSharedSimpleAnnotation(
+            ["README-ro-test-1", "subdir2/subdir2-file.txt"], "rdfs:comment", "Shared")
+        self.assertEqual(romd2.compactAnnotations(), (0, 0))
+        self.assertTrue(os.path.exists(os.path.join(rodir, shared)))
+        # Merging by date gives one annotation for each resource, sharing the merged body
+        self.assertEqual(romd2.compactAnnotations(bydate=True), (4, 1))
+        self.assertEqual(len(list(romd2.getFileAnnotations("subdir2/subdir2-file.txt"))), 2)
+        manifest = romd2.getManifestGraph()
+        for ann in set(manifest.subjects(predicate=RO.annotatesAggregatedResource)):
+            self.assertEqual(len(list(manifest.objects(ann, RO.annotatesAggregatedResource))), 1)
+        self.assertEqual(len(set(manifest.objects(predicate=AO.body)) - set([romd2.manifesturi])), 1)
+        self.deleteTestRo(rodir)
+        return
+
+    def testCalculateChecksums(self):
+        """
+        Test resource checksums calculated and cached in synchronization registries
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test checksums", "ro-testRoChecksums")
+        romd  = ro_metadata.ro_metadata(ro_config, rodir)
+        files = [ os.path.join(rodir, f) for f in
+                  ["README-ro-test-1", "subdir1/subdir1-file.txt", "subdir2/subdir2-file.txt"] ]
+        def md5(f):
+            return hashlib.md5(open(f, "rb").read()).hexdigest()
+        checksums = romd.calculateChecksums(files)
+        self.assertEqual(checksums, dict( (f, md5(f)) for f in files ))
+        for f in files:
+            self.assertEqual(romd.getRegistries()["%s,checksumcache"%f][-1], md5(f))
+        # Cached value is used while the file is unchanged
+        romd.getRegistries()["%s,checksumcache"%files[0]][-1] = "cached"
+        self.assertEqual(romd.calculateChecksum(files[0]), "cached")
+        # Changed file is read again
+        with open(files[0], "a") as f:
+            f.write("More content\n")
+        self.assertEqual(romd.calculateChecksum(files[0]), md5(files[0]))
+        # Cached values are saved with registries
+        romd.saveRegistries()
+        romd2 = ro_metadata.ro_metadata(ro_config, rodir)
+        romd2.getRegistries()["%s,checksumcache"%files[1]][-1] = "cached"
+        self.assertEqual(romd2.calculateChecksum(files[1]), "cached")
+        # Change of algorithm
+        romd3 = ro_metadata.ro_metadata(dict(ro_config, checksumAlgorithm="sha256"), rodir)
+        self.assertEqual(romd3.calculateChecksum(files[1]),
+            hashlib.sha256(open(files[1], "rb").read()).hexdigest())
+        # Files that cannot be read are reported separately, if requested
+        missing = os.path.join(rodir, "nofile.txt")
+        self.assertRaises(OSError, romd3.calculateChecksums, files+[missing])
+        errors  = {}
+        self.assertEqual(set(romd3.calculateChecksums(files+[missing], errors)), set(files))
+        self.assertEqual(errors.keys(), [missing])
+        self.deleteTestRo(rodir)
+        return
+
+    def testComponentUriCache(self):
+        """
+        Test memoized component URI conversions and directory hints
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test URI cache", "ro-testRoUriCache")
+        romd  = ro_metadata.ro_metadata(ro_config, rodir)
+        rouri = str(romd.getRoUri())
+        self.assertEqual(romd.getComponentUri("subdir1/"), rdflib.URIRef(rouri+"subdir1/"))
+        self.assertEqual(romd.getComponentUri("nodir", isdir=True), rdflib.URIRef(rouri+"nodir/"))
+        self.assertEqual(romd.getComponentUri("subdir1", isdir=False), rdflib.URIRef(rouri+"subdir1"))
+        self.assertEqual(romd.getComponentUriRel(rouri+"subdir1/file.txt"), rdflib.URIRef("subdir1/file.txt"))
+        self.assertEqual(romd.getComponentUriRel("http://example.org/x"), rdflib.URIRef("http://example.org/x"))
+        self.assertTrue(romd.isRoMetadataRef(rouri+".ro/manifest.rdf"))
+        self.assertFalse(romd.isRoMetadataRef(rouri+"subdir1/"))
+        # Repeated conversions are served from the cache without touching the file system
+        def nostat(path):
+            raise AssertionError("Unexpected file system access: %s"%(path))
+        fileuri = romd.getComponentUri("subdir2/subdir2-file.txt")
+        isdir = os.path.isdir
+        os.path.isdir = nostat
+        try:
+            self.assertEqual(romd.getComponentUri("subdir2/subdir2-file.txt"), fileuri)
+            self.assertEqual(romd.getComponentUri("newdir/", isdir=None), rdflib.URIRef(rouri+"newdir/"))
+        finally:
+            os.path.isdir = isdir
+        # Change of RO URI discards cached values
+        romd.rouri = rdflib.URIRef("http://example.org/ro/")
+        self.assertEqual(romd.getComponentUriAbs("a/b"), rdflib.URIRef("http://example.org/ro/a/b"))
+        self.assertFalse(romd.isRoMetadataRef(rouri+".ro/manifest.rdf"))
+        # Cache may be shared by several threads
+        cache  = ro_uriutils.UriCache(8)
+        errors = []
+        def useCache(n):
+            try:
+                for i in range(2000):
+                    key = (n*i) % 13
+                    self.assertEqual(cache.get(key, lambda: str(key)), str(key))
+                    cache.put(key+13, str(key))
+                    cache.lookup(key+13)
+                    cache.discard(key)
+            except Exception as e:
+                errors.append(e)
+            return
+        threads = [ threading.Thread(target=useCache, args=(n,)) for n in range(1, 9) ]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self.assertEqual(errors, [])
+        self.assertTrue(len(cache.cache) <= 8)
+        self.deleteTestRo(rodir)
+        return
+
+    def testManifestBodyNotReread(self):
+        """
+        Test manifest graph is reused when the manifest is also an annotation body
+        """
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test manifest body", "ro-testRoManifestBody")
+        romd  = ro_metadata.ro_metadata(ro_config, rodir)
+        romd.addSimpleAnnotation("README-ro-test-1", "title", "Readme title")
+        romd  = ro_metadata.ro_metadata(ro_config, rodir)
+        bodyrefs = []
+        readAnnotationBody = romd._readAnnotationBody
+        def readBody(aref, anngr=None):
+            bodyrefs.append(str(aref))
+            return readAnnotationBody(aref, anngr)
+        romd._readAnnotationBody = readBody
+        anngr = romd._loadAnnotations()
+        self.assertEqual(len(bodyrefs), 1)
+        self.assertNotIn(ro_settings.MANIFEST_DIR+"/"+ro_settings.MANIFEST_FILE, bodyrefs)
+        manifestctx = anngr.get_context(romd.manifesturi)
+        self.assertEqual(len(manifestctx), len(romd.getManifestGraph()))
+        self.assertIn((romd.getRoUri(), RDF.type, RO.ResearchObject), anngr)
+        self.deleteTestRo(rodir)
+        return
+
     def testQueryAnnotations(self):
         rodir = self.createTestRo(testbase, "data/ro-test-1",
             "Test query annotations", "ro-testRoAnnotate")
@@ -834,7 +1368,21 @@ def getTestSuite(select="unit"):
             , "testGetComponentUriRelUri"
             , "testAddAggregatedResources"
             , "testAddAggregatedResourcesWithDirs"
+            , "testAddAggregatedResourcesBulk"
+            , "testAddAggregatedResourcesIncremental"
             , "testGetAggregatedResources"
+            , "testManifestJournal"
+            , "testManifestJournalLimit"
+            , "testMigrateMetadataFormat"
+            , "testCompressedMetadata"
+            , "testAnnotationGraphUpdates"
+            , "testCalculateChecksums"
+            , "testComponentUriCache"
+            , "testZipRo"
+            , "testZipRoCompressed"
+            , "testCompactAnnotations"
+            , "testSharedSimpleAnnotation"
+            , "testManifestBodyNotReread"
             ],
         "component":
             [ "testComponents"
@@ -10,6 +10,7 @@ __license__     = "MIT (http://opensource.org/licenses/MIT)"
 
 import sys
 import urlparse
+import StringIO
 from compiler.ast import Assert
 if __name__ == "__main__":
     # Add main project directory and ro manager directories at start of python path
@@ -20,15 +21,20 @@ import logging
 import os.path
 import rdflib
 import time
+import random
+import threading
 from MiscUtils import TestUtils
 from rocommand import ro_annotation
 from rocommand.test import TestROSupport
+from StdoutContext import SwitchStdout
 from rocommand.test.TestConfig import ro_test_config
 from rocommand.ro_metadata import ro_metadata
 from rocommand.ro_remote_metadata import ro_remote_metadata, createRO, deleteRO, sendZipRO
+from rocommand.ro_remote_metadata import ROSRS_Error
 from rocommand import ro_rosrs_sync
-from rocommand.ro_namespaces import ROTERMS
+from rocommand.ro_namespaces import ROTERMS, RO
 from rocommand.ROSRS_Session import ROSRS_Session
+from rocommand import ro_command
 
 # Local ro_config for testing
 ro_config = {
@@ -43,6 +49,84 @@ log = logging.getLogger(__name__)
 # Base directory for RO tests in this module
 testbase = os.path.dirname(os.path.abspath(__file__))
 
+class DelayedRemoteRo(object):
+    """
+    Stand-in for a remote RO, initially empty, that accepts uploaded resources
+    after a random delay, and records the number of concurrent uploads.
+    Resources are given an ETag based on the resource path and number of
+    times uploaded, unless set in etags.  HEAD requests are counted, and
+    conditional updates are supported.  Annotations are recorded in annotations,
+    and annotation updates are counted.
+    """
+
+    def __init__(self):
+        self.lock      = threading.Lock()
+        self.active    = 0
+        self.maxactive = 0
+        self.uploaded  = {}
+        self.etags     = {}
+        self.heads     = 0
+        self.annotations = {}
+        self.annupdates  = 0
+        return
+
+    def isAggregatedResource(self, respath):
+        return str(respath) in self.uploaded
+
+    def getHead(self, respath):
+        with self.lock:
+            self.heads += 1
+        return (200, "OK", {"etag": self.etags[str(respath)]})
+
+    def updateResourceInt(self, respath, ctype, body, etag=None):
+        if etag and etag != self.etags[str(respath)]:
+            return (412, "Precondition Failed", {}, respath)
+        (status, reason, headers, respath) = self.aggregateResourceInt(respath, ctype, body)
+        return (200, "OK", headers, respath)
+
+    def aggregateResourceInt(self, respath, ctype, body):
+        with self.lock:
+            self.active   += 1
+            self.maxactive = max(self.active, self.maxactive)
+        time.sleep(random.random()*0.02)
+        data = body if isinstance(body, basestring) else body.read()
+        with self.lock:
+            self.active -= 1
+            self.uploaded[str(respath)] = data
+            version = int(self.etags.get(str(respath), '"0"').strip('"').split("/")[-1]) + 1
+            self.etags[str(respath)] = '"%s/%d"'%(respath, version)
+        return (201, "Created", {"etag": self.etags[str(respath)]}, respath)
+
+    def isAnnotationNode(self, respath):
+        return str(respath) in self.annotations
+
+    def targets(self, targetpath):
+        if isinstance(targetpath, list):
+            return tuple( str(t) for t in targetpath )
+        return str(targetpath)
+
+    def addAnnotationNode(self, bodypath, targetpath):
+        annpath = "annotations/%d"%(len(self.annotations)+1)
+        self.annotations[annpath] = (str(bodypath), self.targets(targetpath))
+        return (201, "Created", rdflib.URIRef(annpath))
+
+    def updateAnnotationNode(self, annpath, bodypath, targetpath):
+        self.annotations[str(annpath)] = (str(bodypath), self.targets(targetpath))
+        self.annupdates += 1
+        return (200, "OK")
+
+    def getComponentUriRel(self, uri):
+        return rdflib.URIRef(uri)
+
+    def getAggregatedResources(self):
+        return []
+
+    def getAllAnnotationNodes(self):
+        return []
+
+    def reloadManifest(self):
+        return
+
 class TestRosrsSync(TestROSupport.TestROSupport):
     
 
@@ -65,6 +149,243 @@ class TestRosrsSync(TestROSupport.TestROSupport):
     def testNull(self):
         assert True, 'Null test failed'
         
+    def testPushConcurrent(self):
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test push", "ro-testRoPush")
+        localRo  = ro_metadata(ro_config, rodir)
+        localRo.addAggregatedResources(rodir, recurse=True)
+        results = {}
+        for workers in [1, 4]:
+            remoteRo = DelayedRemoteRo()
+            localRo.getRegistries().clear()
+            actions = list(ro_rosrs_sync.pushResearchObject(localRo, remoteRo, workers=workers))
+            results[workers] = [ (a, str(u)) for (a, u) in actions if a != ro_rosrs_sync.ACTION_ERROR ]
+            uploaded = [ u for (a, u) in results[workers] if a == ro_rosrs_sync.ACTION_AGGREGATE_INTERNAL ]
+            self.assertIn("subdir1/subdir1-file.txt", uploaded)
+            self.assertEqual(sorted(uploaded), sorted(remoteRo.uploaded.keys()))
+            self.assertEqual(remoteRo.uploaded["README-ro-test-1"],
+                open(os.path.join(rodir, "README-ro-test-1")).read())
+            filename = os.path.join(rodir, "subdir1/subdir1-file.txt")
+            self.assertEqual(localRo.getRegistries()["%s,etag"%filename], '"subdir1/subdir1-file.txt/1"')
+            self.assertTrue(localRo.getRegistries()["%s,checksum"%filename])
+        # Same results whether or not uploads are concurrent (the order of resources
+        # in the manifest graph is not fixed, so is not compared)
+        self.assertEqual(sorted(results[1]), sorted(results[4]))
+        self.assertEqual(len(results[4]), len(set(results[4])))
+        self.assertTrue(remoteRo.maxactive > 1)
+        self.deleteTestRo(rodir)
+        return
+
+    def testPushUnreadableFile(self):
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test push", "ro-testRoPush")
+        localRo  = ro_metadata(ro_config, rodir)
+        localRo.addAggregatedResources(rodir, recurse=True)
+        remoteRo = DelayedRemoteRo()
+        filename = os.path.join(rodir, "subdir1/subdir1-file.txt")
+        checksummodule = sys.modules[ro_metadata.__module__].ro_checksum
+        calculateChecksum = checksummodule.calculateChecksum
+        def failingChecksum(f, algorithm="md5"):
+            if f == filename:
+                raise IOError(13, "Permission denied", f)
+            return calculateChecksum(f, algorithm)
+        checksummodule.calculateChecksum = failingChecksum
+        try:
+            actions = list(ro_rosrs_sync.pushResearchObject(localRo, remoteRo))
+        finally:
+            checksummodule.calculateChecksum = calculateChecksum
+        # Only the resource that cannot be read is not pushed
+        errors = [ u for (a, u) in actions if a == ro_rosrs_sync.ACTION_ERROR ]
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], IOError)
+        self.assertNotIn("subdir1/subdir1-file.txt", remoteRo.uploaded)
+        self.assertIn("subdir2/subdir2-file.txt", remoteRo.uploaded)
+        self.deleteTestRo(rodir)
+        return
+
+    def testPushPlan(self):
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test push", "ro-testRoPush")
+        localRo  = ro_metadata(ro_config, rodir)
+        localRo.addAggregatedResources(rodir, recurse=True)
+        remoteRo = DelayedRemoteRo()
+        resourceActions = (
+            [ ro_rosrs_sync.ACTION_AGGREGATE_INTERNAL, ro_rosrs_sync.ACTION_UPDATE_OVERWRITE
+            , ro_rosrs_sync.ACTION_UPDATE, ro_rosrs_sync.ACTION_SKIP
+            ])
+        def push(dryrun):
+            return [ (a, str(u)) for (a, u) in
+                     ro_rosrs_sync.pushResearchObject(localRo, remoteRo, dryrun=dryrun)
+                     if a in resourceActions ]
+        # Plan is displayed without uploading anything, and matches the push
+        plan = push(dryrun=True)
+        self.assertIn((ro_rosrs_sync.ACTION_AGGREGATE_INTERNAL, "README-ro-test-1"), plan)
+        self.assertEqual(remoteRo.uploaded, {})
+        self.assertEqual(push(dryrun=False), plan)
+        # Nothing changed: all resources skipped
+        plan = push(dryrun=True)
+        self.assertEqual(set(a for (a, u) in plan), set([ro_rosrs_sync.ACTION_SKIP]))
+        # Changed locally and in ROSRS
+        with open(os.path.join(rodir, "README-ro-test-1"), "a") as f:
+            f.write("Updated\n")
+        remoteRo.etags["subdir1/subdir1-file.txt"] = '"changed/1"'
+        plan = push(dryrun=True)
+        self.assertIn((ro_rosrs_sync.ACTION_UPDATE, "README-ro-test-1"), plan)
+        self.assertIn((ro_rosrs_sync.ACTION_UPDATE_OVERWRITE, "subdir1/subdir1-file.txt"), plan)
+        self.assertEqual(len([ a for (a, u) in plan if a != ro_rosrs_sync.ACTION_SKIP ]), 2)
+        self.assertEqual(push(dryrun=False), plan)
+        self.assertTrue(remoteRo.uploaded["README-ro-test-1"].endswith("Updated\n"))
+        self.deleteTestRo(rodir)
+        return
+
+    def testPushPlanNewRo(self):
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test push", "ro-testRoPush")
+        localRo  = ro_metadata(ro_config, rodir)
+        localRo.addAggregatedResources(rodir, recurse=True)
+        class HeadSession(object):
+            def __init__(self, status, reason):
+                self.status   = status
+                self.reason   = reason
+                self.requests = []
+            def baseuri(self):
+                return "http://example.org/ROs/"
+            def doRequest(self, uripath, method="GET", **kwargs):
+                self.requests.append((method, uripath))
+                return (self.status, self.reason, {}, None)
+        # RO not in ROSRS: planned against an empty RO, with no further requests
+        rosrs = HeadSession(404, "Not Found")
+        outstr = StringIO.StringIO()
+        with SwitchStdout(outstr):
+            status = ro_command.push_plan(rosrs, ro_config, localRo, "ro-testRoPush", False)
+        self.assertEqual(status, 0)
+        self.assertIn("RO would be created: http://example.org/ROs/ro-testRoPush/", outstr.getvalue())
+        self.assertIn("Resource to upload: README-ro-test-1", outstr.getvalue())
+        self.assertEqual(rosrs.requests, [("HEAD", "http://example.org/ROs/ro-testRoPush/")])
+        remoteRo = ro_remote_metadata(ro_config, rosrs, "http://example.org/ROs/ro-testRoPush", empty=True)
+        self.assertEqual(list(remoteRo.getAggregatedResources()), [])
+        self.assertEqual(list(remoteRo.getAllAnnotationNodes()), [])
+        self.assertEqual(len(rosrs.requests), 1)
+        # Other failures are reported, not taken to mean the RO exists
+        rosrs = HeadSession(500, "Internal Server Error")
+        outstr = StringIO.StringIO()
+        with SwitchStdout(outstr):
+            status = ro_command.push_plan(rosrs, ro_config, localRo, "ro-testRoPush", False)
+        self.assertEqual(status, 2)
+        self.assertIn("Error accessing RO http://example.org/ROs/ro-testRoPush/: 500 Internal Server Error",
+            outstr.getvalue())
+        self.assertNotIn("RO already exists", outstr.getvalue())
+        self.deleteTestRo(rodir)
+        return
+
+    def testPushTrustETags(self):
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test push", "ro-testRoPush")
+        localRo  = ro_metadata(ro_config, rodir)
+        localRo.addAggregatedResources(rodir, recurse=True)
+        remoteRo = DelayedRemoteRo()
+        def push(dryrun, trustetags):
+            return [ (a, str(u)) for (a, u) in
+                     ro_rosrs_sync.pushResearchObject(localRo, remoteRo,
+                        dryrun=dryrun, trustetags=trustetags)
+                     if a != ro_rosrs_sync.ACTION_ERROR ]
+        push(dryrun=False, trustetags=True)
+        resources = len(remoteRo.uploaded)
+        # Without trusting ETags, each resource is checked
+        plan = push(dryrun=True, trustetags=False)
+        self.assertEqual(remoteRo.heads, resources)
+        self.assertEqual(push(dryrun=True, trustetags=True), plan)
+        self.assertEqual(remoteRo.heads, resources)
+        # Change in ROSRS to unchanged resource is not seen
+        remoteRo.etags["subdir1/subdir1-file.txt"] = '"changed/1"'
+        self.assertIn((ro_rosrs_sync.ACTION_SKIP, "subdir1/subdir1-file.txt"),
+            push(dryrun=True, trustetags=True))
+        # Change in ROSRS to changed resource is detected on update
+        with open(os.path.join(rodir, "subdir1/subdir1-file.txt"), "a") as f:
+            f.write("Updated\n")
+        self.assertIn((ro_rosrs_sync.ACTION_UPDATE, "subdir1/subdir1-file.txt"),
+            push(dryrun=True, trustetags=True))
+        self.assertIn((ro_rosrs_sync.ACTION_UPDATE_OVERWRITE, "subdir1/subdir1-file.txt"),
+            push(dryrun=False, trustetags=True))
+        self.assertTrue(remoteRo.uploaded["subdir1/subdir1-file.txt"].endswith("Updated\n"))
+        filename = os.path.join(rodir, "subdir1/subdir1-file.txt")
+        self.assertEqual(localRo.getRegistries()["%s,etag"%filename], '"subdir1/subdir1-file.txt/2"')
+        # Unconditional update of resource changed only locally
+        with open(os.path.join(rodir, "README-ro-test-1"), "a") as f:
+            f.write("Updated\n")
+        self.assertIn((ro_rosrs_sync.ACTION_UPDATE, "README-ro-test-1"),
+            push(dryrun=False, trustetags=True))
+        self.assertEqual(remoteRo.heads, resources)
+        self.deleteTestRo(rodir)
+        return
+
+    def testPushAnnotations(self):
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test push", "ro-testRoPush")
+        localRo  = ro_metadata(ro_config, rodir)
+        localRo.addAggregatedResources(rodir, recurse=True)
+        ann1 = localRo.addSimpleAnnotation("subdir1/subdir1-file.txt", "type", "Test file")
+        ann2 = localRo.addSimpleAnnotation("README-ro-test-1", "description", "Read me")
+        # An annotation of several resources is pushed as one annotation
+        localRo.addSimpleAnnotation("subdir2/subdir2-file.txt", "type", "Test file")
+        node = [ n for (n, b, t) in localRo.getAllAnnotationNodes()
+                 if str(t).endswith("subdir2-file.txt") ][0]
+        localRo._addManifestStmt(
+            (node, RO.annotatesAggregatedResource, localRo.getComponentUri("subdir1/subdir1-file.txt")))
+        localRo._updateManifest()
+        remoteRo = DelayedRemoteRo()
+        def push(dryrun=False):
+            return [ (a, u) for (a, u) in
+                     ro_rosrs_sync.pushResearchObject(localRo, remoteRo, dryrun=dryrun)
+                     if a in ro_rosrs_sync.ANNOTATION_ACTIONS ]
+        pushed = push()
+        added  = [ u for (a, u) in pushed if a == ro_rosrs_sync.ACTION_AGGREGATE_ANNOTATION ]
+        self.assertEqual(len(added), len(remoteRo.annotations))
+        self.assertTrue(len(added) >= 3)
+        self.assertIn(("subdir1/subdir1-file.txt", "subdir2/subdir2-file.txt"),
+            [ t for (b, t) in remoteRo.annotations.values() ])
+        # Unchanged annotations are not pushed again.  (Pushing new annotations changes
+        # the local manifest, which is the body of an annotation, so push it again first.)
+        push()
+        remoteRo.annupdates = 0
+        pushed = push()
+        self.assertEqual(set(a for (a, u) in pushed), set([ro_rosrs_sync.ACTION_SKIP_ANNOTATION]))
+        self.assertEqual(len(pushed), len(added))
+        self.assertEqual(remoteRo.annupdates, 0)
+        # Annotation with changed body is updated, and body uploaded
+        bodyuri = [ b for (n, b, t) in localRo.getAllAnnotationNodes()
+                    if str(t).endswith("README-ro-test-1") ][0]
+        bodypath = str(localRo.getComponentUriRel(bodyuri))
+        with open(os.path.join(rodir, bodypath), "a") as f:
+            f.write("\n")
+        actions = list(ro_rosrs_sync.pushResearchObject(localRo, remoteRo))
+        self.assertIn((ro_rosrs_sync.ACTION_UPDATE, bodypath), [ (a, str(u)) for (a, u) in actions ])
+        updated = [ u for (a, u) in actions if a == ro_rosrs_sync.ACTION_UPDATE_ANNOTATION ]
+        self.assertEqual(len(updated), 1)
+        self.assertEqual(remoteRo.annupdates, 1)
+        self.assertEqual(
+            [ u for (a, u) in actions if a == ro_rosrs_sync.ACTION_UPDATE ], [ rdflib.URIRef(bodypath) ])
+        self.assertEqual(push(dryrun=True),
+            [ (ro_rosrs_sync.ACTION_SKIP_ANNOTATION, u) for (a, u) in pushed ])
+        self.deleteTestRo(rodir)
+        return
+
+    def testPushPrune(self):
+        rodir = self.createTestRo(testbase, "data/ro-test-1", "RO test push", "ro-testRoPush")
+        localRo  = ro_metadata(ro_config, rodir)
+        localRo.addAggregatedResources(rodir, recurse=True)
+        localRo.addSimpleAnnotation("subdir1/subdir1-file.txt", "type", "Test file")
+        localRo.addSimpleAnnotation("README-ro-test-1", "description", "Read me")
+        remoteRo = DelayedRemoteRo()
+        list(ro_rosrs_sync.pushResearchObject(localRo, remoteRo))
+        nodes = [ n for (n, b, t) in localRo.getAllAnnotationNodes() ]
+        self.assertTrue(len(nodes) >= 2)
+        self.assertTrue(all(isinstance(n, rdflib.URIRef) for n in nodes))
+        # As "ro add -a --prune": annotations pushed to ROSRS remain aggregated
+        os.remove(os.path.join(rodir, "subdir2", "subdir2-file.txt"))
+        localRo.addAggregatedResources(rodir, recurse=True)
+        self.assertEqual(localRo.pruneAggregatedResources(rodir), 1)
+        for n in nodes:
+            self.assertTrue(localRo.isAnnotationNode(n))
+        actions = list(ro_rosrs_sync.pushResearchObject(localRo, remoteRo, dryrun=True))
+        self.assertNotIn(ro_rosrs_sync.ACTION_DELETE_ANNOTATION, [ a for (a, u) in actions ])
+        self.deleteTestRo(rodir)
+        return
+
     def testPushZip(self):
         httpsession = ROSRS_Session(ro_test_config.ROSRS_URI,
         accesskey=ro_test_config.ROSRS_ACCESS_TOKEN)
@@ -164,6 +485,13 @@ def getTestSuite(select="unit"):
         "unit":
             [ "testUnits"
             , "testNull"
+            , "testPushConcurrent"
+            , "testPushPlan"
+            , "testPushPlanNewRo"
+            , "testPushTrustETags"
+            , "testPushAnnotations"
+            , "testPushPrune"
+            , "testPushUnreadableFile"
             ],
         "component":
             [ "testComponents"
@@ -27,6 +27,9 @@ if __name__ == '__main__':
 
 from uritemplate import uritemplate
 
+from MiscUtils.HttpSession    import HTTP_Cache, setHttpCache
+
+from rocommand               import ro_settings
 from rocommand.ro_namespaces import RDF, RDFS
 from rocommand.ro_annotation import annotationTypes, annotationPrefixes
 from rocommand.ro_metadata   import ro_metadata
@@ -40,6 +43,10 @@ import TrafficLightReports
 log  = logging.getLogger(__file__)
 here = os.path.dirname(os.path.abspath(__file__))
 
+# Cache RO manifests and annotations read for evaluation, revalidated on each use;
+# the cache is pruned to the default size and age limits of HTTP_Cache
+setHttpCache(HTTP_Cache(os.path.join(os.path.expanduser("~"), ro_settings.HTTP_CACHE_DIR)))
+
 @view_config(route_name='hello', request_method='GET')
 def hello(request):
     #return Response(repr(request.host))